@@ -0,0 +1,133 @@
+"""
+fake_ircd.py
+Minimal IRC server for offline load tests. Speaks just enough of the protocol for
+irc.client (001 welcome, JOIN with NAMES, PRIVMSG, WHO, WHOIS, PING/PONG) and lets the
+harness inject messages from simulated users and observe what the bot says back.
+"""
+import asyncio
+import time
+from shared.logger import setup_logger
+
+logger = setup_logger("bench.fake_ircd")
+
+SERVER_NAME = "fake.ircd"
+
+
+class FakeIRCServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.writer = None
+        self.client_task = None
+        self.nick = None
+        self.channels: set[str] = set()
+        self.users: dict[str, str] = {}  # nick -> hostmask of simulated users
+        self.connected = asyncio.Event()
+        self.on_bot_privmsg = None  # callback(target, text, received_at)
+        self.lines_in = 0
+        self.lines_out = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Fake IRC server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.writer:
+            self.writer.close()
+        if self.client_task:
+            # Let the reader see EOF instead of being cancelled when the loop shuts down.
+            await asyncio.wait([self.client_task], timeout=5)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def add_user(self, nick: str, hostmask: str):
+        self.users[nick] = hostmask
+
+    def send(self, line: str):
+        """Send a raw line to the bot; a no-op until it is registered."""
+        if not self.writer:
+            return
+        self.writer.write(f"{line}\r\n".encode())
+        self.lines_out += 1
+
+    async def flush(self):
+        if self.writer:
+            await self.writer.drain()
+
+    def inject_privmsg(self, hostmask: str, target: str, text: str):
+        self.send(f":{hostmask} PRIVMSG {target} :{text}")
+
+    def inject_join(self, hostmask: str, channel: str):
+        self.send(f":{hostmask} JOIN {channel}")
+
+    async def _client(self, reader, writer):
+        self.writer = writer
+        self.client_task = asyncio.current_task()
+        logger.info("Bot connected to fake IRC server")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                self.lines_in += 1
+                self._handle(raw.decode("utf-8", errors="ignore").rstrip("\r\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            logger.info("Bot disconnected from fake IRC server")
+            self.writer = None
+            self.connected.clear()
+
+    def _handle(self, line: str):
+        received_at = time.perf_counter()
+        if " :" in line:
+            head, trailing = line.split(" :", 1)
+            params = head.split()
+        else:
+            params, trailing = line.split(), None
+        if not params:
+            return
+        cmd = params[0].upper()
+        if cmd == "NICK":
+            self.nick = params[1] if len(params) > 1 else trailing
+        elif cmd == "USER":
+            self.send(f":{SERVER_NAME} 001 {self.nick} :Welcome to the fake network {self.nick}")
+            self.send(f":{SERVER_NAME} 376 {self.nick} :End of /MOTD command.")
+            self.connected.set()
+        elif cmd == "PING":
+            self.send(f":{SERVER_NAME} PONG {SERVER_NAME} :{trailing or (params[1] if len(params) > 1 else '')}")
+        elif cmd == "JOIN":
+            for chan in params[1].split(","):
+                self.channels.add(chan)
+                self.send(f":{self.nick}!bot@fake.host JOIN {chan}")
+                names = " ".join([self.nick] + list(self.users)[:50])
+                self.send(f":{SERVER_NAME} 353 {self.nick} = {chan} :{names}")
+                self.send(f":{SERVER_NAME} 366 {self.nick} {chan} :End of /NAMES list.")
+        elif cmd == "PART":
+            for chan in params[1].split(","):
+                self.channels.discard(chan)
+                self.send(f":{self.nick}!bot@fake.host PART {chan}")
+        elif cmd == "WHO" and len(params) > 1:
+            chan = params[1]
+            for nick in list(self.users)[:50]:
+                user, host = self.users[nick].split("!", 1)[1].split("@", 1)
+                self.send(f":{SERVER_NAME} 352 {self.nick} {chan} {user} {host} {SERVER_NAME} {nick} H :0 Simulated user")
+            self.send(f":{SERVER_NAME} 315 {self.nick} {chan} :End of /WHO list.")
+        elif cmd == "WHOIS":
+            target = params[-1] if len(params) > 1 else trailing
+            hostmask = self.users.get(target)
+            if hostmask:
+                user, host = hostmask.split("!", 1)[1].split("@", 1)
+                self.send(f":{SERVER_NAME} 311 {self.nick} {target} {user} {host} * :Simulated user")
+            else:
+                self.send(f":{SERVER_NAME} 401 {self.nick} {target} :No such nick/channel")
+            self.send(f":{SERVER_NAME} 318 {self.nick} {target} :End of /WHOIS list.")
+        elif cmd == "PRIVMSG" and len(params) > 1:
+            if self.on_bot_privmsg:
+                self.on_bot_privmsg(params[1], trailing or "", received_at)
+        elif cmd == "QUIT":
+            self.send("ERROR :Closing link")
@@ -0,0 +1,344 @@
+"""
+loadtest.py
+End-to-end, fully offline load test of irc_bot + logic_server.
+
+Starts a fake IRC server, runs both processes against a throwaway config and
+database with the stub AI provider, drives N channels x M users at a fixed
+message rate with a mix of chatter, commands and mentions, and reports
+end-to-end latency percentiles, throughput, CPU and RSS of both processes.
+
+    python -m bench.loadtest --channels 5 --users 20 --rate 20 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from bench.fake_ircd import FakeIRCServer
+from shared.logger import setup_logger
+
+logger = setup_logger("bench.loadtest")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_NICK = "LoadBot"
+TOKEN_RE = re.compile(r"lt-(\d+)")
+CHATTER = ["hello there", "anyone around?", "lol", "brb", "that build is green again",
+           "has anyone tried the new release", "coffee time", "ok", "nice", "good morning"]
+# Sent after warm-up by a user with no level; each must be answered "Permission denied"
+INTRUDER = "intruder!i@elsewhere.bench"
+RESTRICTED = ["!Admin profile lag 30", "!ADMIN profile on echo", "!RateLimit set ai user 1000/1"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+class ProcStats:
+    """CPU and RSS sampling from /proc (Linux only; reports None elsewhere)."""
+    CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def __init__(self, name: str, pid: int):
+        self.name = name
+        self.pid = pid
+        self.cpu_start = self._cpu()
+        self.wall_start = time.perf_counter()
+        self.cpu_end = self.cpu_start
+        self.wall_end = self.wall_start
+        self.rss_peak_kb = 0
+        self.rss_last_kb = 0
+
+    def _cpu(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.CLK_TCK
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def _rss_kb(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def sample(self):
+        cpu = self._cpu()
+        if cpu is not None:
+            self.cpu_end = cpu
+            self.wall_end = time.perf_counter()
+        rss = self._rss_kb()
+        if rss is not None:
+            self.rss_last_kb = rss
+            self.rss_peak_kb = max(self.rss_peak_kb, rss)
+
+    def report(self) -> dict:
+        if self.cpu_start is None:
+            return {"cpu_percent": None, "rss_peak_mb": None, "rss_last_mb": None}
+        wall = max(self.wall_end - self.wall_start, 1e-9)
+        return {
+            "cpu_percent": round(100 * (self.cpu_end - self.cpu_start) / wall, 1),
+            "rss_peak_mb": round(self.rss_peak_kb / 1024, 1),
+            "rss_last_mb": round(self.rss_last_kb / 1024, 1),
+        }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.ircd = FakeIRCServer()
+        self.workdir = tempfile.mkdtemp(prefix="lolo-bench-")
+        self.channels = [f"#load{i}" for i in range(args.channels)]
+        self.users = [(f"user{i}", f"user{i}!u{i}@sim{i % 7}.bench") for i in range(args.users)]
+        self.procs: dict[str, subprocess.Popen] = {}
+        self.pending: dict[int, tuple[str, float]] = {}  # token -> (kind, sent_at)
+        self.latencies: dict[str, list[float]] = {"command": [], "mention": []}
+        self.sent = {"chatter": 0, "command": 0, "mention": 0}
+        self.next_token = 0
+        self.warm = asyncio.Event()
+        self.denied = asyncio.Event()
+
+    def write_config(self) -> str:
+        conf = {
+            "BOT_NICK": BOT_NICK,
+            "IRC_SERVER": "127.0.0.1",
+            "IRC_PORT": self.ircd.port,
+            "IRC_CHANNEL": self.channels[0],
+            "IRC_AUTOCHANNELS": self.channels[1:],
+            "LOGIC_SERVER_HOST": "127.0.0.1",
+            "LOGIC_SERVER_PORT": free_port(),
+            "DATABASE_FILE": os.path.join(self.workdir, "bench.db"),
+            "SPOOL_DIR": os.path.join(self.workdir, "spool"),
+            "AI_PROVIDER": "stub",
+            "AI_STUB_LATENCY": self.args.ai_latency,
+            "AI_STUB_TOOL_LATENCY": self.args.tool_latency,
+            "TRACE_SAMPLE_RATE": self.args.trace_rate,
+            "TRACE_DIR": os.path.join(self.workdir, "traces"),
+        }
+        path = os.path.join(self.workdir, "config.json")
+        with open(path, "w") as f:
+            json.dump(conf, f, indent=2)
+        self.ws_port = conf["LOGIC_SERVER_PORT"]
+        return path
+
+    def spawn(self, name: str, args: list[str], env: dict) -> subprocess.Popen:
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        proc = subprocess.Popen([sys.executable] + args, cwd=REPO_ROOT, env=env,
+                                stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        self.procs[name] = proc
+        return proc
+
+    async def wait_port(self, port: int, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"Port {port} did not open within {timeout}s (see logs in {self.workdir})")
+
+    def on_bot_privmsg(self, target: str, text: str, received_at: float):
+        if text.startswith("lt-warmup"):
+            self.warm.set()
+            return
+        if text == "Permission denied":
+            self.denied.set()
+            return
+        m = TOKEN_RE.search(text)
+        if not m:
+            return
+        info = self.pending.pop(int(m.group(1)), None)
+        if info:
+            kind, sent_at = info
+            self.latencies[kind].append(received_at - sent_at)
+
+    async def start_stack(self):
+        await self.ircd.start()
+        for nick, hostmask in self.users:
+            self.ircd.add_user(nick, hostmask)
+        self.ircd.on_bot_privmsg = self.on_bot_privmsg
+        env = dict(os.environ, LOLO_CONFIG=self.write_config(), PYTHONUNBUFFERED="1")
+        seed = ("import logic_server.db as db; db.init_db(); "
+                "db.add_user('owner!o@bench', 'owner', 'Owner'); db.close_db()")
+        subprocess.run([sys.executable, "-c", seed], cwd=REPO_ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.spawn("logic_server", ["-m", "logic_server"], env)
+        await self.wait_port(self.ws_port)
+        self.spawn("irc_bot", ["-m", "irc_bot"], env)
+        await asyncio.wait_for(self.ircd.connected.wait(), 30)
+        for _ in range(60):
+            self.ircd.inject_privmsg(self.users[0][1], self.channels[0], "!echo lt-warmup")
+            try:
+                await asyncio.wait_for(self.warm.wait(), 1)
+                break
+            except asyncio.TimeoutError:
+                continue
+        else:
+            raise RuntimeError(f"Bot never answered the warm-up command (see logs in {self.workdir})")
+        await self.check_permissions()
+        logger.info(f"Stack is up (workdir {self.workdir})")
+
+    async def check_permissions(self):
+        for text in RESTRICTED:
+            self.denied.clear()
+            self.ircd.inject_privmsg(INTRUDER, self.channels[0], text)
+            await self.ircd.flush()
+            try:
+                await asyncio.wait_for(self.denied.wait(), 10)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"'{text}' from an unregistered user was not refused (see logs in {self.workdir})")
+
+    def pick_kind(self) -> str:
+        r = random.random()
+        if r < self.args.mention_ratio:
+            return "mention"
+        if r < self.args.mention_ratio + self.args.command_ratio:
+            return "command"
+        return "chatter"
+
+    def send_one(self):
+        channel = random.choice(self.channels)
+        _, hostmask = random.choice(self.users)
+        kind = self.pick_kind()
+        if kind == "chatter":
+            text = random.choice(CHATTER)
+        else:
+            token = self.next_token
+            self.next_token += 1
+            if kind == "command":
+                text = f"!echo lt-{token}"
+            elif random.random() < 0.5:
+                text = f"{BOT_NICK}: what is the price of lt-{token}?"
+            else:
+                text = f"{BOT_NICK}: tell me about lt-{token}"
+            self.pending[token] = (kind, time.perf_counter())
+        self.sent[kind] += 1
+        self.ircd.inject_privmsg(hostmask, channel, text)
+
+    async def drive(self):
+        interval = 1.0 / self.args.rate
+        start = time.perf_counter()
+        next_at = start
+        end = start + self.args.duration
+        while next_at < end:
+            now = time.perf_counter()
+            while next_at <= now and next_at < end:
+                self.send_one()
+                next_at += interval
+            await self.ircd.flush()
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        drain_end = time.perf_counter() + self.args.drain
+        while self.pending and time.perf_counter() < drain_end:
+            await asyncio.sleep(0.1)
+        return time.perf_counter() - start
+
+    async def sample_procs(self, stats: list[ProcStats]):
+        while True:
+            for s in stats:
+                s.sample()
+            await asyncio.sleep(0.5)
+
+    def stop_stack(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    async def run(self) -> dict:
+        try:
+            await self.start_stack()
+            stats = [ProcStats(name, p.pid) for name, p in self.procs.items()]
+            sampler = asyncio.create_task(self.sample_procs(stats))
+            elapsed = await self.drive()
+            sampler.cancel()
+            for s in stats:
+                s.sample()
+            return self.report(elapsed, stats)
+        finally:
+            self.stop_stack()
+            await self.ircd.stop()
+
+    def report(self, elapsed: float, stats: list[ProcStats]) -> dict:
+        answered = sum(len(v) for v in self.latencies.values())
+        result = {
+            "config": vars(self.args),
+            "elapsed_s": round(elapsed, 2),
+            "sent": self.sent,
+            "answered": answered,
+            "unanswered": len(self.pending),
+            "throughput_msgs_per_s": round(sum(self.sent.values()) / elapsed, 2),
+            "throughput_replies_per_s": round(answered / elapsed, 2),
+            "latency_ms": {},
+            "processes": {s.name: s.report() for s in stats},
+            "workdir": self.workdir,
+        }
+        for kind, values in self.latencies.items():
+            result["latency_ms"][kind] = {
+                "count": len(values),
+                **{f"p{p}": round(percentile(values, p) * 1000, 1) for p in (50, 90, 99)},
+                "max": round(max(values) * 1000, 1) if values else 0.0,
+            }
+        return result
+
+
+def print_report(r: dict):
+    print(f"\nElapsed {r['elapsed_s']}s | sent {r['sent']} | answered {r['answered']} | unanswered {r['unanswered']}")
+    print(f"Throughput: {r['throughput_msgs_per_s']} msgs/s in, {r['throughput_replies_per_s']} replies/s out")
+    for kind, lat in r["latency_ms"].items():
+        print(f"{kind:>8} latency ms: n={lat['count']} p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+    for name, p in r["processes"].items():
+        print(f"{name:>13}: cpu {p['cpu_percent']}% rss peak {p['rss_peak_mb']} MB (last {p['rss_last_mb']} MB)")
+    print(f"Logs: {r['workdir']}")
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Offline end-to-end load test for irc_bot + logic_server")
+    ap.add_argument("--channels", type=int, default=3)
+    ap.add_argument("--users", type=int, default=20, help="simulated users (spread over all channels)")
+    ap.add_argument("--rate", type=float, default=10, help="total messages per second")
+    ap.add_argument("--duration", type=float, default=20, help="seconds of traffic")
+    ap.add_argument("--drain", type=float, default=30, help="seconds to wait for outstanding replies")
+    ap.add_argument("--command-ratio", type=float, default=0.2)
+    ap.add_argument("--mention-ratio", type=float, default=0.05)
+    ap.add_argument("--ai-latency", type=float, default=0.5, help="stub AI latency in seconds")
+    ap.add_argument("--tool-latency", type=float, default=0.3, help="extra stub latency for tool-like prompts")
+    ap.add_argument("--trace-rate", type=float, default=0, help="TRACE_SAMPLE_RATE for both processes")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json", help="also write the report to this file")
+    return ap.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    result = asyncio.run(LoadTest(args).run())
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
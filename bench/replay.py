@@ -0,0 +1,234 @@
+"""
+replay.py
+Replays real traffic from a Log table (bot_log.db, or bot.db from before the log split)
+through the logic server and records per-line latency and which code path fired, as a
+reproducible regression benchmark.
+
+    python -m bench.replay --db bot_log.db --speed 100              # in-process, via handle_line
+    python -m bench.replay --db bot_log.db --entry events           # in-process, incl. ignore checks + log writes
+    python -m bench.replay --db bot_log.db --ws ws://localhost:8765 # against a running logic server
+
+In-process modes run against a scratch copy of the database with the stub AI provider
+(unless --real-ai), so replaying never modifies the source database.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from bench.loadtest import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Log rows the bot writes for JOIN/PART/NICK events rather than real messages
+EVENT_RE = re.compile(r"^\S+ (joined \S+|left \S+|is now \S+)$")
+
+
+def parse_ts(value: str) -> datetime.datetime:
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised timestamp {value!r}")
+
+def load_rows(args) -> list[tuple]:
+    """Returns (timestamp, raw_line) tuples from the source Log table, oldest first."""
+    src = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+    sql = "SELECT timestamp, hostmask, nick, target, message FROM log WHERE 1=1"
+    params = []
+    if args.channel:
+        sql += " AND target = ?"
+        params.append(args.channel)
+    if args.since:
+        sql += " AND timestamp >= ?"
+        params.append(args.since)
+    if args.until:
+        sql += " AND timestamp < ?"
+        params.append(args.until)
+    sql += " ORDER BY id"
+    if args.limit:
+        sql += " LIMIT ?"
+        params.append(args.limit)
+    rows = []
+    for ts, hostmask, nick, target, message in src.execute(sql, params):
+        if not args.include_bot and hostmask.endswith("!bot@localhost"):
+            continue
+        if not args.include_events and EVENT_RE.match(message) and message.startswith(nick + " "):
+            continue
+        rows.append((parse_ts(ts), f"{hostmask} PRIVMSG {target} :{message}"))
+    src.close()
+    return rows
+
+def prepare_scratch_config(args) -> str:
+    """Copy the source DB into a scratch dir and write a config pointing at it."""
+    workdir = tempfile.mkdtemp(prefix="lolo-replay-")
+    scratch_db = os.path.join(workdir, "replay.db")
+    src = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+    dst = sqlite3.connect(scratch_db)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    base_config = os.environ.get("LOLO_CONFIG", os.path.join(REPO_ROOT, "config.json"))
+    with open(base_config) as f:
+        conf = json.load(f)
+    conf["DATABASE_FILE"] = scratch_db  # its Log rows are moved to the scratch log database on startup
+    conf["LOG_DATABASE_FILE"] = os.path.join(workdir, "replay_log.db")
+    if not args.real_ai:
+        conf["AI_PROVIDER"] = "stub"
+        conf["AI_STUB_LATENCY"] = args.ai_latency
+        conf["AI_STUB_TOOL_LATENCY"] = 0.0
+    path = os.path.join(workdir, "config.json")
+    with open(path, "w") as f:
+        json.dump(conf, f, indent=2)
+    return path
+
+
+class Replayer:
+    def __init__(self, args, rows):
+        self.args = args
+        self.rows = rows
+        self.results: list[tuple] = []  # (timestamp, line, path, latency_s, replied)
+        self.max_lag = 0.0
+
+    async def pace(self, start_wall: float, first_ts: datetime.datetime, ts: datetime.datetime):
+        if self.args.speed <= 0:
+            return
+        due = start_wall + (ts - first_ts).total_seconds() / self.args.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self.max_lag = max(self.max_lag, -delay)
+
+    async def run_inprocess(self):
+        from logic_server.commands.parser import CODE_PATH
+        if self.args.entry == "events":
+            from logic_server import events
+            async def feed(line):
+                CODE_PATH.set("not_dispatched")  # ignored users, verify, admin user and denied admin lines stop before handle_line
+                out = await events.handle_message({"line": line})
+                return bool(out)
+        else:
+            from logic_server.commands import handle_line
+            async def feed(line):
+                resp, _ = await handle_line(line)
+                return bool(resp)
+        await self._replay(feed, lambda: CODE_PATH.get())
+
+    async def run_ws(self):
+        import websockets
+        async with websockets.connect(self.args.ws) as ws:
+            greeting = json.loads(await ws.recv())  # state snapshot pushed on connect
+            if greeting.get("type") != "state":
+                raise RuntimeError(f"Unexpected greeting from logic server: {greeting}")
+            ids = itertools.count(1)
+            async def feed(line):
+                # The server acks a message once it has finished handling it.
+                msg_id = next(ids)
+                await ws.send(json.dumps({"line": line, "id": msg_id, "ack": True}))
+                replied = False
+                while True:
+                    data = json.loads(await ws.recv())
+                    if data.get("type") == "ack" and data.get("id") == msg_id:
+                        return replied
+                    replied = replied or "response" in data
+            await self._replay(feed, lambda: "ws")
+
+    async def _replay(self, feed, current_path):
+        if not self.rows:
+            return
+        first_ts = self.rows[0][0]
+        start_wall = time.perf_counter()
+        for i, (ts, line) in enumerate(self.rows):
+            await self.pace(start_wall, first_ts, ts)
+            t0 = time.perf_counter()
+            replied = await feed(line)
+            latency = time.perf_counter() - t0
+            path = current_path()
+            if path == "ws":
+                path = "replied" if replied else "silent"
+            self.results.append((ts, line, path, latency, replied))
+            if self.args.progress and (i + 1) % self.args.progress == 0:
+                print(f"replayed {i + 1}/{len(self.rows)}", file=sys.stderr)
+        self.elapsed = time.perf_counter() - start_wall
+
+    def report(self):
+        by_path: dict[str, list[float]] = {}
+        for _, _, path, latency, _ in self.results:
+            key = path.split(":")[0] if self.args.group else path
+            by_path.setdefault(key, []).append(latency)
+        total = len(self.results)
+        print(f"\nReplayed {total} lines in {self.elapsed:.2f}s ({total / max(self.elapsed, 1e-9):.1f} lines/s), "
+              f"max schedule lag {self.max_lag * 1000:.1f} ms")
+        print(f"{'code path':<28}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for path, values in sorted(by_path.items(), key=lambda kv: -len(kv[1])):
+            print(f"{path:<28}{len(values):>8}"
+                  + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (50, 90, 99))
+                  + f"{max(values) * 1000:>10.2f}")
+        if self.args.csv:
+            with open(self.args.csv, "w", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(["timestamp", "code_path", "latency_ms", "replied", "line"])
+                for ts, line, path, latency, replied in self.results:
+                    w.writerow([ts.isoformat(), path, f"{latency * 1000:.3f}", int(replied), line])
+            print(f"Per-line results written to {self.args.csv}")
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Replay Log table traffic through the logic server")
+    ap.add_argument("--db", default=os.path.join(REPO_ROOT, "bot_log.db"), help="source database with a Log table")
+    ap.add_argument("--ws", help="replay over the WebSocket to a running logic server, e.g. ws://localhost:8765")
+    ap.add_argument("--entry", choices=("parser", "events"), default="parser",
+                    help="in-process entry point: handle_line only, or the full event path incl. log writes")
+    ap.add_argument("--speed", type=float, default=0, help="time compression, e.g. 100 = 100x; 0 = as fast as possible")
+    ap.add_argument("--channel", help="only replay lines sent to this target")
+    ap.add_argument("--since", help="only rows with timestamp >= this (YYYY-MM-DD[ HH:MM:SS])")
+    ap.add_argument("--until", help="only rows with timestamp < this")
+    ap.add_argument("--limit", type=int, help="replay at most this many rows")
+    ap.add_argument("--include-bot", action="store_true", help="also replay the bot's own lines")
+    ap.add_argument("--include-events", action="store_true", help="also replay join/part/nick log rows")
+    ap.add_argument("--real-ai", action="store_true", help="use the configured AI provider instead of the stub")
+    ap.add_argument("--ai-latency", type=float, default=0.0, help="stub AI latency in seconds")
+    ap.add_argument("--group", action="store_true", help="group code paths by kind (command, disabled, ...)")
+    ap.add_argument("--csv", help="write per-line results to this CSV file")
+    ap.add_argument("--progress", type=int, default=0, help="print progress every N lines")
+    ap.add_argument("--verbose", action="store_true", help="keep the logic server's own logging")
+    return ap.parse_args(argv)
+
+async def _run(args, rows):
+    replayer = Replayer(args, rows)
+    if args.ws:
+        await replayer.run_ws()
+    else:
+        import logic_server.db as db
+        import logic_server.events  # noqa: F401 -- import everything that sets up loggers first
+        db.init_db()
+        if not args.verbose:
+            for name in list(logging.Logger.manager.loggerDict):
+                logging.getLogger(name).setLevel(logging.WARNING)
+        try:
+            await replayer.run_inprocess()
+        finally:
+            db.close_db()
+    return replayer
+
+def main(argv=None):
+    args = parse_args(argv)
+    rows = load_rows(args)
+    print(f"Loaded {len(rows)} lines from {args.db}", file=sys.stderr)
+    if not args.ws:
+        # Must happen before anything imports config
+        os.environ["LOLO_CONFIG"] = prepare_scratch_config(args)
+    replayer = asyncio.run(_run(args, rows))
+    replayer.report()
+
+if __name__ == "__main__":
+    main()
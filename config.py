@@ -3,7 +3,7 @@ import os
 import json
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+CONFIG_FILE = os.environ.get('LOLO_CONFIG', os.path.join(BASE_DIR, 'config.json'))
 try:
     with open(CONFIG_FILE) as f:
         _conf = json.load(f)
@@ -15,12 +15,80 @@ IRC_SERVER = _conf['IRC_SERVER']
 IRC_PORT = _conf['IRC_PORT']
 IRC_CHANNEL = _conf['IRC_CHANNEL']
 IRC_AUTOCHANNELS = _conf['IRC_AUTOCHANNELS']
+# How this bot introduces itself to the logic server, which may serve several bots
+BOT_ID = _conf.get('BOT_ID', f"{BOT_NICK}@{IRC_SERVER}")
 
 LOGIC_SERVER_HOST = _conf['LOGIC_SERVER_HOST']
 LOGIC_SERVER_PORT = _conf['LOGIC_SERVER_PORT']
+# Standby logic servers ("host:port"), tried in order when the one above is unreachable
+LOGIC_SERVER_STANDBY = _conf.get('LOGIC_SERVER_STANDBY', [])
+# Link supervision (irc_bot/supervisor.py): the WebSocket is probed every LINK_HEARTBEAT_INTERVAL
+# seconds, IRC after IRC_PING_INTERVAL seconds without inbound lines; a link fails when a probe
+# is unanswered for max(LINK_TIMEOUT_MIN, srtt + 4 * rttvar)
+LINK_HEARTBEAT_INTERVAL = _conf.get('LINK_HEARTBEAT_INTERVAL', 3)
+IRC_PING_INTERVAL = _conf.get('IRC_PING_INTERVAL', 5)
+LINK_TIMEOUT_MIN = _conf.get('LINK_TIMEOUT_MIN', 4)
+LINK_CONNECT_TIMEOUT = _conf.get('LINK_CONNECT_TIMEOUT', 10)
+LINK_FAILBACK_INTERVAL = _conf.get('LINK_FAILBACK_INTERVAL', 60)  # while on a standby, how often to try the primary
 
 DATABASE_FILE = _conf['DATABASE_FILE']
 DB_PATH = os.path.join(BASE_DIR, DATABASE_FILE)
+# Chat log database, separate from users and settings so it can be rotated or dropped on
+# its own; "{network}" is replaced by IRC_SERVER for one log database per network
+LOG_DATABASE_FILE = _conf.get('LOG_DATABASE_FILE', os.path.splitext(DATABASE_FILE)[0] + '_log.db')
+LOG_DB_PATH = os.path.join(BASE_DIR, LOG_DATABASE_FILE.format(network=IRC_SERVER))
+
+# "stub" pins every AI request to the offline stand-in used by the load-test harness;
+# anything else routes between the providers in logic_server/ai/ai_config.py
+AI_PROVIDER = _conf.get('AI_PROVIDER', 'gemini')
+AI_STUB_LATENCY = _conf.get('AI_STUB_LATENCY', 0.5)
+AI_STUB_TOOL_LATENCY = _conf.get('AI_STUB_TOOL_LATENCY', 0.3)
+
+# Add the channel lines most relevant to a mention to the AI prompt (needs numpy)
+AI_RETRIEVAL = _conf.get('AI_RETRIEVAL', False)
+VECTOR_INDEX_DIR = os.path.join(BASE_DIR, _conf.get('VECTOR_INDEX_DIR', 'vector_index'))
+# Bulk symbol list for the stock price tool, written by "python -m logic_server.ai.symbols refresh";
+# without it only the curated logic_server/ai/symbols.tsv is known
+SYMBOLS_FILE = os.path.join(BASE_DIR, _conf.get('SYMBOLS_FILE', 'symbols.tsv'))
+
+# Seconds a command handler may run before the user gets a timeout reply
+COMMAND_TIMEOUT = _conf.get('COMMAND_TIMEOUT', 10)
+
+# Run plugin handlers in this many worker processes (see logic_server/plugin_workers.py); 0 runs
+# them in the server. CPU seconds per call and memory (MB) per worker they may use there.
+PLUGIN_WORKERS = _conf.get('PLUGIN_WORKERS', 0)
+PLUGIN_CPU_SECONDS = _conf.get('PLUGIN_CPU_SECONDS', 5)
+PLUGIN_MEMORY_MB = _conf.get('PLUGIN_MEMORY_MB', 256)
+
+# Plugin jobs (see logic_server/jobs.py): runs at once, and the default per-run timeout in seconds
+JOB_MAX_CONCURRENCY = _conf.get('JOB_MAX_CONCURRENCY', 8)
+JOB_TIMEOUT = _conf.get('JOB_TIMEOUT', 30)
+
+# Requests slower than this many seconds are logged with stage timings and a stack snapshot; 0 disables
+SLOW_REQUEST_THRESHOLD = _conf.get('SLOW_REQUEST_THRESHOLD', 0)
+# Sampling interval and output directory for "!admin profile on <cmd>"
+PROFILE_SAMPLE_INTERVAL = _conf.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+PROFILE_DIR = os.path.join(BASE_DIR, _conf.get('PROFILE_DIR', 'profiles'))
+
+# Fraction of IRC lines traced across the bot and logic server (see shared/tracing.py); 0 disables
+TRACE_SAMPLE_RATE = _conf.get('TRACE_SAMPLE_RATE', 0)
+TRACE_DIR = os.path.join(BASE_DIR, _conf.get('TRACE_DIR', 'traces'))
+TRACE_MAX_BYTES = _conf.get('TRACE_MAX_BYTES', 50 * 1024 * 1024)  # then rotated to <file>.1
+
+# Bot-side spool for events while the logic server is unreachable
+SPOOL_DIR = os.path.join(BASE_DIR, _conf.get('SPOOL_DIR', 'spool'))
+SPOOL_MAX_BYTES = _conf.get('SPOOL_MAX_BYTES', 64 * 1024 * 1024)
+SPOOL_SEGMENT_BYTES = _conf.get('SPOOL_SEGMENT_BYTES', 1024 * 1024)
+SPOOL_COMMAND_MAX_AGE = _conf.get('SPOOL_COMMAND_MAX_AGE', 60)  # older commands/mentions are only logged
+# Bot-side queue of events waiting to be written to the logic server
+OUTBOUND_QUEUE_MAX = _conf.get('OUTBOUND_QUEUE_MAX', 10000)
+OUTBOUND_BATCH_MAX = _conf.get('OUTBOUND_BATCH_MAX', 100)
+# Bot-side flood filter: lines repeated more than FLOOD_REPEAT_LIMIT times a minute, or the
+# FLOOD_BURST_LINES-th line within FLOOD_BURST_SECONDS, are dropped and logged as one summary
+FLOOD_FILTER = _conf.get('FLOOD_FILTER', True)
+FLOOD_REPEAT_LIMIT = _conf.get('FLOOD_REPEAT_LIMIT', 3)
+FLOOD_BURST_LINES = _conf.get('FLOOD_BURST_LINES', 8)
+FLOOD_BURST_SECONDS = _conf.get('FLOOD_BURST_SECONDS', 4)
 
 def save_config():
     """Save modifications back to config.json."""
@@ -4,88 +4,167 @@ import json
 import config
 import websockets
 import irc.client
+from irc.strings import lower as irc_lower
+from collections import OrderedDict
+from typing import Optional
+from shared import metrics, tracing
 from shared.logger import setup_logger
-from datetime import datetime
-import logic_server.db as db
 import signal
 from .handlers import IRCHandlers
+from .ratelimit import RateLimiter
+from .floodfilter import FloodFilter
+from .spool import Spool
+from .outbound import OutboundQueue, PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH
+from .tracker import ChannelTracker
+from .supervisor import Supervisor
 from irc_bot.irc_message_utils import sanitize_for_irc, split_irc_messages
 
 logger = setup_logger("irc_bot.client")
 
+WHOIS_TIMEOUT = 15  # seconds before an unanswered WHOIS is reported as failed
+PENDING_WHOIS_MAX = 100
+# What this bot can do for the logic server (see logic_server/clients.py)
+CAPABILITIES = ("say", "join", "whois", "events", "batch")
+# What a logic server that does not advertise its event subscriptions is sent
+DEFAULT_FORWARDED_EVENTS = ("join", "part", "nick")
+
 class IRCBot:
-    def __init__(self, verify_secret=None):
-        self.verify_secret = verify_secret
-        self.owner_setup_pending = bool(verify_secret)
-        self.pending_admin = {}
-        db.init_db()
+    def __init__(self):
+        self.ignored = set()  # hostmasks pushed down by the logic server
+        self.events = set(DEFAULT_FORWARDED_EVENTS)  # non-message events the logic server wants
+        self.limiter = RateLimiter(config.BOT_NICK)
+        self.flood = FloodFilter(self.report_flood, repeat_limit=config.FLOOD_REPEAT_LIMIT,
+                                 burst_lines=config.FLOOD_BURST_LINES, burst_seconds=config.FLOOD_BURST_SECONDS)
         self.reactor = irc.client.Reactor()
         self.ws = None
         self.ws_down_since = None
-        self.connection = self.reactor.server().connect(
-            config.IRC_SERVER, config.IRC_PORT, config.BOT_NICK
-        )
+        self.spool = Spool(config.SPOOL_DIR, config.SPOOL_MAX_BYTES, config.SPOOL_SEGMENT_BYTES,
+                           config.SPOOL_COMMAND_MAX_AGE)
+        self._spool_drain_task = None
+        self.outbound = OutboundQueue(config.OUTBOUND_QUEUE_MAX)
+        self._outbound_task = None
+        # One connection for the bot's lifetime: the supervisor connects and reconnects it,
+        # and the handlers (registered on the reactor) stay registered once
+        self.connection = self.reactor.server()
+        self.supervisor = Supervisor(self)
         self.handlers = IRCHandlers(self)
-        self.connection.add_global_handler("welcome", self.handlers.on_welcome)
-        self.connection.add_global_handler("pubmsg", self.handlers.on_pubmsg)
-        self.connection.add_global_handler("privmsg", self.handlers.on_privmsg)
-        self.connection.add_global_handler("whoisuser", self.handlers.on_whoisuser)
-        self.connection.add_global_handler("endofwhois", self.handlers.on_endofwhois)
-        self.connection.add_global_handler("disconnect", self.on_disconnect)
-        self.connection.add_global_handler("join", self.handlers.on_join)
-        self.connection.add_global_handler("part", self.handlers.on_part)
-        self.connection.add_global_handler("nick", self.handlers.on_nick)
-        self._irc_reconnect_task = None  # Track running reconnect task
-        self._ws_heartbeat_task = None
-        self._ws_heartbeat_event = None
+        self._add_handlers(self.connection)
+        self.tracker = ChannelTracker()
+        # nick key -> (nick as requested, timeout handle) for WHOIS lookups sent to IRC
+        self.pending_whois: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _add_handlers(self, conn):
+        conn.add_global_handler("welcome", self.handlers.on_welcome)
+        conn.add_global_handler("pubmsg", self.handlers.on_pubmsg)
+        conn.add_global_handler("privmsg", self.handlers.on_privmsg)
+        conn.add_global_handler("whoisuser", self.handlers.on_whoisuser)
+        conn.add_global_handler("endofwhois", self.handlers.on_endofwhois)
+        conn.add_global_handler("disconnect", self.on_disconnect)
+        conn.add_global_handler("join", self.handlers.on_join)
+        conn.add_global_handler("part", self.handlers.on_part)
+        conn.add_global_handler("nick", self.handlers.on_nick)
+        conn.add_global_handler("quit", self.handlers.on_quit)
+        conn.add_global_handler("kick", self.handlers.on_kick)
+        conn.add_global_handler("topic", self.handlers.on_topic)
+        conn.add_global_handler("mode", self.handlers.on_mode)
+        conn.add_global_handler("namreply", self.handlers.on_namreply)
+        conn.add_global_handler("whoreply", self.handlers.on_whoreply)
+        conn.add_global_handler("pong", self.supervisor.on_pong)
+        conn.add_global_handler("all_raw_messages", self.supervisor.on_irc_line)
 
     def on_disconnect(self, connection, event):
-        logger.warning("Disconnected from IRC, scheduling reconnect")
-        print("[IRC Bot] Disconnected from IRC, scheduling reconnect")  # Ensure visibility
-        if self._irc_reconnect_task and not self._irc_reconnect_task.done():
-            logger.warning("Reconnect already in progress, skipping duplicate trigger.")
-            print("[IRC Bot] Reconnect already in progress, skipping duplicate trigger.")
-            return
-        self._irc_reconnect_task = asyncio.create_task(self._irc_reconnect())
+        self.supervisor.irc_disconnected(event.arguments[0] if event.arguments else "")
+        self.tracker.reset()  # rosters are rebuilt from NAMES/WHO after rejoining
+        self.report_channels()
+        for key in list(self.pending_whois):
+            self.whois_done(key)  # the answers died with the connection
+        logger.warning("Disconnected from IRC, reconnecting")
+
+    def send_ws(self, raw_line: str, kind: str = "event", priority: int = PRIORITY_NORMAL):
+        self.send_payload({"line": raw_line}, kind, priority)
+
+    def send_payload(self, payload: dict, kind: str = "event", priority: int = PRIORITY_NORMAL):
+        """
+        Queue a payload for the logic server. Never blocks: the outbound writer task
+        delivers queued payloads in order. kind is "command" for work that goes stale
+        if it has to be spooled (see Spool). Inside a trace, the payload carries the
+        trace context and the current span stays open until the payload is sent.
+        """
+        parent = tracing.hold()
+        if parent:
+            payload["trace"] = parent
+        self.outbound.put(payload, kind, priority)
 
-    async def _irc_reconnect(self):
-        backoff = 1
+    async def outbound_writer(self):
+        """The only task that writes events to the WS; batches whatever queued up while it was busy."""
         while True:
-            try:
-                print(f"[IRC Bot] Attempting IRC reconnect...")
-                conn = self.reactor.server().connect(
-                    config.IRC_SERVER, config.IRC_PORT, config.BOT_NICK
-                )
-                self.connection = conn
-                conn.add_global_handler("welcome", self.handlers.on_welcome)
-                conn.add_global_handler("pubmsg", self.handlers.on_pubmsg)
-                conn.add_global_handler("privmsg", self.handlers.on_privmsg)
-                conn.add_global_handler("whoisuser", self.handlers.on_whoisuser)
-                conn.add_global_handler("endofwhois", self.handlers.on_endofwhois)
-                conn.add_global_handler("disconnect", self.on_disconnect)
-                conn.add_global_handler("join", self.handlers.on_join)
-                conn.add_global_handler("part", self.handlers.on_part)
-                conn.add_global_handler("nick", self.handlers.on_nick)
-                logger.info("IRC reconnected successfully")
-                print("[IRC Bot] IRC reconnected successfully")
-                self._irc_reconnect_task = None
-                backoff = 1  # Reset backoff after successful reconnect
-                return
-            except Exception as e:
-                logger.warning(f"IRC reconnect failed: {e}, retrying in {backoff}s")
-                print(f"[IRC Bot] IRC reconnect failed: {e}, retrying in {backoff}s")
-                await asyncio.sleep(backoff)
-                backoff = min(backoff * 2, 60)
+            batch = await self.outbound.get_batch(config.OUTBOUND_BATCH_MAX)
+            await self.deliver(batch)
+
+    async def deliver(self, batch: list[tuple]):
+        """
+        Send (kind, payload) pairs, or spool them to disk while the logic server is
+        unreachable. Once anything is spooled, later payloads queue behind it until the
+        backlog drains, so the server sees events in the order they happened.
+        """
+        try:
+            if self.ws is not None and not len(self.spool):
+                if len(batch) == 1:
+                    message = batch[0][1]
+                else:
+                    message = {"type": "batch", "items": [payload for _, payload in batch]}
+                    metrics.observe("outbound.batch_size", len(batch))
+                if await self._send_now(message):
+                    return
+            for kind, payload in batch:
+                if payload.get("type") != "channels":  # the next hello carries the current list
+                    self.spool.append(payload, kind)
+            self._ensure_drain()
+        finally:
+            for _, payload in batch:
+                tracing.release(payload.get("trace"))
 
-    async def send_ws(self, raw_line: str):
+    async def _send_now(self, payload: dict) -> bool:
+        ws = self.ws
+        if ws is None:
+            return False
         try:
-            await self.ws.send(json.dumps({"line": raw_line}))
-            logger.debug(f"WS >> sent IRC line: {raw_line}")
+            await ws.send(json.dumps(payload))
+            logger.debug(f"WS >> sent: {payload}")
+            return True
         except Exception as e:
             logger.error(f"Error sending to WS: {e}")
-            if not self.ws_down_since:
-                self.ws_down_since = datetime.now()
-            self.ws = None
+            self.supervisor.abort_ws(ws, f"send failed: {e}")
+            return False
+
+    def _ensure_drain(self):
+        if self.ws is not None and len(self.spool) and not (self._spool_drain_task and not self._spool_drain_task.done()):
+            self._spool_drain_task = asyncio.create_task(self.drain_spool())
+
+    async def drain_spool(self):
+        """Replay spooled payloads in order; stale commands are downgraded to log-only or dropped."""
+        if len(self.spool):
+            logger.info(f"Draining {len(self.spool)} spooled payloads")
+        sent = stale = 0
+        while self.ws is not None:
+            record = self.spool.peek()
+            if record is None:
+                break
+            payload = record["payload"]
+            if self.spool.is_stale(record):
+                stale += 1
+                if "line" not in payload:
+                    self.spool.commit()  # a WHOIS reply nobody is waiting for any more
+                    continue
+                payload = {"line": payload["line"], "log_only": True}
+            if not await self._send_now(payload):
+                break
+            self.spool.commit()
+            sent += 1
+        if sent or stale:
+            metrics.incr("spool.replayed", sent)
+            metrics.incr("spool.stale", stale)
+            logger.info(f"Replayed {sent} spooled payloads ({stale} stale commands logged only), {len(self.spool)} left")
 
     async def process_irc(self):
         while True:
@@ -93,117 +172,150 @@ class IRCBot:
                 self.reactor.process_once(timeout=0)
             except Exception as e:
                 logger.error(f"process_irc exception: {e}")
-                if not (self._irc_reconnect_task and not self._irc_reconnect_task.done()):
-                    self._irc_reconnect_task = asyncio.create_task(self._irc_reconnect())
+                self.supervisor.drop_irc(f"error: {e}")
                 await asyncio.sleep(1)
                 continue
             await asyncio.sleep(0.1)
 
-    async def process_ws(self):
-        async for msg in self.ws:
+    def hello(self) -> dict:
+        """First message on every WS connection: who we are and which channels we are in."""
+        return {
+            "type": "hello",
+            "id": config.BOT_ID,
+            "network": config.IRC_SERVER,
+            "nick": (self.connection.is_connected() and self.connection.get_nickname()) or config.BOT_NICK,
+            "capabilities": list(CAPABILITIES),
+            "channels": self.tracker.joined(),
+        }
+
+    def report_channels(self):
+        """Tell the logic server which channels we are in after joining or leaving one."""
+        self.send_payload({"type": "channels", "channels": self.tracker.joined()}, priority=PRIORITY_HIGH)
+
+    def report_flood(self, hostmask: str, channel: Optional[str], count: int, reason: str, sample: str):
+        """One log row for a flood the filter dropped, in place of its lines."""
+        logger.info(f"Suppressed {count} lines from {hostmask} in {channel or 'PM'} ({reason})")
+        target = channel or hostmask.split('!')[0]
+        self.send_payload({"type": "suppressed", "hostmask": hostmask, "target": target, "count": count,
+                           "reason": reason, "sample": sample}, priority=PRIORITY_LOW)
+
+    def apply_state(self, data: dict):
+        """Replace the local read cache with the snapshot pushed by the logic server."""
+        self.ignored = set(data.get("ignored", []))
+        self.events = set(data.get("events", DEFAULT_FORWARDED_EVENTS))
+        self.limiter.update(data)
+        logger.debug(f"State updated: {len(self.ignored)} ignored hostmasks, forwarding {sorted(self.events)}")
+
+    async def privmsg_lines(self, target: str, lines: list[str]):
+        sent = []
+        for line in lines:
+            if line.strip():
+                self.connection.privmsg(target, line)
+                logger.info(f"IRC >> PRIVMSG {target} :{line}")
+                sent.append(line)
+        if sent:
+            self.send_payload({"type": "sent", "nick": config.BOT_NICK, "target": target, "lines": sent})
+
+    def lookup_hostmask(self, nick: str):
+        """
+        Answer the logic server's WHOIS request from the channel tracker when we can;
+        otherwise ask IRC, giving up after WHOIS_TIMEOUT seconds.
+        """
+        known = self.tracker.lookup(nick)
+        if known:
+            metrics.incr("tracker.whois.local")
+            self.send_payload({"type": "whois", "nick": nick, "user": known[0], "host": known[1]},
+                              "command", PRIORITY_HIGH)
+            return
+        key = irc_lower(nick)
+        if key in self.pending_whois:
+            return
+        while len(self.pending_whois) >= PENDING_WHOIS_MAX:
+            self.whois_done(next(iter(self.pending_whois)))
+        timer = asyncio.get_running_loop().call_later(WHOIS_TIMEOUT, self.whois_done, key)
+        self.pending_whois[key] = (nick, timer)
+        metrics.incr("tracker.whois.remote")
+        self.connection.whois([nick])
+        logger.info(f"IRC >> WHOIS {nick}")
+
+    def whois_done(self, key: str, user: Optional[str] = None, host: Optional[str] = None):
+        """Report a pending WHOIS to the logic server: found if user/host are given, else failed."""
+        pending = self.pending_whois.pop(key, None)
+        if pending is None:
+            return
+        nick, timer = pending
+        timer.cancel()
+        if host:
+            payload = {"type": "whois", "nick": nick, "user": user, "host": host}
+        else:
+            payload = {"type": "endofwhois", "nick": nick}
+        self.send_payload(payload, "command", PRIORITY_HIGH)
+
+    async def process_ws(self, ws):
+        async for msg in ws:
             logger.debug(f"WS << {msg}")
             try:
                 data = json.loads(msg)
                 if data.get("type") == "heartbeat":
-                    if self._ws_heartbeat_event and not self._ws_heartbeat_event.done():
-                        self._ws_heartbeat_event.set_result(True)
+                    self.supervisor.on_heartbeat(data)
                     continue
-                response = data.get("response")
-                if response:
-                    if isinstance(response, str):
-                        if response.startswith("__PRIVMSG__::"):
-                            parts = response.split("::", 2)
-                            if len(parts) == 3:
-                                target, message = parts[1], parts[2]
-                                logger.info(f"Sending IRC PM: {message} to {target}")
-                                lines = split_irc_messages(message)
-                                for line in lines:
-                                    if line.strip():
-                                        self.connection.privmsg(target, line)
-                                        logger.info(f"IRC >> PRIVMSG {target} :{line}")
-                                        db.log_message(
-                                            f"{config.BOT_NICK}!bot@localhost",
-                                            config.BOT_NICK,
-                                            target,
-                                            line
-                                        )
-                                return
-                        elif response.startswith("__JOIN__::"):
-                            target = response.split("::", 1)[1]
-                            logger.info(f"Joining channel: {target}")
-                            self.connection.join(target)
-                            logger.info(f"IRC >> JOIN {target}")
-                            return
-                        elif response.startswith("__PART__::"):
-                            target = response.split("::", 1)[1]
-                            logger.info(f"Parting channel: {target}")
-                            self.connection.part(target)
-                            logger.info(f"IRC >> PART {target}")
-                            return
-                    target = data.get("target", config.IRC_CHANNEL)
-                    logger.info(f"Sending IRC response: {response}")
-                    if isinstance(response, list):
-                        lines = []
-                        for resp in response:
-                            lines.extend(split_irc_messages(sanitize_for_irc(str(resp))))
-                    else:
-                        lines = split_irc_messages(sanitize_for_irc(str(response)))
-                    for line in lines:
-                        if line.strip():
-                            self.connection.privmsg(target, line)
-                            logger.info(f"IRC >> PRIVMSG {target} :{line}")
-                            db.log_message(
-                                f"{config.BOT_NICK}!bot@localhost",
-                                config.BOT_NICK,
-                                target,
-                                line
-                            )
+                if data.get("type") == "state":
+                    self.apply_state(data)
+                    continue
+                with tracing.continue_trace(data.get("trace"), "irc.reply", target=data.get("target", "")):
+                    await self.handle_response(data)
             except json.JSONDecodeError:
                 logger.warning("WS >> invalid JSON")
 
+    async def handle_response(self, data: dict):
+        """Carry out one reply from the logic server: IRC lines or a __JOIN__/__PART__/__WHOIS__ action."""
+        response = data.get("response")
+        if response and not self.connection.is_connected():
+            metrics.incr("link.irc.dropped_responses")
+            logger.warning(f"Not connected to IRC, dropping response: {response}")
+            return
+        if response:
+            if isinstance(response, str):
+                if response.startswith("__PRIVMSG__::"):
+                    parts = response.split("::", 2)
+                    if len(parts) == 3:
+                        target, message = parts[1], parts[2]
+                        logger.info(f"Sending IRC PM: {message} to {target}")
+                        await self.privmsg_lines(target, split_irc_messages(message))
+                    return
+                elif response.startswith("__JOIN__::"):
+                    target = response.split("::", 1)[1]
+                    logger.info(f"Joining channel: {target}")
+                    self.connection.join(target)
+                    logger.info(f"IRC >> JOIN {target}")
+                    return
+                elif response.startswith("__PART__::"):
+                    target = response.split("::", 1)[1]
+                    logger.info(f"Parting channel: {target}")
+                    self.connection.part(target)
+                    logger.info(f"IRC >> PART {target}")
+                    return
+                elif response.startswith("__WHOIS__::"):
+                    self.lookup_hostmask(response.split("::", 1)[1])
+                    return
+            target = data.get("target", config.IRC_CHANNEL)
+            logger.info(f"Sending IRC response: {response}")
+            if isinstance(response, list):
+                lines = []
+                for resp in response:
+                    lines.extend(split_irc_messages(sanitize_for_irc(str(resp))))
+            else:
+                lines = split_irc_messages(sanitize_for_irc(str(response)))
+            await self.privmsg_lines(target, lines)
+
     async def start(self):
         asyncio.create_task(self.process_irc())
-        uri = f"ws://{config.LOGIC_SERVER_HOST}:{config.LOGIC_SERVER_PORT}"
-        backoff = 1
-        while True:
-            try:
-                self.ws = await websockets.connect(uri, ping_interval=20, ping_timeout=20)
-                self.ws_down_since = None
-                logger.info(f"WS connected to {uri}")
-                backoff = 1  # Reset backoff after successful WS connect
-                self._ws_heartbeat_task = asyncio.create_task(self.ws_heartbeat())
-                await self.process_ws()
-            except Exception as e:
-                now = datetime.now()
-                if not self.ws_down_since:
-                    self.ws_down_since = now
-                self.ws = None
-                logger.warning(f"WS disconnected: {e}; reconnecting in {backoff}s")
-                await asyncio.sleep(backoff)
-                backoff = min(backoff * 2, 60)
-
-    async def ws_heartbeat(self, interval=60, timeout=10):
-        while True:
-            await asyncio.sleep(interval)
-            if not self.ws:
-                continue
-            try:
-                heartbeat_msg = json.dumps({"type": "heartbeat"})
-                await self.ws.send(heartbeat_msg)
-                logger.debug("Sent WS heartbeat")
-                print(" [IRC Bot] Sent WS heartbeat")
-                self._ws_heartbeat_event = asyncio.get_event_loop().create_future()
-                try:
-                    await asyncio.wait_for(self._ws_heartbeat_event, timeout)
-                    logger.debug("Received WS heartbeat reply")
-                    print(" [IRC Bot] WS heartbeat OK")
-                except asyncio.TimeoutError:
-                    logger.warning("WS heartbeat timed out, reconnecting...")
-                    print(" [IRC Bot] WS heartbeat timed out, reconnecting...")
-                    self.ws = None
-            except Exception as e:
-                logger.error(f"WS heartbeat error: {e}")
-                print(f" [IRC Bot] WS heartbeat error: {e}")
+        self._outbound_task = asyncio.create_task(self.outbound_writer())
+        irc_link = asyncio.create_task(self.supervisor.run_irc())
+        try:
+            await self.supervisor.run_ws()
+        finally:
+            irc_link.cancel()
 
     def on_welcome(self, connection, event):
         return self.handlers.on_welcome(connection, event)
@@ -214,9 +326,6 @@ class IRCBot:
     def on_privmsg(self, connection, event):
         return self.handlers.on_privmsg(connection, event)
 
-    def handle_admin(self, connection, event):
-        return self.handlers.handle_admin(connection, event)
-
     def on_whoisuser(self, connection, event):
         return self.handlers.on_whoisuser(connection, event)
 
@@ -233,13 +342,8 @@ class IRCBot:
         return self.handlers.on_nick(connection, event)
 
 async def main():
-    db.init_db()
-    owner = db.User.get_or_none(db.User.level == "Owner")
-    if not owner:
-        secret = input("No owner found. Enter secret passphrase for first owner: ").strip()
-    else:
-        secret = None
-    bot = IRCBot(verify_secret=secret)
+    tracing.setup("irc_bot")
+    bot = IRCBot()
     loop = asyncio.get_running_loop()
     stop = loop.create_future()
     def _stop_signal():
@@ -258,6 +362,13 @@ async def main():
     if bot.ws:
         await bot.ws.close()
     bot.connection.disconnect("Shutting down")
+    bot.flood.flush()
+    if bot._outbound_task:
+        bot._outbound_task.cancel()
+    for kind, payload in bot.outbound.take(len(bot.outbound)):
+        bot.spool.append(payload, kind)  # undelivered events survive the restart
+    bot.spool.close()
+    tracing.close()
     for s in (signal.SIGINT, signal.SIGTERM):
         loop.remove_signal_handler(s)
 
@@ -0,0 +1,163 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+from shared import metrics
+
+NON_WORD = re.compile(r"[\W\d_]+")
+MANY_SENDERS = "*"  # hostmask reported for spam suppressed across several senders
+
+
+class Sender:
+    """Recent lines of one hostmask in one channel (or in PM), and its current flood, if any."""
+    __slots__ = ("recent", "times", "suppressed", "reason", "sample", "last_suppressed", "timer")
+
+    def __init__(self, repeat_window: int, burst_lines: int):
+        self.recent: deque = deque(maxlen=repeat_window)  # (fingerprint, time)
+        self.times: deque = deque(maxlen=burst_lines)     # arrival times
+        self.suppressed = 0
+        self.reason = ""
+        self.sample = ""
+        self.last_suppressed = 0.0
+        self.timer = None
+
+
+class ChannelLines:
+    """
+    Fingerprints of the last `size` long lines in a channel with a count per
+    fingerprint, so "how often was this just said" is a dict lookup and the oldest line
+    drops out of the count as a new one comes in.
+    """
+    __slots__ = ("ring", "counts")
+
+    def __init__(self, size: int):
+        self.ring: deque = deque(maxlen=size)  # (fingerprint, time)
+        self.counts: dict[int, int] = {}
+
+    def add(self, fingerprint: int, now: float, window: float) -> int:
+        """Record a line; returns how many times it occurs within the last `window` seconds."""
+        ring, counts = self.ring, self.counts
+        while ring and (len(ring) == ring.maxlen or now - ring[0][1] > window):
+            old = ring.popleft()[0]
+            if counts[old] == 1:
+                del counts[old]
+            else:
+                counts[old] -= 1
+        ring.append((fingerprint, now))
+        counts[fingerprint] = counts.get(fingerprint, 0) + 1
+        return counts[fingerprint]
+
+
+class FloodFilter:
+    """
+    Drops repeated lines and bursts before they are logged or forwarded. Per hostmask and
+    channel, a line is suppressed if its fingerprint (a hash of the text lowercased and
+    stripped of digits and punctuation, so "spam 1" and "SPAM 2!" match) occurred
+    `repeat_limit` times in the sender's last `repeat_window` lines within
+    `window_seconds`, or if it is the `burst_lines`th line within `burst_seconds` (a
+    paste). Long lines are also suppressed once `channel_repeat_limit` copies were
+    seen from anyone in the channel within `window_seconds` (spam from many hosts); those
+    are counted together under the hostmask MANY_SENDERS.
+
+    Each line costs a few dict and deque operations on fixed-size windows. Senders are
+    kept in LRU order and capped at `max_senders`. When a flood has been quiet for
+    `quiet_seconds`, on_summary(hostmask, channel, count, reason, sample) reports it
+    once.
+    """
+    def __init__(self, on_summary: Callable, repeat_limit: int = 3, repeat_window: int = 10,
+                 window_seconds: float = 60, burst_lines: int = 8, burst_seconds: float = 4,
+                 channel_repeat_limit: int = 4, channel_window: int = 200, min_spam_chars: int = 30,
+                 quiet_seconds: float = 10, max_senders: int = 5000):
+        self.on_summary = on_summary
+        self.repeat_limit = repeat_limit
+        self.repeat_window = repeat_window
+        self.window_seconds = window_seconds
+        self.burst_lines = burst_lines
+        self.burst_seconds = burst_seconds
+        self.channel_repeat_limit = channel_repeat_limit
+        self.channel_window = channel_window
+        self.min_spam_chars = min_spam_chars
+        self.quiet_seconds = quiet_seconds
+        self.max_senders = max_senders
+        self.senders: "OrderedDict[tuple, Sender]" = OrderedDict()
+        self.channels: "OrderedDict[str, ChannelLines]" = OrderedDict()
+
+    def _sender(self, key: tuple) -> Sender:
+        sender = self.senders.get(key)
+        if sender is None:
+            while len(self.senders) >= self.max_senders:
+                old_key, old = self.senders.popitem(last=False)
+                self._report(old_key, old)
+            sender = self.senders[key] = Sender(self.repeat_window, self.burst_lines)
+        else:
+            self.senders.move_to_end(key)
+        return sender
+
+    def _channel(self, channel: str) -> ChannelLines:
+        lines = self.channels.get(channel)
+        if lines is None:
+            if len(self.channels) >= self.max_senders:
+                self.channels.popitem(last=False)
+            lines = self.channels[channel] = ChannelLines(self.channel_window)
+        return lines
+
+    def allow(self, hostmask: str, channel: Optional[str], text: str, is_command: bool = False) -> bool:
+        """False if the line is part of a flood and should be dropped."""
+        now = time.monotonic()
+        normalized = NON_WORD.sub(" ", text.lower()).strip()
+        fingerprint = hash(normalized)
+        key = (hostmask, channel)
+        sender = self._sender(key)
+
+        reason = None
+        sender.times.append(now)
+        if len(sender.times) == self.burst_lines and now - sender.times[0] < self.burst_seconds:
+            reason = "burst"
+        if not is_command:
+            repeats = sum(1 for fp, t in sender.recent if fp == fingerprint and now - t <= self.window_seconds)
+            if repeats >= self.repeat_limit:
+                reason = reason or "repeat"
+        sender.recent.append((fingerprint, now))
+        if channel and len(normalized) >= self.min_spam_chars:
+            copies = self._channel(channel).add(fingerprint, now, self.window_seconds)
+            if copies > self.channel_repeat_limit:
+                reason = reason or "channel repeat"
+        if reason is None:
+            return True
+
+        metrics.incr(f"flood.suppressed.{reason.replace(' ', '_')}")
+        if reason == "channel repeat" and not sender.suppressed:
+            key = (MANY_SENDERS, channel)
+            sender = self._sender(key)
+        if not sender.suppressed:
+            sender.reason, sender.sample = reason, text
+            sender.timer = asyncio.get_running_loop().call_later(self.quiet_seconds, self._quiet, key)
+        sender.suppressed += 1
+        sender.last_suppressed = now
+        return False
+
+    def _quiet(self, key: tuple):
+        sender = self.senders.get(key)
+        if sender is None or not sender.suppressed:
+            return
+        left = sender.last_suppressed + self.quiet_seconds - time.monotonic()
+        if left > 0:
+            sender.timer = asyncio.get_running_loop().call_later(left, self._quiet, key)
+            return
+        self._report(key, sender)
+
+    def _report(self, key: tuple, sender: Sender):
+        if not sender.suppressed:
+            return
+        if sender.timer is not None:
+            sender.timer.cancel()
+        hostmask, channel = key
+        self.on_summary(hostmask, channel, sender.suppressed, sender.reason, sender.sample)
+        sender.suppressed = 0
+        sender.timer = None
+
+    def flush(self):
+        """Report every flood still in progress, e.g. on shutdown."""
+        for key, sender in list(self.senders.items()):
+            self._report(key, sender)
@@ -1,148 +1,183 @@
-import asyncio
 import json
 import config
-import logic_server.db as db
+from irc.strings import lower as irc_lower
+from shared import tracing
 from shared.logger import setup_logger
+from .outbound import PRIORITY_LOW, PRIORITY_HIGH
 from datetime import datetime
 
 logger = setup_logger("irc_bot.handlers")
 
 class IRCHandlers:
+    """
+    Thin IRC edge: events are forwarded to the logic server, which owns all
+    persistent state (permissions, prefixes, logging). Local state is the read
+    cache the logic server pushes down (see IRCBot.apply_state) and the channel
+    rosters seen on IRC (see ChannelTracker).
+    """
     def __init__(self, client):
         self.client = client
 
     def on_welcome(self, connection, event):
         logger.info("Connected to IRC, joining channels")
-        connection.join(config.IRC_CHANNEL)
-        logger.info(f"IRC >> JOIN {config.IRC_CHANNEL}")
-        for chan in config.IRC_AUTOCHANNELS:
+        supervisor = self.client.supervisor
+        supervisor.irc_welcomed()
+        channels = [config.IRC_CHANNEL] + list(config.IRC_AUTOCHANNELS)
+        # Channels joined at runtime (e.g. with !join) before the connection dropped
+        configured = {irc_lower(c) for c in channels}
+        channels += sorted(c for c in supervisor.restore_channels if c not in configured)
+        for chan in channels:
             connection.join(chan)
             logger.info(f"IRC >> JOIN {chan}")
 
     def on_pubmsg(self, connection, event):
-        hostmask = event.source
-        if db.get_user_level(hostmask) == "Ignored":
+        if event.source in self.client.ignored or not self.allow_line(event.source, event.target, event.arguments[0]):
             return
-        raw = event.arguments[0]
-        prefix = db.get_prefix(event.target)
-        if any(raw.startswith(prefix + f"admin user {sub}") for sub in ("add","remove","set")):
-            self.client.handlers.handle_admin(connection, event)
-            return
-        db.log_message(event.source, event.source.split('!')[0], event.target, raw)
-        message = raw
+        with tracing.start_trace("irc.pubmsg", target=event.target):
+            self._pubmsg(connection, event)
+
+    def _pubmsg(self, connection, event):
+        message = event.arguments[0]
         if config.BOT_NICK.lower() in message.lower() and self.client.ws_down_since:
+            # Still forwarded below: spooled, and answered if the server is back in time
             downtime = int((datetime.now() - self.client.ws_down_since).total_seconds())
             msg = f"Command server is down for {downtime}s"
             connection.privmsg(config.IRC_CHANNEL, msg)
             logger.info(f"IRC >> PRIVMSG {config.IRC_CHANNEL} :{msg}")
-            return
         raw_line = f"{event.source} PRIVMSG {event.target} :{message}"
-        asyncio.create_task(self.client.send_ws(raw_line))
+        if not self.check_rate_limit(connection, event.source, event.target, message, raw_line):
+            return
+        self.forward_message(raw_line, event.target, message)
 
     def on_privmsg(self, connection, event):
-        message = event.arguments[0]
-        hostmask = event.source
-        if db.get_user_level(hostmask) == "Ignored":
-            return
-        prefix_pm = db.get_prefix(event.target)
-        if any(message.startswith(prefix_pm + f"admin user {sub}") for sub in ("add","remove","set")):
-            self.client.handlers.handle_admin(connection, event)
+        if event.source in self.client.ignored or not self.allow_line(event.source, None, event.arguments[0]):
             return
+        with tracing.start_trace("irc.privmsg"):
+            self._privmsg(connection, event)
+
+    def _privmsg(self, connection, event):
+        message = event.arguments[0]
         nick = event.source.split('!')[0]
-        hostmask = event.source
-        if self.client.owner_setup_pending and message.startswith("!verify "):
-            provided = message.split(" ", 1)[1].strip()
-            if provided == self.client.verify_secret:
-                db.add_user(hostmask, nick, "Owner")
-                connection.privmsg(nick, "You are now the owner.")
-                self.client.owner_setup_pending = False
-                self.client.verify_secret = None
-            else:
-                connection.privmsg(nick, "Invalid passphrase.")
-            return
-        db.log_message(event.source, nick, nick, message)
         raw = f"{event.source} PRIVMSG {nick} :{message}"
-        asyncio.create_task(self.client.send_ws(raw))
-
-    def handle_admin(self, connection, event):
-        parts = event.arguments[0].split()
-        channel = event.target
-        caller = event.source
-        lvl = db.get_user_level(caller)
-        if lvl not in ("Owner","Admin"):
-            connection.privmsg(channel, "Permission denied")
-            return
-        if len(parts) < 4 or parts[1] != "user":
-            connection.privmsg(channel, "Usage: !admin user add|remove NICK [LEVEL]")
-            return
-        cmd, target = parts[2], parts[3]
-        if cmd not in ("add","remove","set"):
-            connection.privmsg(channel, f"Unknown subcommand {cmd}")
+        if not self.check_rate_limit(connection, event.source, None, message, raw):
             return
-        if cmd in ("add","set"):
-            if len(parts) != 5:
-                connection.privmsg(channel, "Usage: !admin user add NICK LEVEL")
-                return
-            newlvl = parts[4].capitalize()
-            if newlvl not in ("Owner","Admin","Normal","Ignored"):
-                connection.privmsg(channel, f"Invalid level {newlvl}")
-                return
-            self.client.pending_admin[target] = (cmd, newlvl, channel)
+        self.forward_message(raw, None, message)
+
+    def allow_line(self, hostmask: str, channel, message: str) -> bool:
+        """False for lines of a paste or spam flood: dropped here, before any logging or forwarding."""
+        if not config.FLOOD_FILTER:
+            return True
+        is_command = self.client.limiter.classify(channel, message) is not None
+        return self.client.flood.allow(hostmask, channel, message, is_command)
+
+    def forward_message(self, raw_line, channel, message):
+        """Commands and mentions jump ahead of JOIN/PART when the queue is full, and go stale if spooled too long."""
+        if self.client.limiter.classify(channel, message) is None:
+            self.client.send_ws(raw_line)
         else:
-            self.client.pending_admin[target] = (cmd, None, channel)
-        connection.whois([target])
-        connection.privmsg(channel, f"Looking up hostmask for {target}...")
+            self.client.send_ws(raw_line, "command", PRIORITY_HIGH)
+
+    def check_rate_limit(self, connection, hostmask, channel, message, raw_line) -> bool:
+        """
+        False if the line exceeds its rate limit. Over-limit lines are still sent for
+        logging, but never dispatched, so they cost no command or AI work.
+        """
+        limiter = self.client.limiter
+        cost = limiter.classify(channel, message)
+        if cost is None or limiter.allow(hostmask, channel, cost):
+            return True
+        nick = hostmask.split('!')[0]
+        logger.info(f"Rate limited {cost} request from {hostmask} in {channel or 'PM'}")
+        if limiter.should_notify(hostmask, cost):
+            connection.notice(nick, f"You're sending {cost} requests too fast; some were ignored.")
+        self.client.send_payload({"line": raw_line, "log_only": True})
+        return False
 
     def on_whoisuser(self, connection, event):
         nick, user, host = event.arguments[0], event.arguments[1], event.arguments[2]
-        hostmask = f"{nick}!{user}@{host}"
-        info = self.client.pending_admin.pop(nick, None)
-        if not info:
-            return
-        cmd, lvl, channel = info
-        if cmd in ("add","set"):
-            db.add_user(hostmask, nick, lvl)
-            connection.privmsg(channel, f"User {nick} added as {lvl}")
-        else:
-            db.remove_user(hostmask)
-            connection.privmsg(channel, f"User {nick} removed")
+        self.client.tracker.on_whois(nick, user, host)
+        self.client.whois_done(irc_lower(nick), user, host)
 
     def on_endofwhois(self, connection, event):
-        nick = event.arguments[0]
-        info = self.client.pending_admin.pop(nick, None)
-        if info:
-            _, _, channel = info
-            connection.privmsg(channel, f"WHOIS failed for {nick}")
+        self.client.whois_done(irc_lower(event.arguments[0]))
+
+    def is_self(self, connection, nick) -> bool:
+        return irc_lower(nick) == irc_lower(connection.get_nickname())
+
+    def on_namreply(self, connection, event):
+        self.client.tracker.on_names(event.arguments[1], event.arguments[2])
+
+    def on_whoreply(self, connection, event):
+        channel, user, host, _, nick = event.arguments[:5]
+        self.client.tracker.on_who(channel, user, host, nick)
+
+    def forwards(self, event_type: str, event) -> bool:
+        """Whether the logic server wants this event: someone subscribed to its type and the source is not ignored."""
+        return event_type in self.client.events and event.source not in self.client.ignored
 
     def on_join(self, connection, event):
-        channel = event.target
-        nick = event.source.split('!')[0]
-        hostmask = event.source
-        if db.get_user_level(hostmask) == "Ignored":
+        is_self = self.is_self(connection, event.source.nick)
+        self.client.tracker.on_join(event.target, event.source, is_self)
+        if is_self:
+            connection.who(event.target)  # NAMES has no hosts; WHO fills them in
+            self.client.report_channels()
+        if not self.forwards("join", event):
             return
-        db.log_message(hostmask, nick, channel, f"{nick} joined {channel}")
-        raw = f"{event.source} JOIN {channel}"
-        asyncio.create_task(self.client.send_ws(raw))
+        raw = f"{event.source} JOIN {event.target}"
+        self.client.send_ws(raw, priority=PRIORITY_LOW)
 
     def on_part(self, connection, event):
-        channel = event.target
-        nick = event.source.split('!')[0]
-        hostmask = event.source
-        if db.get_user_level(hostmask) == "Ignored":
+        is_self = self.is_self(connection, event.source.nick)
+        self.client.tracker.on_part(event.target, event.source.nick, is_self)
+        if is_self:
+            self.client.report_channels()
+        if not self.forwards("part", event):
             return
-        db.log_message(hostmask, nick, channel, f"{nick} left {channel}")
-        raw = f"{event.source} PART {channel}"
-        asyncio.create_task(self.client.send_ws(raw))
+        raw = f"{event.source} PART {event.target}"
+        if event.arguments and event.arguments[0]:
+            raw += f" :{event.arguments[0]}"
+        self.client.send_ws(raw, priority=PRIORITY_LOW)
+
+    def on_kick(self, connection, event):
+        kicked = event.arguments[0]
+        is_self = self.is_self(connection, kicked)
+        self.client.tracker.on_kick(event.target, kicked, is_self)
+        if is_self:
+            self.client.report_channels()
+        if not self.forwards("kick", event):
+            return
+        reason = event.arguments[1] if len(event.arguments) > 1 else ""
+        self.client.send_ws(f"{event.source} KICK {event.target} {kicked} :{reason}", priority=PRIORITY_LOW)
+
+    def on_quit(self, connection, event):
+        forward = self.forwards("quit", event)
+        channels = self.client.tracker.channels_of(event.source.nick) if forward else []
+        self.client.tracker.on_quit(event.source.nick)
+        if not forward:
+            return
+        reason = event.arguments[0] if event.arguments else ""
+        self.client.send_payload({"line": f"{event.source} QUIT :{reason}", "channels": channels},
+                                 priority=PRIORITY_LOW)
 
     def on_nick(self, connection, event):
-        old_nick = event.source.split('!')[0]
-        new_nick = event.target
-        hostmask = event.source
-        if db.get_user_level(hostmask) == "Ignored":
+        self.client.tracker.on_nick(event.source.nick, event.target)
+        if not self.forwards("nick", event):
+            return
+        raw = f"{event.source} NICK :{event.target}"
+        self.client.send_payload({"line": raw, "channels": self.client.tracker.channels_of(event.target)},
+                                 priority=PRIORITY_LOW)
+
+    def on_topic(self, connection, event):
+        if not self.forwards("topic", event):
+            return
+        topic = event.arguments[0] if event.arguments else ""
+        self.client.send_ws(f"{event.source} TOPIC {event.target} :{topic}", priority=PRIORITY_LOW)
+
+    def on_mode(self, connection, event):
+        """Channel modes only; user modes arrive as "umode"."""
+        if not self.forwards("mode", event):
             return
-        db.log_message(hostmask, old_nick, new_nick, f"{old_nick} is now {new_nick}")
-        raw = f"{event.source} NICK :{new_nick}"
-        asyncio.create_task(self.client.send_ws(raw))
+        self.client.send_ws(f"{event.source} MODE {event.target} {' '.join(event.arguments)}", priority=PRIORITY_LOW)
 
 async def handle_irc(reader, ws, writer):
     while True:
@@ -0,0 +1,71 @@
+import asyncio
+from collections import deque
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("irc_bot.outbound")
+
+# Lower priorities are evicted first when the queue is full
+PRIORITY_LOW = 0     # JOIN/PART/NICK
+PRIORITY_NORMAL = 1  # chatter, lines the bot sent
+PRIORITY_HIGH = 2    # commands, mentions, WHOIS replies
+PRIORITY_NAMES = ("low", "normal", "high")
+
+
+class OutboundQueue:
+    """
+    Bounded FIFO of payloads waiting for the single WS writer task. Handlers put()
+    without awaiting; the writer takes everything that piled up while it was busy as
+    one batch. When full, the oldest item of the lowest priority below the new item's
+    is evicted; if there is none, the new item is dropped.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: deque = deque()  # (priority, kind, payload)
+        self.counts = [0] * len(PRIORITY_NAMES)
+        self.ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, payload: dict, kind: str = "event", priority: int = PRIORITY_NORMAL) -> bool:
+        if len(self.items) >= self.maxsize and not self._evict_below(priority):
+            self._dropped(priority)
+            return False
+        self.items.append((priority, kind, payload))
+        self.counts[priority] += 1
+        self.ready.set()
+        return True
+
+    def _evict_below(self, priority: int) -> bool:
+        victim = next((p for p in range(priority) if self.counts[p]), None)
+        if victim is None:
+            return False
+        for i, item in enumerate(self.items):
+            if item[0] == victim:
+                del self.items[i]
+                self.counts[victim] -= 1
+                self._dropped(victim)
+                return True
+        return False
+
+    def _dropped(self, priority: int):
+        metrics.incr(f"outbound.dropped.{PRIORITY_NAMES[priority]}")
+        logger.warning(f"Outbound queue full ({self.maxsize}), dropped a {PRIORITY_NAMES[priority]} priority payload")
+
+    def take(self, max_items: int) -> list[tuple]:
+        """Remove and return up to max_items (kind, payload) pairs, oldest first."""
+        batch = []
+        while self.items and len(batch) < max_items:
+            priority, kind, payload = self.items.popleft()
+            self.counts[priority] -= 1
+            batch.append((kind, payload))
+        if not self.items:
+            self.ready.clear()
+        metrics.gauge("outbound.queued", len(self.items))
+        return batch
+
+    async def get_batch(self, max_items: int) -> list[tuple]:
+        while not self.items:
+            await self.ready.wait()
+        return self.take(max_items)
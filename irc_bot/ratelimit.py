@@ -0,0 +1,111 @@
+import re
+import time
+from typing import Optional
+
+SWEEP_INTERVAL = 60  # seconds between evictions of idle buckets
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "capacity", "rate")
+
+    def __init__(self, capacity: int, seconds: float, now: float):
+        self.capacity = capacity
+        self.rate = capacity / seconds
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full_at(self) -> float:
+        return self.updated + (self.capacity - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets per (hostmask, channel, cost class) and per (channel, cost class), checked in
+    the bot before a line crosses the WebSocket. Limits, prefixes and command classes
+    come from the state the logic server pushes down.
+    """
+    def __init__(self, bot_nick: str):
+        self.mention_re = re.compile(rf"\b{re.escape(bot_nick)}\b", re.IGNORECASE)
+        self.default_limits: dict = {}
+        self.channel_limits: dict = {}
+        self.prefixes: dict[str, str] = {}
+        self.command_classes: dict[str, str] = {}
+        self.buckets: dict[tuple, TokenBucket] = {}
+        self.notified: dict[tuple, float] = {}  # (hostmask, cost) -> muted until
+        self.next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def update(self, state: dict):
+        limits = state.get("rate_limits", {})
+        before = {key: self._key_limit(key) for key in self.buckets}
+        self.default_limits = limits.get("default", {})
+        self.channel_limits = limits.get("channels", {})
+        self.prefixes = state.get("prefixes", {})
+        self.command_classes = state.get("command_classes", {})
+        # Most pushes leave limits alone; only buckets whose limit changed start fresh.
+        for key, limit in before.items():
+            if self._key_limit(key) != limit:
+                del self.buckets[key]
+
+    def classify(self, channel: Optional[str], content: str) -> Optional[str]:
+        """Cost class of a message, or None for plain chatter."""
+        prefix = self.prefixes.get(channel, "!") if channel else "!"
+        if content.startswith(prefix):
+            parts = content[len(prefix):].split()
+            cmd = parts[0].lower() if parts else ""
+            if cmd in self.command_classes:
+                return self.command_classes[cmd]
+        if self.mention_re.search(content):
+            return "ai"
+        return "cheap" if content.startswith(prefix) else None
+
+    def _limit(self, channel: Optional[str], cost: str, scope: str):
+        override = self.channel_limits.get(channel, {}).get(cost, {}).get(scope) if channel else None
+        return override or self.default_limits.get(cost, {}).get(scope)
+
+    def _key_limit(self, key: tuple):
+        """The limit a bucket key is checked against: keys end with (channel, cost)."""
+        return self._limit(key[-2], key[-1], key[0])
+
+    def _bucket(self, key: tuple, limit, now: float) -> Optional[TokenBucket]:
+        if not limit:
+            return None
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(limit[0], limit[1], now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def allow(self, hostmask: str, channel: Optional[str], cost: str) -> bool:
+        """Take one token from both the user's and the channel's bucket, or neither."""
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.sweep(now)
+        buckets = [self._bucket(("user", hostmask, channel, cost), self._limit(channel, cost, "user"), now)]
+        if channel:
+            buckets.append(self._bucket(("channel", channel, cost), self._limit(channel, cost, "channel"), now))
+        buckets = [b for b in buckets if b is not None]
+        if any(b.tokens < 1 for b in buckets):
+            return False
+        for b in buckets:
+            b.tokens -= 1
+        return True
+
+    def should_notify(self, hostmask: str, cost: str, mute_for: float = 60) -> bool:
+        """True at most once per `mute_for` seconds per user and class, so warnings can't be used to flood."""
+        now = time.monotonic()
+        key = (hostmask, cost)
+        if self.notified.get(key, 0) > now:
+            return False
+        self.notified[key] = now + mute_for
+        return True
+
+    def sweep(self, now: float):
+        """Drop buckets that have refilled completely; they are equivalent to new ones."""
+        self.buckets = {k: b for k, b in self.buckets.items() if b.full_at() > now}
+        self.notified = {k: t for k, t in self.notified.items() if t > now}
+        self.next_sweep = now + SWEEP_INTERVAL
@@ -0,0 +1,188 @@
+import json
+import os
+import time
+from typing import Optional
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("irc_bot.spool")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+CURSOR_FILE = "cursor.json"
+
+
+class Spool:
+    """
+    Bounded, disk-backed FIFO of outbound WS payloads, used while the logic server is
+    unreachable. Records are appended as JSON lines to numbered segment files; the
+    reader position is persisted in a cursor file, so a bot restart mid-outage resumes
+    where it left off (at-least-once: a record may be resent after a crash). When the
+    spool exceeds max_bytes the oldest segments are dropped.
+
+    Every record has a kind: "event" records (JOIN/PART/NICK, chatter, lines the bot
+    sent) are always replayed; "command" records (commands, mentions, WHOIS replies)
+    go stale after command_max_age seconds.
+    """
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int, command_max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.command_max_age = command_max_age
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(self._segment_seq(f) for f in os.listdir(directory) if f.startswith(SEGMENT_PREFIX))
+        self.read_seq, self.read_offset = self._load_cursor()
+        self.writer = None
+        self.write_seq = self.segments[-1] if self.segments else 0
+        self.reader = None
+        self.pending_commit = None
+        self.count = self._count_backlog()
+        if self.count:
+            logger.info(f"Spool has {self.count} records left over from a previous run")
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _segment_seq(filename: str) -> int:
+        return int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _load_cursor(self) -> tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                cur = json.load(f)
+            return cur["seq"], cur["offset"]
+        except (OSError, ValueError, KeyError):
+            return (self.segments[0] if self.segments else 0), 0
+
+    def _save_cursor(self):
+        tmp = os.path.join(self.directory, CURSOR_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"seq": self.read_seq, "offset": self.read_offset}, f)
+        os.replace(tmp, os.path.join(self.directory, CURSOR_FILE))
+
+    def _count_backlog(self) -> int:
+        count = 0
+        for seq in self.segments:
+            if seq < self.read_seq:
+                continue
+            with open(self._path(seq), "rb") as f:
+                if seq == self.read_seq:
+                    f.seek(self.read_offset)
+                count += sum(1 for _ in f)
+        return count
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(self._path(seq)) for seq in self.segments if os.path.exists(self._path(seq)))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, payload: dict, kind: str = "event"):
+        if self.writer is None or self.writer.tell() >= self.segment_bytes:
+            self._roll()
+        self.writer.write(json.dumps({"ts": time.time(), "kind": kind, "payload": payload}) + "\n")
+        self.writer.flush()
+        self.count += 1
+        metrics.incr("spool.appended")
+        metrics.gauge("spool.backlog", self.count)
+        if self.writer.tell() >= self.segment_bytes:
+            self._enforce_limit()
+
+    def _roll(self):
+        if self.writer:
+            os.fsync(self.writer.fileno())
+            self.writer.close()
+        self.write_seq += 1
+        self.segments.append(self.write_seq)
+        self.writer = open(self._path(self.write_seq), "a", encoding="utf-8")
+        if not self.count:
+            # Nothing unread: older segments are fully delivered, start reading at the new one
+            self._close_reader()
+            for seq in self.segments[:-1]:
+                if os.path.exists(self._path(seq)):
+                    os.remove(self._path(seq))
+            self.segments = self.segments[-1:]
+            self.read_seq, self.read_offset = self.write_seq, 0
+            self._save_cursor()
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        while len(self.segments) > 1 and self.size_bytes() > self.max_bytes:
+            oldest = self.segments.pop(0)
+            path = self._path(oldest)
+            with open(path, "rb") as f:
+                if oldest == self.read_seq:
+                    f.seek(self.read_offset)
+                lost = sum(1 for _ in f) if oldest >= self.read_seq else 0
+            os.remove(path)
+            self.count -= lost
+            metrics.incr("spool.dropped_overflow", lost)
+            logger.warning(f"Spool over {self.max_bytes} bytes: dropped segment {oldest} ({lost} unsent records)")
+            if oldest >= self.read_seq:
+                self.read_seq, self.read_offset = self.segments[0], 0
+                self._close_reader()
+                self._save_cursor()
+
+    def _close_reader(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+    def peek(self) -> Optional[dict]:
+        """
+        Next record to send, as {"ts", "kind", "payload"}, or None if drained.
+        Call commit() once it has been delivered; peek() again returns the same record until then.
+        """
+        while self.count > 0:
+            if self.reader is None:
+                if self.read_seq not in self.segments:
+                    later = [s for s in self.segments if s > self.read_seq]
+                    if not later:
+                        return None
+                    self.read_seq, self.read_offset = later[0], 0
+                self.reader = open(self._path(self.read_seq), "r", encoding="utf-8")
+                self.reader.seek(self.read_offset)
+            line = self.reader.readline()
+            if line.endswith("\n"):
+                self.pending_commit = self.reader.tell()
+                self.reader.seek(self.read_offset)
+                try:
+                    return json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt spool record in segment {self.read_seq}")
+                    self._advance()
+                    continue
+            if self.read_seq == self.write_seq or self.read_seq == self.segments[-1]:
+                return None  # caught up with the writer
+            # Finished an older segment: delete it and move on
+            self._close_reader()
+            os.remove(self._path(self.read_seq))
+            self.segments.remove(self.read_seq)
+            self.read_offset = 0
+        return None
+
+    def _advance(self):
+        self.read_offset = self.pending_commit
+        self.reader.seek(self.read_offset)
+        self.pending_commit = None
+        self.count -= 1
+
+    def commit(self):
+        """Mark the record returned by the last peek() as delivered."""
+        if self.pending_commit is None:
+            return
+        self._advance()
+        metrics.gauge("spool.backlog", self.count)
+        self._save_cursor()
+
+    def is_stale(self, record: dict) -> bool:
+        return record["kind"] == "command" and time.time() - record["ts"] > self.command_max_age
+
+    def close(self):
+        if self.writer:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.writer.close()
+            self.writer = None
+        self._close_reader()
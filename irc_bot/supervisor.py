@@ -0,0 +1,350 @@
+"""
+supervisor.py
+Keeps the bot's two links up: the WebSocket to the logic server and the IRC connection.
+
+The WebSocket is probed every LINK_HEARTBEAT_INTERVAL seconds with a "heartbeat" message.
+IRC is probed with a PING only after IRC_PING_INTERVAL seconds without any line from the
+server, since servers throttle clients that ping often and any inbound line already shows
+the link is alive. Round-trip times feed a smoothed RTT and deviation as in
+TCP (RFC 6298), and a probe not answered within max(LINK_TIMEOUT_MIN, srtt + 4 * rttvar)
+fails the link. A failed link is torn down at once, so whatever reads from it returns
+instead of waiting on a dead socket, and reconnected with exponential backoff. The
+WebSocket tries the standby logic servers (LOGIC_SERVER_STANDBY) in order before backing
+off, and goes back to the primary once it answers again. After an IRC reconnect the bot
+rejoins the channels it was in.
+
+Every outage is timed from detection until the link is back (for IRC, until the server
+welcomes us); the mean time to recovery is logged, kept in metrics and sent to the logic
+server with each heartbeat for !admin clients.
+"""
+import asyncio
+import json
+import socket
+import time
+from datetime import datetime
+from typing import Optional
+import config
+import irc.client
+import websockets
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("irc_bot.supervisor")
+
+MAX_BACKOFF = 60
+IRC_REGISTER_TIMEOUT = 30  # seconds from TCP connect to the server's welcome
+
+
+class LinkHealth:
+    """Smoothed RTT and outage history of one link."""
+    __slots__ = ("name", "srtt", "rttvar", "up", "down_since", "outages", "downtime", "longest")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.up = False
+        self.down_since: Optional[float] = None  # None until the first failure
+        self.outages = 0
+        self.downtime = 0.0
+        self.longest = 0.0
+
+    def rtt_sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        metrics.observe(f"link.{self.name}.rtt_s", rtt)
+        metrics.gauge(f"link.{self.name}.srtt_ms", round(self.srtt * 1000, 1))
+
+    def timeout(self) -> float:
+        """How long to wait for a heartbeat reply before declaring the link dead."""
+        if self.srtt is None:
+            return config.LINK_TIMEOUT_MIN
+        return max(config.LINK_TIMEOUT_MIN, self.srtt + 4 * self.rttvar)
+
+    def failed(self, reason: str, since: Optional[float] = None):
+        """since: when the link was last known to work, if earlier than now (e.g. an unanswered probe)."""
+        if self.up or self.down_since is None:
+            self.down_since = since or time.monotonic()
+            metrics.incr(f"link.{self.name}.failures")
+            logger.warning(f"{self.name} link down: {reason}")
+        else:
+            logger.debug(f"{self.name} link still down: {reason}")
+        self.up = False
+        metrics.gauge(f"link.{self.name}.up", 0)
+
+    def recovered(self):
+        self.up = True
+        metrics.gauge(f"link.{self.name}.up", 1)
+        if self.down_since is None:
+            return
+        took = time.monotonic() - self.down_since
+        self.down_since = None
+        self.outages += 1
+        self.downtime += took
+        self.longest = max(self.longest, took)
+        metrics.observe(f"link.{self.name}.recovery_s", took)
+        logger.info(f"{self.name} link recovered after {took:.1f}s "
+                    f"(MTTR {self.mttr:.1f}s over {self.outages} outages, longest {self.longest:.1f}s)")
+
+    @property
+    def mttr(self) -> float:
+        return self.downtime / self.outages if self.outages else 0.0
+
+    def report(self) -> dict:
+        return {
+            "up": self.up,
+            "rtt_ms": round(self.srtt * 1000, 1) if self.srtt is not None else None,
+            "outages": self.outages,
+            "mttr_s": round(self.mttr, 2),
+        }
+
+
+class Supervisor:
+    def __init__(self, bot):
+        self.bot = bot
+        self.ws = LinkHealth("ws")
+        self.irc = LinkHealth("irc")
+        primary = f"{config.LOGIC_SERVER_HOST}:{config.LOGIC_SERVER_PORT}"
+        self.addresses = [primary] + [a for a in config.LOGIC_SERVER_STANDBY if a != primary]
+        self.restore_channels: set[str] = set()  # channels to rejoin after an IRC reconnect
+        self._heartbeat_id = 0
+        self._heartbeat_reply: Optional[asyncio.Future] = None
+        self._ping_reply: Optional[tuple[str, asyncio.Future]] = None
+        self._irc_inbound = 0.0  # monotonic time of the last line from the IRC server
+        self._irc_welcome: Optional[asyncio.Future] = None
+        self._irc_lost: Optional[asyncio.Future] = None
+        self._irc_dead_since: Optional[float] = None  # last known good, for an outage we detected
+        self._failing_back = False  # the current WS is being closed to go back to the primary
+
+    def report(self) -> dict:
+        return {"ws": self.ws.report(), "irc": self.irc.report()}
+
+    # --- WebSocket link ---------------------------------------------------------
+
+    async def run_ws(self):
+        """Connect to the logic server (or a standby) and stay connected."""
+        index, backoff = 0, 1
+        while True:
+            uri = f"ws://{self.addresses[index]}"
+            try:
+                ws = await websockets.connect(uri, ping_interval=None, open_timeout=config.LINK_CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                self._ws_failed(f"cannot connect to {uri}: {e}")
+                index = (index + 1) % len(self.addresses)
+                if index == 0:
+                    logger.warning(f"No logic server reachable; retrying in {backoff}s")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = 1
+            if index:
+                metrics.incr("link.ws.failovers")
+                logger.warning(f"Failed over to standby logic server {uri}")
+            back_to_primary = await self._ws_session(ws, uri, standby=index > 0)
+            # Straight back to the primary after a failback, else try the next address first
+            index = 0 if back_to_primary else (index + 1) % len(self.addresses)
+
+    async def _ws_session(self, ws, uri: str, standby: bool) -> bool:
+        """Serve one connection until it closes or fails; True if it was closed to fail back."""
+        bot = self.bot
+        bot.ws = ws
+        tasks = [asyncio.create_task(self._probe_ws(ws))]
+        self._failing_back = False
+        if standby:
+            tasks.append(asyncio.create_task(self._probe_primary(ws)))
+        try:
+            await ws.send(json.dumps(bot.hello()))
+            bot.ws_down_since = None
+            self.ws.recovered()
+            logger.info(f"WS connected to {uri}")
+            bot._ensure_drain()
+            await bot.process_ws(ws)
+            reason = f"closed (code {ws.close_code})"
+        except websockets.exceptions.ConnectionClosed as e:
+            reason = f"connection lost: {e}"
+        except Exception as e:
+            logger.error(f"WS session error: {e}", exc_info=True)
+            reason = f"error: {e}"
+        finally:
+            failed_back = self._failing_back
+            for task in tasks:
+                task.cancel()
+            if bot.ws is ws:
+                bot.ws = None
+            self.abort_ws(ws)
+        if failed_back:
+            self.ws.up = False  # a planned switch, not an outage
+        else:
+            self._ws_failed(reason)
+        return failed_back
+
+    def _ws_failed(self, reason: str):
+        self.ws.failed(reason)
+        if not self.bot.ws_down_since:
+            self.bot.ws_down_since = datetime.now()
+
+    def abort_ws(self, ws, reason: Optional[str] = None, since: Optional[float] = None):
+        """Drop the connection without a closing handshake, which a dead peer would never answer."""
+        if reason:
+            logger.warning(f"Closing WS: {reason}")
+            self.ws.failed(reason, since)
+        if self.bot.ws is ws:
+            self.bot.ws = None
+        transport = getattr(ws, "transport", None)
+        if transport is not None:
+            transport.abort()
+
+    def on_heartbeat(self, data: dict):
+        """A heartbeat reply from the logic server (servers that do not echo the id answer the latest)."""
+        reply = self._heartbeat_reply
+        if reply is not None and not reply.done() and data.get("id", self._heartbeat_id) == self._heartbeat_id:
+            reply.set_result(time.monotonic())
+
+    async def _probe_ws(self, ws):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(config.LINK_HEARTBEAT_INTERVAL)
+            self._heartbeat_id += 1
+            self._heartbeat_reply = reply = loop.create_future()
+            sent = time.monotonic()
+            message = json.dumps({"type": "heartbeat", "id": self._heartbeat_id, "link": self.report()})
+            try:
+                await asyncio.wait_for(self._send_and_wait(ws, message, reply), self.ws.timeout())
+            except asyncio.TimeoutError:
+                self.abort_ws(ws, f"no heartbeat reply within {self.ws.timeout():.1f}s", since=sent)
+                return
+            except websockets.exceptions.ConnectionClosed:
+                return
+            self.ws.rtt_sample(reply.result() - sent)
+
+    @staticmethod
+    async def _send_and_wait(ws, message: str, reply: asyncio.Future):
+        await ws.send(message)
+        await reply
+
+    async def _probe_primary(self, ws):
+        """While on a standby, check the primary now and then; close the standby link once it answers."""
+        uri = f"ws://{self.addresses[0]}"
+        while True:
+            await asyncio.sleep(config.LINK_FAILBACK_INTERVAL)
+            try:
+                probe = await websockets.connect(uri, ping_interval=None, open_timeout=config.LINK_CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                continue
+            await probe.close()
+            logger.info(f"Primary logic server {uri} is back, failing back")
+            metrics.incr("link.ws.failbacks")
+            self._failing_back = True
+            if self.bot.ws is ws:
+                self.bot.ws = None
+            await ws.close()
+            return
+
+    # --- IRC link ---------------------------------------------------------------
+
+    async def run_irc(self):
+        """Connect to IRC, keep the connection probed, and reconnect whenever it drops."""
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while True:
+            self._irc_lost = loop.create_future()
+            self._irc_welcome = loop.create_future()
+            try:
+                await self._irc_connect()
+            except (OSError, asyncio.TimeoutError, irc.client.ServerConnectionError) as e:
+                self.irc.failed(f"cannot connect to {config.IRC_SERVER}:{config.IRC_PORT}: {e!r}")
+                logger.warning(f"IRC reconnect in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            probe = asyncio.create_task(self._probe_irc())
+            try:
+                await self._irc_lost
+            finally:
+                probe.cancel()
+            if self._irc_welcome.done():
+                backoff = 1  # it was registered and working; retry soon
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def _irc_connect(self):
+        """Connect the bot's one ServerConnection; the socket is opened without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(config.IRC_SERVER, config.IRC_PORT, type=socket.SOCK_STREAM)
+        family, type_, proto, _, address = infos[0]
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(sock, address), config.LINK_CONNECT_TIMEOUT)
+            sock.setblocking(True)
+        except BaseException:
+            sock.close()
+            raise
+        logger.info(f"Connected to IRC server {config.IRC_SERVER}:{config.IRC_PORT}, registering")
+        self.bot.connection.connect(config.IRC_SERVER, config.IRC_PORT, config.BOT_NICK,
+                                    connect_factory=lambda _address: sock)
+
+    def irc_welcomed(self):
+        if self._irc_welcome is not None and not self._irc_welcome.done():
+            self._irc_welcome.set_result(None)
+        self.irc.recovered()
+
+    def irc_disconnected(self, reason: str):
+        """Called from the disconnect event; remembers the channels to rejoin."""
+        if self.irc.up:  # registered, so the tracker knows where we were
+            self.restore_channels = set(self.bot.tracker.joined())
+        self.irc.failed(reason or "disconnected", self._irc_dead_since)
+        self._irc_dead_since = None
+        if self._irc_lost is not None and not self._irc_lost.done():
+            self._irc_lost.set_result(None)
+
+    def drop_irc(self, reason: str, since: Optional[float] = None):
+        """Tear the IRC connection down; the disconnect event starts the reconnect."""
+        logger.warning(f"Closing IRC connection: {reason}")
+        self._irc_dead_since = since
+        if self.bot.connection.is_connected():
+            self.bot.connection.disconnect(reason)
+        else:
+            self.irc_disconnected(reason)
+
+    def on_irc_line(self, connection, event):
+        self._irc_inbound = time.monotonic()
+
+    def on_pong(self, connection, event):
+        pending = self._ping_reply
+        if pending is None:
+            return
+        token, reply = pending
+        if not reply.done() and (token in event.arguments or event.target == token):
+            reply.set_result(time.monotonic())
+
+    async def _probe_irc(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._irc_welcome), IRC_REGISTER_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.drop_irc(f"no welcome from the server within {IRC_REGISTER_TIMEOUT}s")
+            return
+        n = 0
+        self._irc_inbound = time.monotonic()
+        while True:
+            idle = time.monotonic() - self._irc_inbound
+            if idle < config.IRC_PING_INTERVAL:
+                await asyncio.sleep(config.IRC_PING_INTERVAL - idle)
+                continue
+            n += 1
+            token = f"lolo-{n}"
+            reply = loop.create_future()
+            self._ping_reply = (token, reply)
+            sent = time.monotonic()
+            self.bot.connection.ping(token)
+            try:
+                await asyncio.wait_for(reply, self.irc.timeout())
+            except asyncio.TimeoutError:
+                self.drop_irc(f"Ping timeout ({self.irc.timeout():.1f}s)", since=sent)
+                return
+            self._irc_inbound = max(self._irc_inbound, reply.result())  # the PONG is inbound too
+            self.irc.rtt_sample(reply.result() - sent)
@@ -0,0 +1,135 @@
+import sys
+from typing import Optional
+from irc.strings import lower as irc_lower
+from shared import metrics
+
+
+class ChannelTracker:
+    """
+    Who is in which channel, and each visible user's ident@host, kept up to date from
+    NAMES, WHO, JOIN, PART, QUIT, NICK and KICK. A user is only remembered while they
+    share at least one channel with the bot, so memory is bounded by the rosters the
+    bot can actually see. Keys are RFC 1459 case-folded nicks and channels.
+    """
+    def __init__(self):
+        self.channels: dict[str, set[str]] = {}  # channel key -> nick keys
+        self.users: dict[str, list] = {}  # nick key -> [nick, ident, host, channel count]
+
+    def lookup(self, nick: str) -> Optional[tuple[str, str]]:
+        """(ident, host) if the user is in one of our channels and their host is known."""
+        info = self.users.get(irc_lower(nick))
+        if not info or info[2] is None:
+            return None
+        return info[1], info[2]
+
+    def members(self, channel: str) -> list[str]:
+        return [self.users[key][0] for key in self.channels.get(irc_lower(channel), ())]
+
+    def joined(self) -> list[str]:
+        """Channels (case-folded) the bot is in."""
+        return list(self.channels)
+
+    def channels_of(self, nick: str) -> list[str]:
+        """Channels (case-folded) the bot shares with nick."""
+        key = irc_lower(nick)
+        return [channel for channel, roster in self.channels.items() if key in roster]
+
+    def reset(self):
+        self.channels.clear()
+        self.users.clear()
+        self._publish_gauges()
+
+    def _see(self, nick: str, ident: Optional[str] = None, host: Optional[str] = None) -> str:
+        key = sys.intern(irc_lower(nick))
+        info = self.users.get(key)
+        if info is None:
+            info = self.users[key] = [nick, None, None, 0]
+        if host:
+            info[1], info[2] = sys.intern(ident), sys.intern(host)
+        return key
+
+    def _add(self, channel: str, nick: str, ident: Optional[str] = None, host: Optional[str] = None):
+        key = self._see(nick, ident, host)
+        roster = self.channels.setdefault(irc_lower(channel), set())
+        if key not in roster:
+            roster.add(key)
+            self.users[key][3] += 1
+
+    def _remove(self, channel: str, nick: str):
+        key = irc_lower(nick)
+        roster = self.channels.get(irc_lower(channel))
+        if roster is None or key not in roster:
+            return
+        roster.discard(key)
+        self._release(key)
+
+    def _release(self, key: str):
+        info = self.users[key]
+        info[3] -= 1
+        if info[3] <= 0:
+            del self.users[key]
+
+    def _publish_gauges(self):
+        metrics.gauge("tracker.channels", len(self.channels))
+        metrics.gauge("tracker.users", len(self.users))
+
+    # --- fed from IRC events; source hostmasks are "nick!ident@host" ---
+
+    def on_join(self, channel: str, hostmask: str, is_self: bool):
+        if is_self:
+            self.drop_channel(channel)
+            self.channels[irc_lower(channel)] = set()
+        nick, _, rest = hostmask.partition("!")
+        ident, _, host = rest.partition("@")
+        self._add(channel, nick, ident or None, host or None)
+        self._publish_gauges()
+
+    def on_names(self, channel: str, names: str):
+        for name in names.split():
+            self._add(channel, name.lstrip("~&@%+"))
+        self._publish_gauges()
+
+    def on_who(self, channel: str, ident: str, host: str, nick: str):
+        if irc_lower(channel) in self.channels:
+            self._add(channel, nick, ident, host)
+        elif irc_lower(nick) in self.users:
+            self._see(nick, ident, host)
+
+    def on_whois(self, nick: str, ident: str, host: str):
+        if irc_lower(nick) in self.users:
+            self._see(nick, ident, host)
+
+    def on_part(self, channel: str, nick: str, is_self: bool):
+        if is_self:
+            self.drop_channel(channel)
+        else:
+            self._remove(channel, nick)
+        self._publish_gauges()
+
+    on_kick = on_part
+
+    def on_quit(self, nick: str):
+        key = irc_lower(nick)
+        if key not in self.users:
+            return
+        for roster in self.channels.values():
+            roster.discard(key)
+        del self.users[key]
+        self._publish_gauges()
+
+    def on_nick(self, old: str, new: str):
+        old_key, new_key = irc_lower(old), sys.intern(irc_lower(new))
+        info = self.users.pop(old_key, None)
+        if info is None:
+            return
+        info[0] = new
+        self.users[new_key] = info
+        if old_key != new_key:
+            for roster in self.channels.values():
+                if old_key in roster:
+                    roster.discard(old_key)
+                    roster.add(new_key)
+
+    def drop_channel(self, channel: str):
+        for key in self.channels.pop(irc_lower(channel), ()):
+            self._release(key)
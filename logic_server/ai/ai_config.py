@@ -14,4 +14,42 @@ top_p = 0.95
 stop_sequences = []  
 safety_settings = None
 
-AI_CONTEXT_LINES = 50
\ No newline at end of file
+AI_CONTEXT_LINES = 50
+
+# Scheduling of AI requests (see scheduler.py)
+AI_MAX_CONCURRENCY = 4       # AI requests running at once across all channels
+AI_MAX_QUEUED = 100          # queued requests beyond this are rejected outright
+AI_REQUEST_DEADLINE = 60     # seconds from the mention until the answer is no longer useful
+
+# Tool calls from one model turn run concurrently (see tool_runner.py)
+MAX_TOOL_ROUNDS = 5          # model turns that may request tools before we stop and ask for an answer
+TOOL_MAX_WORKERS = 16        # tool calls running at once across all AI requests
+TOOL_TIMEOUT = 10            # seconds per tool call unless listed below
+TOOL_TIMEOUTS = {"web_search": 30}
+
+# Providers and routing (see providers.py). Routes list providers in order of preference;
+# ones without an API key are skipped. "AI_PROVIDER": "stub" in config.json pins everything to the stub.
+AI_PROVIDERS = {
+    "gemini-pro": {"type": "gemini", "model": default_model},
+    "gemini-flash": {"type": "gemini", "model": "gemini-2.0-flash"},
+    "openai-mini": {"type": "openai", "model": "gpt-4o-mini"},
+    "openai": {"type": "openai", "model": "gpt-4o"},
+    "stub": {"type": "stub"},
+}
+AI_ROUTES = {
+    "short": ["gemini-flash", "openai-mini"],  # chat without tools: cheap, fast models
+    "tools": ["gemini-pro", "openai"],         # long or tool-heavy questions
+}
+AI_SHORT_PROMPT_CHARS = 200  # longer questions take the "tools" route
+AI_HEDGE_AFTER = 8.0         # seconds before a backup provider is raced against a slow one; None disables
+AI_BREAKER_FAILURES = 3      # consecutive errors before a provider is skipped
+AI_BREAKER_RESET = 30        # seconds before a tripped provider gets a trial request
+
+# Retrieval of relevant older lines for AI prompts (see retrieval.py; needs numpy and "AI_RETRIEVAL": true)
+AI_RETRIEVAL_K = 15          # similar older lines added to the prompt
+AI_RECENT_LINES = 10         # most recent lines always included
+RETRIEVAL_DIM = 256          # hashed embedding size; changing it discards saved indexes
+RETRIEVAL_MAX_LINES = 20000  # newest lines indexed per channel (20000 x 256 float32 = 20 MB)
+RETRIEVAL_FLUSH_EVERY = 500  # new lines kept in memory before the channel's index file is rewritten
+RETRIEVAL_MAX_PENDING = 10000
+RETRIEVAL_MIN_SCORE = 0.2    # cosine similarity below which a line is not considered relevant
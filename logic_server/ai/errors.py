@@ -0,0 +1,2 @@
+class AIProviderError(Exception):
+    """A provider could not produce an answer (not configured, network error, bad response); try another."""
@@ -4,7 +4,9 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from .tool_impl import available_tool_implementations
+from .tool_impl import available_tool_implementations, TOOL_FUNCTIONS
+from .tool_runner import run_tool_calls
+from .errors import AIProviderError
 
 from .ai_config import (
     default_model,
@@ -15,6 +17,7 @@ from .ai_config import (
     top_p,
     stop_sequences,
     safety_settings,
+    MAX_TOOL_ROUNDS,
 )
 from shared.logger import setup_logger
 
@@ -32,46 +35,80 @@ except Exception as e:
     logger.error(f"Failed to configure Gemini client: {e}")
     genai_configured = False
 
-try:
-    if genai_configured:
-        generation_config = genai.types.GenerationConfig(
-            temperature=temperature,
-            max_output_tokens=max_tokens,
-            top_k=top_k,
-            top_p=top_p,
-            stop_sequences=stop_sequences if stop_sequences else None,
-        )
-        generative_model = genai.GenerativeModel(
-            model_name=default_model,
-            system_instruction=system_prompt,
-            safety_settings=safety_settings,
-            tools=available_tool_implementations,
-            generation_config=generation_config
-        )
-        logger.info(f"Gemini model '{default_model}' initialized with tools: {[f.__name__ for f in available_tool_implementations]}")
-    else:
-        generative_model = None
-        logger.warning("Gemini model not initialized due to configuration issues.")
-
-except Exception as e:
-    logger.error(f"Failed to initialize GenerativeModel: {e}", exc_info=True)
-    generative_model = None
-
 
-def get_response_with_function_calling(prompt: str) -> str:
+class GeminiProvider:
+    """One Gemini model behind the provider interface (see providers.py)."""
+    def __init__(self, name: str, model: str = default_model):
+        self.name = name
+        self.model = model
+        self.generative_model = None
+        if not genai_configured:
+            return
+        try:
+            generation_config = genai.types.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+                top_k=top_k,
+                top_p=top_p,
+                stop_sequences=stop_sequences if stop_sequences else None,
+            )
+            self.generative_model = genai.GenerativeModel(
+                model_name=model,
+                system_instruction=system_prompt,
+                safety_settings=safety_settings,
+                tools=available_tool_implementations,
+                generation_config=generation_config
+            )
+            logger.info(f"Gemini model '{model}' initialized with tools: {[f.__name__ for f in available_tool_implementations]}")
+        except Exception as e:
+            logger.error(f"Failed to initialize GenerativeModel '{model}': {e}", exc_info=True)
+
+    @property
+    def configured(self) -> bool:
+        return self.generative_model is not None
+
+    def complete(self, prompt: str) -> str:
+        return get_response_with_function_calling(self.generative_model, prompt)
+
+
+def _function_calls(response) -> list:
+    if not response.candidates:
+        return []
+    return [part.function_call for part in response.candidates[0].content.parts if "function_call" in part]
+
+def _run_function_calls(calls: list) -> list:
+    """Run every function call from one model turn concurrently and wrap the results for the reply."""
+    requested = [(fc.name, genai.protos.FunctionCall.to_dict(fc).get("args", {})) for fc in calls]
+    results = run_tool_calls(requested, TOOL_FUNCTIONS)
+    return [
+        genai.protos.Part(function_response=genai.protos.FunctionResponse(name=fc.name, response=result))
+        for fc, result in zip(calls, results)
+    ]
+
+def get_response_with_function_calling(generative_model, prompt: str) -> str:
     """
-    Gets a response from Gemini using a ChatSession for robust automatic
-    function calling.
+    Gets a response from Gemini using a ChatSession. Function calling is driven here
+    rather than by the SDK, so all the tools the model asks for in one turn run
+    concurrently instead of one after another. Raises AIProviderError when the
+    service fails, so the caller can fail over to another provider.
     """
-    if not genai_configured:
-        return "Error: Gemini AI client is not configured. Check API key."
     if not generative_model:
-         return "Error: Gemini AI model failed to initialize."
+        raise AIProviderError("Gemini AI model is not configured. Check API key.")
 
     try:
-        chat = generative_model.start_chat(enable_automatic_function_calling=True)
+        chat = generative_model.start_chat()
         logger.info(f"Sending prompt to Gemini ChatSession: '{prompt}'")
         response = chat.send_message(prompt)
+        for _ in range(MAX_TOOL_ROUNDS):
+            calls = _function_calls(response)
+            if not calls:
+                break
+            logger.info(f"Gemini requested {len(calls)} tool call(s): {[fc.name for fc in calls]}")
+            response = chat.send_message(_run_function_calls(calls))
+        else:
+            if _function_calls(response):
+                logger.warning(f"Gemini still requesting tools after {MAX_TOOL_ROUNDS} rounds for prompt: '{prompt}'")
+                return "Sorry, I couldn't finish looking that up."
 
         logger.debug(f"Gemini ChatSession Raw Response: {response}")
 
@@ -98,14 +135,14 @@ def get_response_with_function_calling(prompt: str) -> str:
 
     except ConnectionError as e:
         logger.error(f"Network error connecting to Gemini: {e}")
-        return "Error: Could not connect to the AI service."
+        raise AIProviderError("Could not connect to Gemini") from e
     except AttributeError as e:
          logger.error(f"Attribute error processing Gemini response: {e}", exc_info=True)
          last_response_str = f"Last response state: {response}" if 'response' in locals() else "Response object not available."
          logger.error(last_response_str)
-         return f"An internal error occurred processing the AI response."
+         raise AIProviderError("Could not process the Gemini response") from e
     except Exception as e:
         logger.error(f"An unexpected error occurred in Gemini chat interaction: {e}", exc_info=True)
         last_response_str = f"Last response state: {response}" if 'response' in locals() else "Response object not available."
         logger.error(last_response_str)
-        return f"An unexpected error occurred while processing your request with the AI."
\ No newline at end of file
+        raise AIProviderError(f"Gemini request failed: {e}") from e
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+openai_chat.py
+OpenAI chat completions behind the provider interface, with the same tools as Gemini.
+Tool schemas are derived from the tool functions' signatures and docstrings.
+"""
+import inspect
+import json
+import os
+import typing
+from dotenv import load_dotenv
+from openai import OpenAI
+from shared.logger import setup_logger
+from .ai_config import system_prompt, temperature, max_tokens, MAX_TOOL_ROUNDS
+from .errors import AIProviderError
+from .tool_impl import available_tool_implementations, TOOL_FUNCTIONS
+from .tool_runner import run_tool_calls
+
+load_dotenv()
+
+logger = setup_logger("openai_ai")
+
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+def _json_type(annotation) -> dict:
+    if typing.get_origin(annotation) is list:
+        (item,) = typing.get_args(annotation) or (str,)
+        return {"type": "array", "items": _json_type(item)}
+    return {"type": JSON_TYPES.get(annotation, "string")}
+
+def tool_schema(func) -> dict:
+    """OpenAI function tool definition for one of our tool functions."""
+    doc = inspect.getdoc(func) or ""
+    description = doc.split("\nArgs:")[0].strip()
+    params = inspect.signature(func).parameters
+    return {
+        "type": "function",
+        "function": {
+            "name": func.__name__,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {name: _json_type(p.annotation) for name, p in params.items()},
+                "required": [name for name, p in params.items() if p.default is inspect.Parameter.empty],
+            },
+        },
+    }
+
+TOOL_SCHEMAS = [tool_schema(f) for f in available_tool_implementations]
+
+
+class OpenAIProvider:
+    """One OpenAI chat model behind the provider interface (see providers.py)."""
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+        api_key = os.getenv("OPENAI_API_KEY")
+        self.client = OpenAI(api_key=api_key) if api_key else None
+
+    @property
+    def configured(self) -> bool:
+        return self.client is not None
+
+    def complete(self, prompt: str) -> str:
+        if not self.client:
+            raise AIProviderError("OpenAI API key not found in environment.")
+        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+        try:
+            for _ in range(MAX_TOOL_ROUNDS + 1):
+                response = self.client.chat.completions.create(
+                    model=self.model, messages=messages, tools=TOOL_SCHEMAS,
+                    temperature=temperature, max_tokens=max_tokens,
+                )
+                message = response.choices[0].message
+                if not message.tool_calls:
+                    return (message.content or "").strip()
+                logger.info(f"{self.model} requested {len(message.tool_calls)} tool call(s): "
+                            f"{[c.function.name for c in message.tool_calls]}")
+                messages.append(message.model_dump(exclude_none=True))
+                calls = [(c.function.name, json.loads(c.function.arguments or "{}")) for c in message.tool_calls]
+                for call, result in zip(message.tool_calls, run_tool_calls(calls, TOOL_FUNCTIONS)):
+                    messages.append({"role": "tool", "tool_call_id": call.id, "content": json.dumps(result)})
+        except Exception as e:
+            logger.error(f"OpenAI request to {self.model} failed: {e}", exc_info=True)
+            raise AIProviderError(f"OpenAI request failed: {e}") from e
+        logger.warning(f"{self.model} still requesting tools after {MAX_TOOL_ROUNDS} rounds for prompt: '{prompt}'")
+        return "Sorry, I couldn't finish looking that up."
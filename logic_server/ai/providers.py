@@ -0,0 +1,196 @@
+"""
+providers.py
+Routes each AI prompt to a provider (Gemini, OpenAI or the offline stub) and
+degrades gracefully when one is slow or down.
+
+A prompt is classified as "short" or "tools" and served by the providers listed for
+that route in AI_ROUTES, in order. If the first has not answered within AI_HEDGE_AFTER
+seconds the next one is started as well and the first answer wins; if a provider
+fails, the next one takes over. Each provider has a circuit breaker, so one that keeps
+failing is skipped until AI_BREAKER_RESET seconds have passed.
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional
+import config
+from shared import metrics, tracing
+from shared.logger import setup_logger
+from logic_server import profiling
+from .ai_config import (
+    AI_PROVIDERS, AI_ROUTES, AI_SHORT_PROMPT_CHARS, AI_HEDGE_AFTER,
+    AI_BREAKER_FAILURES, AI_BREAKER_RESET, AI_MAX_CONCURRENCY,
+)
+from .errors import AIProviderError
+
+logger = setup_logger("ai.providers")
+
+# Words that suggest the model will want a tool, so the larger model is worth it
+TOOL_HINTS = re.compile(r"\b(price|prices|stock|stocks|crypto|search|look up|lookup|news|latest|uptime|"
+                        r"said|earlier|history|compare|weather)\b", re.IGNORECASE)
+UNAVAILABLE_REPLY = "Sorry, the AI service is unavailable right now. Please try again later."
+
+# Primary and hedge requests for every running AI job
+_executor = ThreadPoolExecutor(max_workers=AI_MAX_CONCURRENCY * 2, thread_name_prefix="ai-provider")
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` consecutive errors, then open for `reset_after` seconds.
+    After that a single trial request is let through (half-open): success closes the
+    breaker, failure opens it again.
+    """
+    def __init__(self, name: str, failures: int = AI_BREAKER_FAILURES, reset_after: float = AI_BREAKER_RESET):
+        self.name = name
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial_running and time.monotonic() - self.opened_at >= self.reset_after:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"AI provider {self.name} recovered, closing circuit breaker")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+        metrics.gauge(f"ai.breaker_open.{self.name}", 0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            reopen = self.trial_running or (self.opened_at is None and self.failures >= self.max_failures)
+            self.trial_running = False
+            if reopen:
+                self.opened_at = time.monotonic()
+        if reopen:
+            metrics.incr(f"ai.breaker_trips.{self.name}")
+            metrics.gauge(f"ai.breaker_open.{self.name}", 1)
+            logger.warning(f"AI provider {self.name} failing ({self.failures} errors), "
+                           f"circuit open for {self.reset_after}s")
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+
+def _make_provider(name: str, spec: dict):
+    kind = spec["type"]
+    if kind == "gemini":
+        from .gemini import GeminiProvider
+        return GeminiProvider(name, spec["model"])
+    if kind == "openai":
+        from .openai_chat import OpenAIProvider
+        return OpenAIProvider(name, spec["model"])
+    if kind == "stub":
+        from .stub import StubProvider
+        return StubProvider(name)
+    raise ValueError(f"Unknown AI provider type '{kind}' for {name}")
+
+def _build_providers() -> dict:
+    if config.AI_PROVIDER == "stub":
+        names = {"stub"}
+    else:
+        names = {name for route in AI_ROUTES.values() for name in route}
+    providers = {}
+    for name in sorted(names):
+        try:
+            providers[name] = _make_provider(name, AI_PROVIDERS[name])
+        except Exception as e:
+            logger.error(f"Could not set up AI provider {name}: {e}", exc_info=True)
+    return providers
+
+PROVIDERS = _build_providers()
+BREAKERS = {name: CircuitBreaker(name) for name in PROVIDERS}
+
+
+def classify(prompt: str) -> str:
+    """Route name for a prompt: "tools" for long or tool-flavoured questions, else "short"."""
+    question = prompt.rsplit("User: ", 1)[-1]
+    if len(question) > AI_SHORT_PROMPT_CHARS or TOOL_HINTS.search(question):
+        return "tools"
+    return "short"
+
+def route_for(prompt: str) -> list[str]:
+    if config.AI_PROVIDER == "stub":
+        return ["stub"]
+    return [name for name in AI_ROUTES.get(classify(prompt), ()) if name in PROVIDERS and PROVIDERS[name].configured]
+
+def _call(name: str, prompt: str) -> str:
+    started = time.monotonic()
+    try:
+        with tracing.span(f"ai.{name}"):
+            result = PROVIDERS[name].complete(prompt)
+    except Exception:
+        BREAKERS[name].record_failure()
+        metrics.incr(f"ai.provider_error.{name}")
+        raise
+    BREAKERS[name].record_success()
+    metrics.observe(f"ai.provider_s.{name}", time.monotonic() - started)
+    return result
+
+def get_response_with_function_calling(prompt: str) -> str:
+    """
+    Same contract as the providers' complete(): returns the answer text. Runs in a
+    worker thread (see scheduler.py); blocks until a provider answers or all fail.
+    """
+    route = route_for(prompt)
+    candidates = iter(route)
+    pending = {}
+    hedged = False
+
+    def start_next() -> bool:
+        for name in candidates:
+            if BREAKERS[name].allow():
+                pending[_executor.submit(profiling.bind(_call), name, prompt)] = name
+                return True
+            metrics.incr(f"ai.breaker_skipped.{name}")
+        return False
+
+    if not start_next():
+        logger.error(f"No AI provider available for route {route}")
+        return UNAVAILABLE_REPLY
+    while pending:
+        timeout = None if hedged or AI_HEDGE_AFTER is None else AI_HEDGE_AFTER
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Slow primary: race a backup against it
+            hedged = True
+            if start_next():
+                metrics.incr("ai.hedged")
+                logger.info(f"AI request slower than {AI_HEDGE_AFTER}s, hedging with {list(pending.values())[-1]}")
+            continue
+        for future in done:
+            name = pending.pop(future)
+            try:
+                result = future.result()
+            except AIProviderError as e:
+                logger.warning(f"AI provider {name} failed: {e}")
+                start_next()  # fail over
+                continue
+            except Exception as e:
+                logger.error(f"AI provider {name} raised unexpectedly: {e}", exc_info=True)
+                start_next()
+                continue
+            metrics.incr(f"ai.answered_by.{name}")
+            return result
+    return UNAVAILABLE_REPLY
+
+def provider_status() -> dict:
+    """name -> "ok" | "open" | "unconfigured", for diagnostics."""
+    return {
+        name: ("unconfigured" if not p.configured else "open" if BREAKERS[name].is_open else "ok")
+        for name, p in PROVIDERS.items()
+    }
@@ -0,0 +1,259 @@
+"""
+retrieval.py
+Optional retrieval stage for AI prompts: instead of only the last N lines, the prompt
+gets a short recent window plus the older lines most similar to the question.
+
+Lines are embedded with feature hashing (words and character trigrams hashed into a
+fixed number of dimensions), so no model is needed and embedding a line costs
+microseconds. Each channel's vectors live in a NumPy array persisted as .npy files
+and memory-mapped on load; rows logged since then sit in an in-memory tail until the
+next flush. Requires numpy; without it (or with AI_RETRIEVAL off) the prompt falls
+back to the plain recent-lines context.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+import peewee
+import config
+import logic_server.db as db
+from shared import metrics
+from shared.logger import setup_logger
+from .ai_config import (
+    RETRIEVAL_DIM, RETRIEVAL_MAX_LINES, RETRIEVAL_FLUSH_EVERY, RETRIEVAL_MAX_PENDING, RETRIEVAL_MIN_SCORE,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = setup_logger("ai.retrieval")
+
+WORD_RE = re.compile(r"[a-z0-9][a-z0-9_'.+#-]*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do for from has have he her his i if in is it its me my no not of on "
+    "or our she so that the their them they this to up was we were what when where which who why will "
+    "with you your".split()
+)
+
+
+def available() -> bool:
+    return np is not None and config.AI_RETRIEVAL
+
+
+def _features(text: str) -> list[str]:
+    words = [w for w in WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+    feats = list(words)
+    for w in words:
+        padded = f"<{w}>"
+        feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return feats
+
+def embed(texts: list[str]) -> "np.ndarray":
+    """(len(texts), RETRIEVAL_DIM) float32 unit vectors; all-zero rows for texts with no features."""
+    out = np.zeros((len(texts), RETRIEVAL_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feat in _features(text):
+            h = zlib.crc32(feat.encode())
+            # Words weigh more than their trigrams; the sign bit keeps collisions from only adding up
+            weight = 1.0 if len(feat) > 3 or not feat.startswith("<") else 0.5
+            out[row, h % RETRIEVAL_DIM] += weight if h & 0x80000000 else -weight
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+
+class ChannelIndex:
+    """Vectors and Log ids for one channel: a memory-mapped base plus an in-memory tail."""
+    def __init__(self, path_prefix: str):
+        self.path_prefix = path_prefix
+        self.base_ids = np.zeros(0, dtype=np.int64)
+        self.base_vecs = np.zeros((0, RETRIEVAL_DIM), dtype=np.float32)
+        self.tail_ids: list[int] = []
+        self.tail_vecs: list = []
+
+    @property
+    def last_id(self) -> int:
+        if self.tail_ids:
+            return self.tail_ids[-1]
+        return int(self.base_ids[-1]) if len(self.base_ids) else 0
+
+    def __len__(self) -> int:
+        return len(self.base_ids) + len(self.tail_ids)
+
+    def load(self) -> bool:
+        try:
+            self.base_ids = np.load(self.path_prefix + ".ids.npy", mmap_mode="r")
+            self.base_vecs = np.load(self.path_prefix + ".vecs.npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return False
+        if len(self.base_ids) != len(self.base_vecs) or self.base_vecs.shape[1:] != (RETRIEVAL_DIM,):
+            logger.warning(f"Discarding mismatched vector index {self.path_prefix}")
+            self.base_ids = np.zeros(0, dtype=np.int64)
+            self.base_vecs = np.zeros((0, RETRIEVAL_DIM), dtype=np.float32)
+            return False
+        return True
+
+    def add(self, ids: list[int], vecs: "np.ndarray"):
+        self.tail_ids.extend(ids)
+        self.tail_vecs.extend(vecs)
+
+    def flush(self):
+        """Fold the tail into the base, keep the newest RETRIEVAL_MAX_LINES, persist and re-map."""
+        if not self.tail_ids:
+            return
+        ids = np.concatenate([self.base_ids, np.asarray(self.tail_ids, dtype=np.int64)])[-RETRIEVAL_MAX_LINES:]
+        vecs = np.concatenate([self.base_vecs, np.stack(self.tail_vecs)])[-RETRIEVAL_MAX_LINES:]
+        for suffix, arr in ((".ids.npy", ids), (".vecs.npy", vecs)):
+            tmp = self.path_prefix + ".tmp" + suffix
+            np.save(tmp, arr)
+            os.replace(tmp, self.path_prefix + suffix)
+        self.tail_ids, self.tail_vecs = [], []
+        if not self.load():
+            self.base_ids, self.base_vecs = ids, vecs
+
+    def search(self, query: "np.ndarray", k: int, before_id: int) -> list[int]:
+        """Ids of the k best matches older than before_id, best first."""
+        ids = self.base_ids
+        scores = self.base_vecs @ query if len(ids) else np.zeros(0, dtype=np.float32)
+        if self.tail_ids:
+            ids = np.concatenate([ids, np.asarray(self.tail_ids, dtype=np.int64)])
+            scores = np.concatenate([scores, np.stack(self.tail_vecs) @ query])
+        scores = np.where((ids < before_id) & (scores >= RETRIEVAL_MIN_SCORE), scores, -np.inf)
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [int(ids[i]) for i in top if np.isfinite(scores[i])]
+
+
+class VectorIndex:
+    """Per-channel indexes, fed with new Log rows by the DB writer and queried from read threads."""
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.channels: dict[str, ChannelIndex] = {}
+        self.pending: list = []  # (id, channel, message) logged in loaded channels, not yet embedded
+        self.overflowed = False
+        self.pending_lock = threading.Lock()  # held only briefly, so the DB writer never waits on a search
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path_prefix(self, channel: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(channel.lower().encode()).hexdigest()[:16])
+
+    def on_log(self, row):
+        """Called on the DB writer thread for every new Log row; embedding is deferred to the next search."""
+        if row.target not in self.channels:
+            return  # backfilled from the DB on first use
+        with self.pending_lock:
+            if len(self.pending) >= RETRIEVAL_MAX_PENDING:
+                self.pending = []
+                self.overflowed = True  # catch up from the DB instead
+                return
+            self.pending.append((row.id, row.target, row.message))
+
+    def _channel(self, channel: str) -> ChannelIndex:
+        """Must hold self.lock and be on a DB connection (read pool thread)."""
+        index = self.channels.get(channel)
+        if index is None:
+            index = self.channels[channel] = ChannelIndex(self._path_prefix(channel))
+            if index.load() and index.last_id > (db.Log.select(peewee.fn.MAX(db.Log.id)).scalar() or 0):
+                # The log database was rotated or dropped since this index was built
+                logger.info(f"Rebuilding vector index for {channel}")
+                index = self.channels[channel] = ChannelIndex(index.path_prefix)
+            self._backfill(channel, index)
+        return index
+
+    def _backfill(self, channel: str, index: ChannelIndex):
+        """Embed rows logged while the index was not being fed (first use, or bot restarts)."""
+        rows = list(
+            db.Log.select(db.Log.id, db.Log.message)
+            .where((db.Log.target == channel) & (db.Log.id > index.last_id))
+            .order_by(db.Log.id.desc())
+            .limit(RETRIEVAL_MAX_LINES)
+            .tuples()
+        )[::-1]
+        if not rows:
+            return
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start:start + 1000]
+            index.add([r[0] for r in chunk], embed([r[1] for r in chunk]))
+        index.flush()
+        logger.info(f"Indexed {len(rows)} older lines of {channel}")
+
+    def _drain_pending(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+            overflowed, self.overflowed = self.overflowed, False
+        if overflowed:
+            for channel, index in self.channels.items():
+                self._backfill(channel, index)
+        by_channel: dict[str, list] = {}
+        for row_id, channel, message in pending:
+            by_channel.setdefault(channel, []).append((row_id, message))
+        for channel, rows in by_channel.items():
+            index = self.channels[channel]
+            rows = [r for r in rows if r[0] > index.last_id]
+            if rows:
+                index.add([r[0] for r in rows], embed([r[1] for r in rows]))
+            if len(index.tail_ids) >= RETRIEVAL_FLUSH_EVERY:
+                index.flush()
+
+    def search(self, channel: str, query: str, k: int, before_id: int) -> list[int]:
+        qvec = embed([query])[0]
+        if not qvec.any():
+            return []
+        with self.lock:
+            self._drain_pending()
+            return self._channel(channel).search(qvec, k, before_id)
+
+    def flush(self):
+        with self.lock:
+            self._drain_pending()
+            for index in self.channels.values():
+                index.flush()
+
+
+_index = None
+
+def get_index() -> VectorIndex:
+    global _index
+    if _index is None:
+        _index = VectorIndex(config.VECTOR_INDEX_DIR)
+        db.on_log_insert(_index.on_log)
+    return _index
+
+def close():
+    """Persist in-memory tails; call before the database is closed."""
+    if _index is not None:
+        _index.flush()
+
+def get_relevant_context(channel: str, query: str, k: int, recent: int) -> list[tuple]:
+    """
+    The last `recent` lines plus up to k older lines similar to query, as
+    (timestamp, nick, message) oldest first. Runs on a DB read thread (use aread).
+    """
+    started = time.perf_counter()
+    recent_rows = list(
+        db.Log.select(db.Log.id, db.Log.timestamp, db.Log.nick, db.Log.message)
+        .where(db.Log.target == channel)
+        .order_by(db.Log.id.desc())
+        .limit(recent)
+        .tuples()
+    )
+    before_id = recent_rows[-1][0] if recent_rows else 2 ** 62
+    ids = get_index().search(channel, query, k, before_id)
+    rows = recent_rows
+    if ids:
+        rows = rows + list(
+            db.Log.select(db.Log.id, db.Log.timestamp, db.Log.nick, db.Log.message)
+            .where(db.Log.id.in_(ids))
+            .tuples()
+        )
+    metrics.observe("ai.retrieval_s", time.perf_counter() - started)
+    metrics.observe("ai.retrieval_hits", len(ids))
+    return [(ts, nick, msg) for _, ts, nick, msg in sorted(rows)]
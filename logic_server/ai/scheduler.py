@@ -0,0 +1,169 @@
+"""
+scheduler.py
+Fair, deadline-aware scheduling of AI requests.
+
+Requests are queued per channel and per user and served round-robin (channels first,
+then users within a channel), so one busy channel or one chatty user cannot starve
+everyone else. At most AI_MAX_CONCURRENCY requests run at once. A request that is
+still waiting when its deadline passes is dropped, and a user asking again in the
+same channel supersedes their earlier, unanswered request.
+"""
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from shared import metrics
+from shared.logger import setup_logger
+from logic_server import profiling
+from .ai_config import AI_MAX_CONCURRENCY, AI_MAX_QUEUED, AI_REQUEST_DEADLINE
+
+logger = setup_logger("ai.scheduler")
+
+
+class AIJobDropped(Exception):
+    """Raised to the submitter when a job will not be answered: expired, superseded or overloaded."""
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AIJob:
+    __slots__ = ("id", "func", "args", "user", "channel", "submitted", "deadline", "future", "superseded")
+
+    def __init__(self, job_id, func, args, user, channel, deadline):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.user = user
+        self.channel = channel
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + deadline
+        self.future = asyncio.get_running_loop().create_future()
+        self.superseded = False
+
+
+class AIScheduler:
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY, max_queued: int = AI_MAX_QUEUED,
+                 deadline: float = AI_REQUEST_DEADLINE):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.deadline = deadline
+        # channel -> user -> deque of jobs; both levels rotate for round-robin service
+        self.queues: "OrderedDict[str, OrderedDict[str, deque]]" = OrderedDict()
+        self.queued = 0
+        self.running: dict[tuple, AIJob] = {}  # (channel, user) -> running job
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ai")
+        self.slots = max_concurrency
+        self.ids = itertools.count(1)
+
+    async def submit(self, func: Callable, *args, user: str, channel: str, deadline: Optional[float] = None):
+        """Run func(*args) in a worker thread when it is this user's turn; returns its result or raises AIJobDropped."""
+        self._supersede(user, channel)
+        if self.queued >= self.max_queued:
+            metrics.incr("ai.dropped.overloaded")
+            raise AIJobDropped("overloaded")
+        job = AIJob(next(self.ids), profiling.bind(func), args, user, channel,
+                    self.deadline if deadline is None else deadline)
+        self.queues.setdefault(channel, OrderedDict()).setdefault(user, deque()).append(job)
+        self.queued += 1
+        metrics.incr("ai.submitted")
+        self._publish_gauges()
+        self._dispatch()
+        return await job.future
+
+    def _supersede(self, user: str, channel: str):
+        users = self.queues.get(channel)
+        pending = users.pop(user, None) if users else None
+        if users is not None and not users:
+            del self.queues[channel]
+        for job in pending or ():
+            self.queued -= 1
+            self._drop(job, "superseded")
+        running = self.running.get((channel, user))
+        if running and not running.superseded:
+            running.superseded = True  # its answer is discarded when the worker finishes
+
+    def _next_job(self) -> Optional[AIJob]:
+        """Pop the oldest job of the next user of the next channel in rotation, skipping expired ones."""
+        while self.queues:
+            channel, users = next(iter(self.queues.items()))
+            self.queues.move_to_end(channel)
+            user, jobs = next(iter(users.items()))
+            users.move_to_end(user)
+            job = jobs.popleft()
+            self.queued -= 1
+            if not jobs:
+                del users[user]
+            if not users:
+                del self.queues[channel]
+            if time.monotonic() > job.deadline:
+                self._drop(job, "expired")
+                continue
+            return job
+        return None
+
+    def _dispatch(self):
+        while self.slots > 0:
+            job = self._next_job()
+            if job is None:
+                break
+            self.slots -= 1
+            wait = time.monotonic() - job.submitted
+            metrics.observe("ai.queue_wait_s", wait)
+            self.running[(job.channel, job.user)] = job
+            asyncio.get_running_loop().create_task(self._run(job))
+        self._publish_gauges()
+
+    async def _run(self, job: AIJob):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        work = loop.run_in_executor(self.executor, job.func, *job.args)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(work), max(0.0, job.deadline - started))
+            metrics.observe("ai.run_s", time.monotonic() - started)
+            if job.superseded:
+                self._drop(job, "superseded")
+            elif not job.future.done():
+                job.future.set_result(result)
+        except asyncio.TimeoutError:
+            self._drop(job, "expired")
+            # The worker thread cannot be interrupted; keep its slot until it actually finishes.
+            await asyncio.wait([work])
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            if self.running.get((job.channel, job.user)) is job:
+                del self.running[(job.channel, job.user)]
+            self.slots += 1
+            self._dispatch()
+
+    def _drop(self, job: AIJob, reason: str):
+        metrics.incr(f"ai.dropped.{reason}")
+        logger.info(f"AI job {job.id} from {job.user} in {job.channel} dropped: {reason} "
+                    f"(waited {time.monotonic() - job.submitted:.1f}s)")
+        if not job.future.done():
+            job.future.set_exception(AIJobDropped(reason))
+
+    def _publish_gauges(self):
+        metrics.gauge("ai.queued", self.queued)
+        metrics.gauge("ai.running", self.max_concurrency - self.slots)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "running": self.max_concurrency - self.slots,
+            "channels_waiting": len(self.queues),
+        }
+
+
+_scheduler: Optional[AIScheduler] = None
+
+def get_scheduler() -> AIScheduler:
+    """The process-wide scheduler, created on first use inside the running event loop."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AIScheduler()
+    return _scheduler
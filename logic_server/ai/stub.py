@@ -0,0 +1,42 @@
+"""
+stub.py
+Offline, deterministic stand-in for the Gemini client, selected with "AI_PROVIDER": "stub".
+Sleeps for a configurable latency (plus one simulated tool call per tool keyword, run
+concurrently like the real tools) and answers with the user's own words, so load tests
+can match answers to questions.
+"""
+import time
+import config
+from shared.logger import setup_logger
+from .tool_runner import run_tool_calls
+
+logger = setup_logger("stub_ai")
+
+TOOL_KEYWORDS = ("price", "search", "uptime", "history")
+
+def _stub_tool() -> dict:
+    time.sleep(config.AI_STUB_TOOL_LATENCY)
+    return {"result": "ok"}
+
+STUB_TOOLS = {keyword: _stub_tool for keyword in TOOL_KEYWORDS}
+
+def get_response_with_function_calling(prompt: str) -> str:
+    """Same contract as gemini.get_response_with_function_calling, without the network."""
+    question = prompt.rsplit("User: ", 1)[-1].strip()
+    time.sleep(config.AI_STUB_LATENCY)
+    tools_used = [k for k in TOOL_KEYWORDS if k in question.lower()]
+    if tools_used:
+        run_tool_calls([(k, {}) for k in tools_used], STUB_TOOLS)
+    logger.debug(f"Stub answer for '{question}' (tools: {tools_used})")
+    return f"Stub answer to: {question}"
+
+
+class StubProvider:
+    """The stub behind the provider interface (see providers.py)."""
+    configured = True
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def complete(self, prompt: str) -> str:
+        return get_response_with_function_calling(prompt)
@@ -0,0 +1,356 @@
+"""
+symbols.py
+Resolves what people type ("nvidia corp", "etherium", "AAPL") to a Finnhub symbol
+without asking Finnhub, so misspelt names don't cost a quote request.
+
+The reference data is the curated symbols.tsv next to this file plus, if present, a
+bulk list at SYMBOLS_FILE (every US listing and Binance USDT pair) written by
+
+    python -m logic_server.ai.symbols refresh
+
+Both use one line per symbol: symbol, name and extra aliases, tab-separated. Curated
+rows rank above bulk ones. The index over them is built once and pickled next to
+SYMBOLS_FILE; it is rebuilt when either file changes. It has three parts:
+
+- a dict of every lookup key (symbol, aliases, name with "Inc", "Corp" etc. dropped),
+  for exact matches;
+- the same keys sorted, so a prefix is a bisect plus a short scan;
+- character trigrams -> keys, so a misspelling finds keys sharing most of its trigrams,
+  which are then checked with a bounded edit distance.
+
+Lookups take tens of microseconds (typos a few hundred).
+"""
+import bisect
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Optional
+import config
+from shared.logger import setup_logger
+
+logger = setup_logger("ai.symbols")
+
+CURATED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "symbols.tsv")
+INDEX_VERSION = 1
+RELOAD_CHECK_SECONDS = 60   # how often lookups check whether the files changed
+PREFIX_SCAN = 200           # keys looked at after a prefix's first match
+FUZZY_CANDIDATES = 50       # keys sharing the most trigrams that get an edit distance check
+COMMON_GRAM = 1000          # trigrams in more keys than this say little and are skipped
+TICKER_RE = re.compile(r"^[A-Z0-9][A-Z0-9.:\-]{0,14}$")
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Words in listed company names that people leave out
+NOISE_WORDS = frozenset(
+    "inc incorporated corp corporation co company companies ltd limited plc llc lp holdings holding group "
+    "the sa ag nv se adr ads ord shs sponsored cl class common stock".split()
+)
+# Finnhub security types ranked first among the bulk listings
+MAIN_TYPES = ("Common Stock", "ETP", "ADR", "REIT")
+
+
+def normalize(text: str) -> str:
+    """Lowercase words without punctuation or corporate filler: "ALPHABET INC-CL A" -> "alphabet"."""
+    words = WORD_RE.findall(text.lower().replace("&", " and "))
+    kept = []
+    for i, word in enumerate(words):
+        if word in NOISE_WORDS or (len(word) == 1 and i and words[i - 1] in ("cl", "class")):
+            continue
+        kept.append(word)
+    return " ".join(kept)
+
+def _grams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _within(a: str, b: str, limit: int) -> Optional[int]:
+    """Edit distance of a and b (a swap of neighbours counts as one edit) if at most limit, else None."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return None
+        before, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else None
+
+def _max_typos(query: str) -> int:
+    if len(query) < 5:
+        return 0  # short queries are usually tickers, and everything is one typo from a ticker
+    return 1 if len(query) < 8 else 2
+
+
+class Candidate:
+    __slots__ = ("symbol", "name", "match", "distance")
+
+    def __init__(self, symbol: str, name: str, match: str, distance: int = 0):
+        self.symbol = symbol
+        self.name = name
+        self.match = match  # "exact", "prefix" or "fuzzy"
+        self.distance = distance
+
+    def __repr__(self):
+        return f"Candidate({self.symbol!r}, {self.name!r}, {self.match!r}, {self.distance})"
+
+
+class SymbolIndex:
+    def __init__(self, rows: list[tuple[str, str, list[str]]], complete: bool):
+        """rows: (symbol, name, aliases) best first. complete: rows cover every listing (bulk data loaded)."""
+        self.complete = complete
+        self.symbols = [r[0] for r in rows]
+        self.names = [r[1] for r in rows]
+        by_key: dict[str, list[int]] = {}
+        for entry, (symbol, name, aliases) in enumerate(rows):
+            keys = {symbol.lower(), normalize(name), name.lower()}
+            if ":" in symbol:
+                keys.add(symbol.split(":", 1)[1].lower())
+            for alias in aliases:
+                keys.update((alias.lower(), normalize(alias)))
+            for key in keys:
+                if key:
+                    by_key.setdefault(key, []).append(entry)
+        self.keys = sorted(by_key)
+        self.entries = [array("i", by_key[k]) for k in self.keys]  # entries per key, best first
+        self.key_ids = {k: i for i, k in enumerate(self.keys)}
+        grams: dict[str, array] = {}
+        for key_id, key in enumerate(self.keys):
+            for gram in _grams(key):
+                grams.setdefault(gram, array("i")).append(key_id)
+        self.grams = grams
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __reduce__(self):
+        # By state, so an index saved by "python -m ..." (where this module is __main__) loads in the server
+        return _restore, (self.__dict__,)
+
+    def _candidates(self, entries, match: str, distance: int = 0) -> list[Candidate]:
+        """Candidates for entries in rank order, one per symbol."""
+        found, seen = [], set()
+        for entry in entries:
+            symbol = self.symbols[entry]
+            if symbol not in seen:
+                seen.add(symbol)
+                found.append(Candidate(symbol, self.names[entry], match, distance))
+        return found
+
+    def _entries(self, key_ids) -> list[int]:
+        return sorted({e for k in key_ids for e in self.entries[k]})
+
+    def exact(self, query: str) -> list[Candidate]:
+        key_ids = {self.key_ids[k] for k in (query.strip().lower(), normalize(query)) if k in self.key_ids}
+        return self._candidates(self._entries(key_ids), "exact")
+
+    def prefix(self, query: str, limit: int = 5) -> list[Candidate]:
+        q = normalize(query)
+        if len(q) < 3:
+            return []
+        start = bisect.bisect_left(self.keys, q)
+        key_ids = []
+        for key_id in range(start, min(start + PREFIX_SCAN, len(self.keys))):
+            if not self.keys[key_id].startswith(q):
+                break
+            key_ids.append(key_id)
+        return self._candidates(self._entries(key_ids), "prefix")[:limit]
+
+    def fuzzy(self, query: str, limit: int = 5) -> list[Candidate]:
+        q = normalize(query)
+        typos = _max_typos(q)
+        if not typos:
+            return []
+        grams = _grams(q)
+        postings = [p for p in map(self.grams.get, grams) if p is not None and len(p) <= COMMON_GRAM]
+        shared = Counter(chain.from_iterable(postings))
+        # A key within `typos` edits shares all but about 3 trigrams per edit
+        needed = max(1, len(grams) - 3 * typos - (len(grams) - len(postings)))
+        found = []
+        for key_id, n in shared.most_common(FUZZY_CANDIDATES):
+            if n < needed:
+                break
+            distance = _within(q, self.keys[key_id], typos)
+            if distance is not None:
+                found.append((distance, self.entries[key_id][0], key_id))
+        found.sort()
+        results, seen = [], set()
+        for distance, entry, _ in found:
+            if self.symbols[entry] not in seen:
+                seen.add(self.symbols[entry])
+                results.append(Candidate(self.symbols[entry], self.names[entry], "fuzzy", distance))
+        return results[:limit]
+
+    def lookup(self, query: str, limit: int = 5) -> list[Candidate]:
+        """Ranked candidates: exact matches, else prefix matches, else ones within a typo or two."""
+        return (self.exact(query) or self.prefix(query, limit) or self.fuzzy(query, limit))[:limit]
+
+
+def _restore(state: dict) -> SymbolIndex:
+    index = SymbolIndex.__new__(SymbolIndex)
+    index.__dict__.update(state)
+    return index
+
+
+# --- data files ---------------------------------------------------------------
+
+def read_rows(path: str) -> list[tuple[str, str, list[str]]]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            symbol, name = fields[0], fields[1] if len(fields) > 1 else fields[0]
+            aliases = [a for a in fields[2].split(",") if a] if len(fields) > 2 else []
+            rows.append((symbol, name, aliases))
+    return rows
+
+def _signature() -> tuple:
+    """Changes whenever one of the data files does."""
+    sig = [INDEX_VERSION]
+    for path in (CURATED_FILE, config.SYMBOLS_FILE):
+        try:
+            st = os.stat(path)
+            sig.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append((path, None))
+    return tuple(sig)
+
+def build() -> SymbolIndex:
+    rows = read_rows(CURATED_FILE)
+    complete = os.path.exists(config.SYMBOLS_FILE)
+    if complete:
+        rows += read_rows(config.SYMBOLS_FILE)
+    started = time.monotonic()
+    index = SymbolIndex(rows, complete)
+    logger.info(f"Indexed {len(index)} symbols ({len(index.keys)} keys) in {time.monotonic() - started:.2f}s")
+    return index
+
+def _index_path() -> str:
+    return config.SYMBOLS_FILE + ".idx"
+
+def load() -> SymbolIndex:
+    """The pickled index if it matches the data files, else a fresh one (saved when there is bulk data)."""
+    signature = _signature()
+    try:
+        with open(_index_path(), "rb") as f:
+            saved_signature, index = pickle.load(f)
+        if saved_signature == signature:
+            return index
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        pass
+    index = build()
+    if index.complete:
+        tmp = _index_path() + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, _index_path())
+        except OSError as e:
+            logger.warning(f"Could not save symbol index: {e}")
+    return index
+
+
+_index: Optional[SymbolIndex] = None
+_signature_seen = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def index() -> SymbolIndex:
+    """The current index; reloaded if the data files changed (checked every RELOAD_CHECK_SECONDS)."""
+    global _index, _signature_seen, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return _index
+    with _lock:
+        if _index is None or now - _checked_at >= RELOAD_CHECK_SECONDS:
+            signature = _signature()
+            if _index is None or signature != _signature_seen:
+                _index = load()
+                _signature_seen = signature
+            _checked_at = now
+    return _index
+
+def lookup(query: str, limit: int = 5) -> list[Candidate]:
+    return index().lookup(query, limit)
+
+def resolve(query: str) -> Optional[str]:
+    """
+    The symbol for query, or None if it matches nothing. Without the bulk list, a query
+    that looks like a ticker is passed through as one, since the curated list is not
+    exhaustive.
+    """
+    idx = index()
+    candidates = idx.lookup(query, 1)
+    if candidates:
+        return candidates[0].symbol
+    ticker = query.strip().upper()
+    if not idx.complete and TICKER_RE.match(ticker):
+        return ticker
+    return None
+
+
+# --- refreshing the bulk list -------------------------------------------------
+
+FINNHUB_STOCKS_URL = "https://finnhub.io/api/v1/stock/symbol"
+FINNHUB_CRYPTO_URL = "https://finnhub.io/api/v1/crypto/symbol"
+
+def refresh(api_key: str, exchange: str = "US", crypto_exchange: str = "binance") -> int:
+    """Download every listing on exchange and the USDT pairs on crypto_exchange into SYMBOLS_FILE."""
+    import requests
+    stocks = requests.get(FINNHUB_STOCKS_URL, params={"exchange": exchange, "token": api_key}, timeout=60)
+    stocks.raise_for_status()
+    crypto = requests.get(FINNHUB_CRYPTO_URL, params={"exchange": crypto_exchange, "token": api_key}, timeout=60)
+    crypto.raise_for_status()
+    rows = []
+    for item in stocks.json():
+        symbol, name = item.get("symbol"), (item.get("description") or "").strip()
+        if symbol and "\t" not in name:
+            rank = 0 if item.get("type") in MAIN_TYPES else 1
+            rows.append((rank, len(symbol), symbol, name or symbol, ""))
+    for item in crypto.json():
+        base, _, quote = (item.get("displaySymbol") or "").partition("/")
+        if quote == "USDT" and item.get("symbol"):
+            rows.append((2, len(base), item["symbol"], base, base.lower()))
+    rows.sort()
+    tmp = config.SYMBOLS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"# {exchange} listings and {crypto_exchange} USDT pairs from Finnhub, {time.strftime('%Y-%m-%d')}\n")
+        for _, _, symbol, name, aliases in rows:
+            f.write(f"{symbol}\t{name}\t{aliases}\n")
+    os.replace(tmp, config.SYMBOLS_FILE)
+    load()  # build and save the index now rather than on the first lookup
+    return len(rows)
+
+def main(argv: list[str]):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m logic_server.ai.symbols", description="Symbol reference data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh_cmd = sub.add_parser("refresh", help="download the bulk symbol list from Finnhub (needs FINNHUB_API_KEY)")
+    refresh_cmd.add_argument("--exchange", default="US")
+    refresh_cmd.add_argument("--crypto-exchange", default="binance")
+    lookup_cmd = sub.add_parser("lookup", help="show the candidates for a query")
+    lookup_cmd.add_argument("query", nargs="+")
+    args = parser.parse_args(argv)
+    if args.command == "refresh":
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("FINNHUB_API_KEY")
+        if not api_key:
+            sys.exit("FINNHUB_API_KEY is not set")
+        print(f"Wrote {refresh(api_key, args.exchange, args.crypto_exchange)} symbols to {config.SYMBOLS_FILE}")
+    else:
+        for candidate in lookup(" ".join(args.query)):
+            print(f"{candidate.symbol}\t{candidate.name}\t{candidate.match} {candidate.distance}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,28 @@
+from contextvars import ContextVar
+from typing import Optional
+from logic_server.db import search_log
+
+# Channel the current AI request came from; set by the parser, never chosen by the model,
+# so the tool cannot read other channels or private-message logs.
+REQUEST_CHANNEL: ContextVar[Optional[str]] = ContextVar("request_channel", default=None)
+
+def search_chat_history(query: str) -> dict:
+    """
+    Searches the IRC chat history of the current channel for lines matching the given words.
+    Use this when the user asks about something said earlier that is not in the provided context.
+    Args:
+        query: Words to search for (all words must match).
+    Returns:
+        A dictionary with the matching log lines, most relevant first.
+    """
+    channel = REQUEST_CHANNEL.get()
+    if not channel:
+        return {"result": "Chat history can only be searched from a channel."}
+    try:
+        rows = search_log(query, channel=channel, limit=10, order="rank")
+    except Exception as e:
+        return {"result": f"Failed to search chat history: {e}"}
+    if not rows:
+        return {"result": f"No chat history found for '{query}' in {channel}."}
+    lines = [f"[{ts.strftime('%Y-%m-%d %H:%M')}] <{nick}> {msg}" for ts, nick, _, msg in rows]
+    return {"result": "\n".join(lines)}
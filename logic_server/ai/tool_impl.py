@@ -1,11 +1,17 @@
-from .tool_stock_price import get_stock_price
+from .tool_stock_price import get_stock_price, get_stock_prices
 from .tool_system_uptime import get_system_uptime
 from .tool_web_search import web_search
+from .tool_chat_history import search_chat_history
 
-available_tool_implementations = [get_stock_price, get_system_uptime, web_search]
+available_tool_implementations = [get_stock_price, get_stock_prices, get_system_uptime, web_search, search_chat_history]
+
+# Function-call name (as the model sees it) -> implementation
+TOOL_FUNCTIONS = {f.__name__: f for f in available_tool_implementations}
 
 TOOL_IMPLEMENTATIONS_MAP = {
     "stock_price": get_stock_price,
+    "stock_prices": get_stock_prices,
     "system_uptime": get_system_uptime,
     "web_search": web_search,
-}
\ No newline at end of file
+    "chat_history": search_chat_history,
+}
@@ -0,0 +1,67 @@
+"""
+tool_runner.py
+Runs all the function calls a model emits in one turn concurrently, each under its
+own timeout, so a turn that asks for three tools takes about as long as the slowest.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from shared import metrics, tracing
+from shared.logger import setup_logger
+from logic_server import profiling
+from .ai_config import TOOL_MAX_WORKERS, TOOL_TIMEOUT, TOOL_TIMEOUTS
+
+logger = setup_logger("ai.tool_runner")
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="ai-tool")
+
+
+def _timed(name: str, func, args: dict):
+    started = time.monotonic()
+    try:
+        with tracing.span(f"tool.{name}"):
+            return func(**args)
+    finally:
+        metrics.observe(f"ai.tool_s.{name}", time.monotonic() - started)
+
+def run_tool_calls(calls: list[tuple[str, dict]], tools: dict) -> list[dict]:
+    """
+    Execute (name, args) calls concurrently using the functions in tools (name -> callable).
+    Returns one {"result": ...} dict per call, in call order; unknown tools, errors and
+    timeouts become error results instead of exceptions so the model can still answer.
+    """
+    with profiling.stage("tools"):
+        return _run_tool_calls(calls, tools)
+
+def _run_tool_calls(calls: list[tuple[str, dict]], tools: dict) -> list[dict]:
+    started = time.monotonic()
+    futures = []
+    for name, args in calls:
+        func = tools.get(name)
+        if func is None:
+            futures.append((name, None))
+            continue
+        logger.info(f"Calling tool {name}({args})")
+        futures.append((name, _executor.submit(profiling.bind(_timed), name, func, args)))
+    results = []
+    for name, future in futures:
+        if future is None:
+            results.append({"result": f"Unknown tool '{name}'."})
+            continue
+        remaining = started + TOOL_TIMEOUTS.get(name, TOOL_TIMEOUT) - time.monotonic()
+        try:
+            value = future.result(timeout=max(0.0, remaining))
+        except FutureTimeout:
+            # The thread cannot be interrupted; it finishes in the background and its result is discarded.
+            metrics.incr(f"ai.tool_timeout.{name}")
+            logger.warning(f"Tool {name} timed out")
+            results.append({"result": f"The {name} tool timed out."})
+            continue
+        except Exception as e:
+            metrics.incr(f"ai.tool_error.{name}")
+            logger.error(f"Tool {name} failed: {e}", exc_info=True)
+            results.append({"result": f"The {name} tool failed: {e}"})
+            continue
+        results.append(value if isinstance(value, dict) else {"result": value})
+    if len(calls) > 1:
+        metrics.observe("ai.tool_batch_s", time.monotonic() - started)
+    return results
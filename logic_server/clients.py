@@ -0,0 +1,251 @@
+"""
+clients.py
+Registry of connected bots, so one logic server can serve several edge bots (on one
+network or many).
+
+A bot introduces itself with a "hello" message (id, network, nick, capabilities and
+joined channels) and sends a "channels" message whenever it joins or leaves one. A
+reply to a line goes back to the bot that sent the line. Messages that are not replies
+go to the bot that sits in the target channel, one per network; scheduled job output
+only to bots on the network of the bot whose user scheduled it. !say and !part go the same way, and !join/!part can name a bot. A bot that never
+says hello (an older version) is kept under a generated id and is assumed to be in any
+channel no other bot claims.
+"""
+import json
+import time
+from contextvars import ContextVar
+from typing import Optional
+import websockets
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("logic_server.clients")
+
+RATE_WINDOW = 60.0  # seconds the per-client rates are averaged over
+# Capability a bot must declare for an action; bots without a hello can do everything
+ACTION_CAPABILITIES = {"__JOIN__": "join", "__PART__": "join", "__WHOIS__": "whois", "__PRIVMSG__": "say"}
+
+
+class Rate:
+    """Messages per second over roughly the last RATE_WINDOW seconds (two sliding buckets)."""
+    __slots__ = ("total", "current", "previous", "bucket_start")
+
+    def __init__(self):
+        self.total = 0
+        self.current = 0
+        self.previous = 0
+        self.bucket_start = time.monotonic()
+
+    def _roll(self, now: float):
+        elapsed = now - self.bucket_start
+        if elapsed >= RATE_WINDOW:
+            self.previous = self.current if elapsed < 2 * RATE_WINDOW else 0
+            self.current = 0
+            self.bucket_start = now - elapsed % RATE_WINDOW
+
+    def add(self, n: int = 1):
+        self._roll(time.monotonic())
+        self.current += n
+        self.total += n
+
+    def per_second(self) -> float:
+        now = time.monotonic()
+        self._roll(now)
+        into = (now - self.bucket_start) / RATE_WINDOW
+        return (self.previous * (1 - into) + self.current) / RATE_WINDOW
+
+
+class BotClient:
+    __slots__ = ("websocket", "id", "network", "nick", "capabilities", "channels", "greeted", "connected_at",
+                 "received", "sent", "state_version", "link")
+
+    def __init__(self, websocket, client_id: str):
+        self.websocket = websocket
+        self.id = client_id
+        self.network = ""
+        self.nick = ""
+        self.capabilities: frozenset = frozenset()
+        self.channels: set[str] = set()  # lowercased
+        self.greeted = False  # sent a hello; until then channels and capabilities are unknown
+        self.connected_at = time.time()
+        self.received = Rate()
+        self.sent = Rate()
+        self.state_version = None  # of the last state pushed to this bot
+        self.link: Optional[dict] = None  # RTT and recovery stats the bot sends with its heartbeats
+
+    def can(self, action: Optional[str]) -> bool:
+        return not self.greeted or action is None or ACTION_CAPABILITIES[action] in self.capabilities
+
+    async def send(self, message: dict) -> bool:
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            return False
+        self.sent.add()
+        return True
+
+
+# The bot whose line is being handled; set per request by the server, read by jobs.schedule
+ORIGIN: ContextVar[Optional[BotClient]] = ContextVar("origin_bot", default=None)
+
+CLIENTS: dict[str, BotClient] = {}
+_by_channel: dict[str, set[str]] = {}  # lowercased channel -> ids of the bots in it
+_anonymous = 0
+
+
+def _index(client: BotClient, channels):
+    for channel in client.channels:
+        ids = _by_channel.get(channel)
+        if ids is not None:
+            ids.discard(client.id)
+            if not ids:
+                del _by_channel[channel]
+    client.channels = {c.lower() for c in channels}
+    for channel in client.channels:
+        _by_channel.setdefault(channel, set()).add(client.id)
+
+def _publish_gauges():
+    metrics.gauge("clients.connected", len(CLIENTS))
+    metrics.gauge("clients.channels", len(_by_channel))
+
+def connect(websocket) -> BotClient:
+    global _anonymous
+    _anonymous += 1
+    client = BotClient(websocket, f"bot-{_anonymous}")
+    CLIENTS[client.id] = client
+    _publish_gauges()
+    return client
+
+def hello(client: BotClient, data: dict):
+    """Register the bot under the id it asked for (suffixed if another bot already has it)."""
+    wanted = str(data.get("id") or client.id)
+    new_id, n = wanted, 1
+    while new_id in CLIENTS and CLIENTS[new_id] is not client:
+        n += 1
+        new_id = f"{wanted}#{n}"
+    if new_id != wanted:
+        logger.warning(f"Bot id {wanted} is already connected, registering this one as {new_id}")
+    channels = data.get("channels", ())
+    _index(client, ())
+    del CLIENTS[client.id]
+    client.id = new_id
+    client.network = data.get("network", "")
+    client.nick = data.get("nick", "")
+    client.capabilities = frozenset(data.get("capabilities", ()))
+    client.greeted = True
+    CLIENTS[client.id] = client
+    _index(client, channels)
+    _publish_gauges()
+    logger.info(f"Bot {client.id} ({client.nick} on {client.network}) connected with "
+                f"{len(client.channels)} channels, capabilities {sorted(client.capabilities)}")
+
+def set_channels(client: BotClient, channels: list[str]):
+    _index(client, channels)
+    _publish_gauges()
+
+def disconnect(client: BotClient):
+    _index(client, ())
+    if CLIENTS.get(client.id) is client:
+        del CLIENTS[client.id]
+    _publish_gauges()
+    logger.info(f"Bot {client.id} disconnected after {time.time() - client.connected_at:.0f}s "
+                f"({client.received.total} messages in, {client.sent.total} out)")
+
+
+def _on(network: Optional[str]) -> list[BotClient]:
+    """The connected bots, or only those on network when one is given."""
+    return [c for c in CLIENTS.values() if network is None or c.network == network]
+
+def in_channel(channel: str, action: Optional[str] = None, network: Optional[str] = None) -> list[BotClient]:
+    """One bot per network (or on network only) that is in channel and can do action, oldest connection first."""
+    found = {}
+    ids = _by_channel.get(channel.lower(), ())
+    for client in sorted((CLIENTS[i] for i in ids), key=lambda c: c.connected_at):
+        if client.network not in found and client.can(action) and (network is None or client.network == network):
+            found[client.network] = client
+    return list(found.values())
+
+def _action(response) -> tuple[Optional[str], list[str]]:
+    """("__PRIVMSG__", ["#chan", "text"]) for a bot action string, else (None, [])."""
+    if isinstance(response, str) and response.startswith("__"):
+        action, _, rest = response.partition("::")
+        if action in ACTION_CAPABILITIES:
+            return action, rest.split("::")
+    return None, []
+
+def route(message: dict, origin: Optional[BotClient] = None, network: Optional[str] = None) -> list[BotClient]:
+    """
+    The bots that should get message: origin for a reply, else the bots in its channel.
+    With network, only bots on that network are considered.
+    """
+    action, fields = _action(message.get("response"))
+    if action in ("__JOIN__", "__PART__") and len(fields) > 1:
+        chosen = CLIENTS.get(fields[1])
+        if chosen is None:
+            logger.warning(f"No bot {fields[1]} connected for {action}")
+        return [chosen] if chosen else []
+    if action in ("__JOIN__", "__WHOIS__"):
+        return [origin] if origin else [c for c in _on(network) if c.can(action)][:1]
+    target = fields[0] if action in ("__PRIVMSG__", "__PART__") else message.get("target", "")
+    is_channel = target.startswith(("#", "&"))
+    if origin is not None and (not is_channel or target.lower() in origin.channels or not origin.greeted):
+        return [origin]
+    clients = in_channel(target, action, network) if is_channel else []
+    if clients:
+        return clients
+    # Nobody claims the channel: a bot that never said where it is, else whoever asked
+    anonymous = [c for c in _on(network) if not c.greeted]
+    if anonymous:
+        return anonymous[:1]
+    if origin is not None:
+        return [origin]
+    return _on(network)[:1]
+
+async def deliver(message: dict, origin: Optional[BotClient] = None, network: Optional[str] = None) -> bool:
+    """Send message to the bot(s) route() picks; False if none took it."""
+    recipients = route(message, origin, network)
+    action, fields = _action(message.get("response"))
+    if action in ("__JOIN__", "__PART__") and len(fields) > 1:
+        message = dict(message, response=f"{action}::{fields[0]}")  # bots expect just the channel
+    delivered = False
+    for client in recipients:
+        delivered = await client.send(message) or delivered
+    if not delivered:
+        metrics.incr("clients.undeliverable")
+    return delivered
+
+async def broadcast_text(text: str) -> int:
+    """Say text once in every channel any bot is in (per network); returns the number of channels."""
+    done = set()
+    for client in sorted(CLIENTS.values(), key=lambda c: c.connected_at):
+        for channel in sorted(client.channels):
+            if (client.network, channel) not in done and await client.send({"response": text, "target": channel}):
+                done.add((client.network, channel))
+    return len(done)
+
+async def push_state(version, get_state):
+    """Send the bots that have an older state the current one (get_state is awaited once, if needed)."""
+    stale = [c for c in CLIENTS.values() if c.state_version != version]
+    if not stale:
+        return
+    state = await get_state()
+    for client in stale:
+        if await client.send(state):
+            client.state_version = version
+
+def stats() -> list[dict]:
+    """Per-bot connection details and throughput, for !admin clients and diagnostics."""
+    now = time.time()
+    return [{
+        "id": c.id,
+        "network": c.network,
+        "nick": c.nick,
+        "channels": len(c.channels),
+        "capabilities": sorted(c.capabilities),
+        "uptime": now - c.connected_at,
+        "received": c.received.total,
+        "sent": c.sent.total,
+        "in_per_s": c.received.per_second(),
+        "out_per_s": c.sent.per_second(),
+        "link": c.link,
+    } for c in list(CLIENTS.values())]
@@ -8,8 +8,13 @@ from .admin import *
 from .prefix import *
 from .disable import *
 from .enable import *
+from .search import *
+from .stats import *
+from .ratelimit import *
+from .metrics import *
 from .base import *
-from .parser import handle_line
+from .parser import handle_line, split_command
+from .subscriptions import on_event
 
 import pkgutil
 import importlib
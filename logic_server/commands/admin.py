@@ -1,15 +1,18 @@
 from shared.logger import setup_logger
-from .decorator import command, COMMANDS
+from .decorator import command, COMMANDS, COMMAND_CLASSES, COMMAND_TIMEOUTS
+from . import subscriptions
 import pkgutil
 import importlib
 import sys
+import threading
 import logic_server.plugins as plugins
+from logic_server import profiling, jobs, plugin_workers, clients
 from logic_server.db import User
 import config
 
 logger = setup_logger("commands")
 
-@command("admin")
+@command("admin", timeout=60)
 def admin_command(channel: str, *args) -> str:
     """Admin operations: user & plugin management"""
     if len(args) >= 2 and args[0] == "user" and args[1] == "list":
@@ -48,6 +51,14 @@ def admin_command(channel: str, *args) -> str:
             config._conf["IRC_AUTOCHANNELS"] = channels
             config.save_config()
         return msg
+    if len(args) >= 1 and args[0] == "profile":
+        return _profile(args[1:])
+    if len(args) >= 1 and args[0] == "clients":
+        return _clients()
+    if len(args) >= 1 and args[0] == "broadcast":
+        if len(args) < 2:
+            return "Usage: !admin broadcast <message>"
+        return "__BROADCAST__::" + " ".join(args[1:])
     if len(args) >= 1 and args[0] == "plugin":
         action_args = args[1:]
         if not action_args:
@@ -64,6 +75,10 @@ def admin_command(channel: str, *args) -> str:
                 removed = [c for c, f in COMMANDS.items() if f.__module__ == module_name]
                 for c in removed:
                     del COMMANDS[c]
+                    COMMAND_CLASSES.pop(c, None)
+                    COMMAND_TIMEOUTS.pop(c, None)
+                jobs.unregister_module(module_name)
+                subscriptions.unsubscribe_module(module_name)
                 sys.modules.pop(module_name, None)
                 return removed
             if action == "load":
@@ -71,6 +86,7 @@ def admin_command(channel: str, *args) -> str:
                     return f"Plugin {plugin_name} already loaded."
                 try:
                     importlib.import_module(module_name)
+                    plugin_workers.plugins_changed()
                     return f"Plugin {plugin_name} loaded."
                 except Exception as e:
                     logger.error(f"Error loading plugin {plugin_name}: {e}")
@@ -87,6 +103,7 @@ def admin_command(channel: str, *args) -> str:
                 try:
                     mod = importlib.import_module(module_name)
                     importlib.reload(mod)
+                    plugin_workers.plugins_changed()
                     return f"Plugin {plugin_name} reloaded. Removed cmds: {', '.join(removed) or 'none'}"
                 except Exception as e:
                     logger.error(f"Error reloading plugin {plugin_name}: {e}")
@@ -96,4 +113,61 @@ def admin_command(channel: str, *args) -> str:
             from .plugin_downloader import download_and_load_plugin
             return download_and_load_plugin(plugin_url)
         return "Usage: !admin plugin list|load|unload|reload|get <url>"
-    return "Usage: !admin user list | plugin list|load|unload|reload|get <url> | channels add <#channel> | channels remove <#channel> | channels list"
+    return "Usage: !admin user list | plugin list|load|unload|reload|get <url> | channels add <#channel> | channels remove <#channel> | channels list | profile on|off|show <cmd> | profile list | profile lag [seconds] | clients | broadcast <message>"
+
+def _clients() -> str:
+    bots = clients.stats()
+    if not bots:
+        return "No bots connected."
+    return f"{len(bots)} bot(s): " + "; ".join(
+        f"{b['id']} ({b['nick'] or '?'} on {b['network'] or '?'}, {b['channels']} channels, "
+        f"up {int(b['uptime'] // 60)}m, in {b['received']} ({b['in_per_s']:.1f}/s), "
+        f"out {b['sent']} ({b['out_per_s']:.1f}/s){_link(b['link'])})"
+        for b in bots)
+
+def _link(link) -> str:
+    """RTT and recoveries of a bot's WS and IRC links, from its heartbeats."""
+    if not link:
+        return ""
+    parts = []
+    for name in ("ws", "irc"):
+        health = link.get(name) or {}
+        if health.get("rtt_ms") is not None:
+            parts.append(f"{name} rtt {health['rtt_ms']:.0f}ms")
+        if health.get("outages"):
+            parts.append(f"{name} {health['outages']} outages, MTTR {health['mttr_s']:.1f}s")
+    return ", " + ", ".join(parts) if parts else ""
+
+# Held while "!admin profile lag" samples the loop; one measurement at a time.
+_lag_probe = threading.Lock()
+
+PROFILE_USAGE = "Usage: !admin profile on|off|show <cmd> | profile list | profile lag [seconds]"
+
+def _profile(args) -> str:
+    if not args:
+        return PROFILE_USAGE
+    if args[0] == "list":
+        cmds = profiling.profiled_commands()
+        return "Profiling: " + ", ".join(cmds) if cmds else "No commands are being profiled."
+    if args[0] == "lag":
+        try:
+            seconds = min(30.0, float(args[1])) if len(args) > 1 else 5.0
+        except ValueError:
+            return PROFILE_USAGE
+        if not _lag_probe.acquire(blocking=False):
+            return "A lag measurement is already running."
+        try:
+            lag = profiling.measure_lag_blocking(seconds)
+        finally:
+            _lag_probe.release()
+        return (f"Event loop lag over {seconds:g}s: p50={lag['p50'] * 1000:.1f}ms p99={lag['p99'] * 1000:.1f}ms "
+                f"max={lag['max'] * 1000:.1f}ms ({lag['samples']} samples, {lag['tasks']} tasks)")
+    if len(args) != 2 or args[0] not in ("on", "off", "show"):
+        return PROFILE_USAGE
+    action, cmd = args
+    if action == "on":
+        if cmd not in COMMANDS:
+            return f"Unknown command {cmd}."
+        profiling.start_profile(cmd)
+        return f"Profiling {cmd}. Use !admin profile show {cmd} to see results."
+    return profiling.report_profile(cmd, stop=(action == "off"))
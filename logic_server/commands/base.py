@@ -72,19 +72,17 @@ def say_command(channel, source, *args):
 
 @command("join")
 def join_command(channel, source, *args):
-    """Make the bot join a specified channel. Usage: !join <#channel>"""
+    """Make the bot (or the named bot, see !admin clients) join a channel. Usage: !join <#channel> [bot]"""
     logger.info(f"join_command called with raw args: {args}")
     args = [a for a in args if a.strip()]
     logger.info(f"join_command filtered args: {args}")
-    if len(args) != 1 or not args[0].startswith("#"):
-        return "Usage: !join <#channel>"
-    target = args[0]
-    return f"__JOIN__::{target}"
+    if len(args) not in (1, 2) or not args[0].startswith("#"):
+        return "Usage: !join <#channel> [bot]"
+    return "::".join(["__JOIN__", *args])
 
 @command("part")
 def part_command(channel, source, *args):
-    """Make the bot leave a specified channel. Usage: !part <#channel>"""
-    if len(args) != 1 or not args[0].startswith("#"):
-        return "Usage: !part <#channel>"
-    target = args[0]
-    return f"__PART__::{target}"
+    """Make the bot (or the named bot) leave a channel. Usage: !part <#channel> [bot]"""
+    if len(args) not in (1, 2) or not args[0].startswith("#"):
+        return "Usage: !part <#channel> [bot]"
+    return "::".join(["__PART__", *args])
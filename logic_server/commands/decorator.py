@@ -1,12 +1,30 @@
+import config
 from shared.logger import setup_logger
 
 logger = setup_logger("commands")
 
 COMMANDS: dict[str, callable] = {}
 
-def command(name: str):
+# Cost class per command, used for rate limiting: "cheap", "network" (outbound HTTP) or "ai".
+COMMAND_CLASSES: dict[str, str] = {}
+COST_CLASSES = ("cheap", "network", "ai")
+
+# Per-command timeout overrides in seconds; commands without one use config.COMMAND_TIMEOUT.
+COMMAND_TIMEOUTS: dict[str, float] = {}
+
+def command(name: str, cost: str = "cheap", timeout: float = None):
     """Decorator to register a command handler."""
+    if cost not in COST_CLASSES:
+        raise ValueError(f"Unknown cost class {cost!r} for command {name}")
     def decorator(func: callable):
         COMMANDS[name] = func
+        COMMAND_CLASSES[name] = cost
+        if timeout is not None:
+            COMMAND_TIMEOUTS[name] = timeout
+        else:
+            COMMAND_TIMEOUTS.pop(name, None)
         return func
     return decorator
+
+def get_command_timeout(name: str) -> float:
+    return COMMAND_TIMEOUTS.get(name, config.COMMAND_TIMEOUT)
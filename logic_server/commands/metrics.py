@@ -0,0 +1,12 @@
+from shared.logger import setup_logger
+from shared import metrics
+from .decorator import command
+
+logger = setup_logger("commands")
+
+@command("metrics")
+def metrics_command(channel, source, *args):
+    """Show internal counters and timings. Usage: !metrics [prefix], e.g. !metrics ai."""
+    prefix = args[0] if args else ""
+    lines = metrics.format_snapshot(prefix)
+    return lines if lines else f"No metrics recorded{' for ' + prefix if prefix else ''}."
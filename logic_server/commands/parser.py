@@ -1,80 +1,157 @@
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple
+from contextvars import ContextVar
+import inspect
 from config import BOT_NICK
 from shared.logger import setup_logger
-from logic_server.db import get_prefix, is_command_enabled, get_channel_log_context
-from logic_server.ai.ai_config import AI_CONTEXT_LINES
-from .decorator import COMMANDS
-from logic_server.ai.gemini import get_response_with_function_calling
+from shared import metrics
+from logic_server.db import aread, get_prefix, is_command_enabled, get_channel_log_context
+from logic_server.ai.ai_config import AI_CONTEXT_LINES, AI_RETRIEVAL_K, AI_RECENT_LINES
+from logic_server.ai import retrieval
+from logic_server.ai.tool_chat_history import REQUEST_CHANNEL
+from .decorator import COMMANDS, get_command_timeout
+from logic_server.ai.scheduler import get_scheduler, AIJobDropped
+from logic_server.ai.providers import get_response_with_function_calling
+from logic_server import profiling, plugin_workers
 
 logger = setup_logger("parser") # Changed logger name for clarity
 
+# Which branch of handle_line ran for the current line, e.g. "command:echo" or "mention".
+# Visible to the awaiting caller (same task context); used by replay/benchmark tooling.
+CODE_PATH: ContextVar[str] = ContextVar("code_path", default="none")
+
+# Sync handlers run here so they can be abandoned when they overrun their timeout.
+# A hung handler keeps its thread, hence the headroom over normal concurrency.
+_command_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="command")
+
+async def run_command(handler, call_args: tuple, timeout: float, name: str = ""):
+    """
+    Run a command handler under a deadline. Async handlers are cancelled on timeout;
+    sync handlers run in a worker thread that is detached from the response path
+    (it finishes in the background, its result is discarded). Plugin handlers run in a
+    worker process instead when plugin_workers is enabled. Raises asyncio.TimeoutError.
+    """
+    if plugin_workers.isolated(handler):
+        return await asyncio.wait_for(plugin_workers.call(handler, call_args), timeout)
+    if inspect.iscoroutinefunction(handler):
+        with profiling.profile_command(name):  # samples the loop thread while it awaits
+            return await asyncio.wait_for(handler(*call_args), timeout)
+    def call():
+        with profiling.profile_command(name):
+            return handler(*call_args)
+    loop = asyncio.get_running_loop()
+    work = loop.run_in_executor(_command_executor, profiling.bind(call))  # context vars, e.g. the origin bot
+    return await asyncio.wait_for(work, timeout)
+
+def split_command(prefix: str, content: str) -> Optional[Tuple[str, list]]:
+    """
+    (command, args) if content invokes a command with prefix, else None. The command is
+    lowercased ("" for a bare prefix); events uses this too, so its permission checks
+    see the same command the dispatcher runs.
+    """
+    content = content.strip()
+    if not content.startswith(prefix):
+        return None
+    words = content[len(prefix):].split()
+    return (words[0].lower(), words[1:]) if words else ("", [])
+
 async def handle_line(line: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Process a raw IRC PRIVMSG line and return a tuple (response, target) if a command is detected
     or if the bot's nick is mentioned (triggering AI).
     """
+    CODE_PATH.set("none")
     try:
-        parts = line.split(" ", 3) # :nick!user@host PRIVMSG #channel/#user :message
-        if len(parts) < 4 or parts[1] != "PRIVMSG":
-            return None, None # Not a valid PRIVMSG line we can handle here
+        with profiling.stage("parse"):
+            parts = line.split(" ", 3) # :nick!user@host PRIVMSG #channel/#user :message
+            if len(parts) < 4 or parts[1] != "PRIVMSG":
+                CODE_PATH.set("not_privmsg")
+                return None, None # Not a valid PRIVMSG line we can handle here
 
-        source = parts[0].lstrip(':') # Remove leading ':' and strip whitespace
-        target = parts[2]     # Channel or user the message is sent to
-        content = parts[3][1:].strip() # Remove leading ':' and strip whitespace
+            source = parts[0].lstrip(':') # Remove leading ':' and strip whitespace
+            target = parts[2]     # Channel or user the message is sent to
+            content = parts[3][1:].strip() # Remove leading ':' and strip whitespace
 
-        is_channel = target.startswith("#") or target.startswith("&") # Add other channel prefixes if needed
+            is_channel = target.startswith("#") or target.startswith("&") # Add other channel prefixes if needed
 
-        prefix = get_prefix(target) if is_channel else "!" # Default '!' for PMs or if DB fails
+        with profiling.stage("settings"):
+            prefix = await aread(get_prefix, target) if is_channel else "!" # Default '!' for PMs or if DB fails
 
-        if content.startswith(prefix):
-            parts_cmd = content[len(prefix):].split()
-            if not parts_cmd:
+        invoked = split_command(prefix, content)
+        if invoked is not None:
+            cmd, args = invoked # Command is lowercased for case-insensitivity
+            if not cmd:
+                CODE_PATH.set("empty_command")
                 return None, target # Just the prefix was typed
-            cmd = parts_cmd[0].lower() # Lowercase command for case-insensitivity
-            args = parts_cmd[1:]
 
-            if is_channel and not is_command_enabled(target, cmd):
+            with profiling.stage("settings"):
+                enabled = not is_channel or await aread(is_command_enabled, target, cmd)
+            if not enabled:
                 logger.info(f"Command '{prefix}{cmd}' invoked in {target} but is disabled.")
+                CODE_PATH.set(f"disabled:{cmd}")
                 return None, target
 
             handler = COMMANDS.get(cmd)
             if handler:
+                CODE_PATH.set(f"command:{cmd}")
                 try:
-                    import inspect
                     sig = inspect.signature(handler)
                     params = sig.parameters
                     positional = [p for p in params.values() if p.kind in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)]
                     varargs = any(p.kind == inspect.Parameter.VAR_POSITIONAL for p in params.values())
                     source_nick = source.split('!')[0]
                     if len(positional) >= 2:
-                        response = handler(target, source_nick, *args)
+                        call_args = (target, source_nick, *args)
                     elif len(positional) == 1:
-                        response = handler(target, *args)
+                        call_args = (target, *args)
                     elif varargs:
-                        response = handler(*args)
+                        call_args = tuple(args)
                     else:
                         logger.error(f"Unexpected handler signature {sig} for command {cmd}")
-                        response = handler(target, *args)
+                        call_args = (target, *args)
+                    timeout = get_command_timeout(cmd)
+                    started = time.monotonic()
+                    try:
+                        with profiling.stage("handler"):
+                            response = await run_command(handler, call_args, timeout, cmd)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Command {prefix}{cmd} by {source} in {target} timed out after {timeout}s")
+                        CODE_PATH.set(f"command_timeout:{cmd}")
+                        metrics.incr(f"commands.timeout.{cmd}")
+                        return f"Command {prefix}{cmd} timed out after {timeout:g}s.", target
+                    finally:
+                        metrics.observe(f"commands.run_s.{cmd}", time.monotonic() - started)
                     return response, target
                 except Exception as e:
                     logger.error(f"Error executing command {prefix}{cmd} by {source} in {target}: {e}", exc_info=True)
+                    CODE_PATH.set(f"command_error:{cmd}")
+                    metrics.incr(f"commands.error.{cmd}")
                     return f"Error executing command {prefix}{cmd}.", target
             else:
-                pass # Silently ignore unknown prefixed commands
+                CODE_PATH.set("unknown_command") # Silently ignore unknown prefixed commands; may still be a mention
 
         import re
         if BOT_NICK and re.search(rf'\b{re.escape(BOT_NICK)}\b', content, re.IGNORECASE):
             prompt = re.sub(rf'\b{re.escape(BOT_NICK)}\b[ :!,?]*', '', content, flags=re.IGNORECASE).strip()
 
+            CODE_PATH.set("mention")
             if not prompt: # Only the nick was mentioned
+                CODE_PATH.set("mention_empty")
                 logger.info(f"Bot mentioned by {source} in {target} with empty prompt.")
                 return f"Hello {source.split('!')[0]}! How can I help you?", target # Example response
 
             context_lines = []
             if is_channel:
                 try:
-                    context_lines = get_channel_log_context(target, limit=AI_CONTEXT_LINES)
+                    with profiling.stage("context"):
+                        if retrieval.available():
+                            context_lines = await aread(retrieval.get_relevant_context, target, prompt,
+                                                        AI_RETRIEVAL_K, AI_RECENT_LINES)
+                        else:
+                            context_lines = await aread(get_channel_log_context, target, limit=AI_CONTEXT_LINES)
                 except Exception as ctx_exc:
                     logger.error(f"Error fetching channel context for {target}: {ctx_exc}", exc_info=True)
                     context_lines = []
@@ -85,11 +162,23 @@ async def handle_line(line: str) -> Tuple[Optional[str], Optional[str]]:
                 full_prompt = f"Context:\n{context_str}\n\nUser: {prompt}"
             else:
                 full_prompt = prompt
+            if is_channel:
+                full_prompt = f"Channel: {target}\n{full_prompt}"
+            REQUEST_CHANNEL.set(target if is_channel else None) # Scopes search_chat_history; carried into the AI worker threads
 
             logger.info(f"AI prompt from {source} in {target}: '{full_prompt}'")
             try:
-                resp = get_response_with_function_calling(full_prompt)
+                with profiling.stage("ai"):
+                    resp = await get_scheduler().submit(get_response_with_function_calling, full_prompt, user=source, channel=target)
                 return resp, target
+            except AIJobDropped as e:
+                if e.reason == "superseded":
+                    return None, target # The user asked again; only the newest question gets an answer
+                CODE_PATH.set(f"mention_dropped:{e.reason}")
+                nick = source.split('!')[0]
+                if e.reason == "overloaded":
+                    return f"Sorry {nick}, I'm too busy right now. Please try again in a bit.", target
+                return f"Sorry {nick}, that took too long and the conversation has moved on. Please ask again.", target
             except ConnectionError as e:
                 logger.error(f"AI connection error for prompt '{prompt}': {e}")
                 return "Sorry, I'm having trouble connecting to my brain right now.", target
@@ -99,6 +188,7 @@ async def handle_line(line: str) -> Tuple[Optional[str], Optional[str]]:
 
     except Exception as e:
         logger.error(f"Error processing line: '{line}'. Error: {e}", exc_info=True)
+        CODE_PATH.set("error")
         return "An unexpected error occurred while processing the message.", None # Generic error
 
     return None, None # No command or mention detected
@@ -4,11 +4,13 @@ import sys
 from urllib.request import urlopen
 from urllib.parse import urlparse
 from shared.logger import setup_logger
+from logic_server import plugin_workers
 
 logger = setup_logger("plugin_downloader")
 
 PLUGINS_DIR = os.path.join(os.path.dirname(__file__), '../plugins')
 PLUGINS_DIR = os.path.abspath(PLUGINS_DIR)
+DOWNLOAD_TIMEOUT = 30  # seconds
 
 
 def download_and_load_plugin(plugin_url: str) -> str:
@@ -25,7 +27,7 @@ def download_and_load_plugin(plugin_url: str) -> str:
         os.makedirs(PLUGINS_DIR)
     plugin_path = os.path.join(PLUGINS_DIR, filename)
     try:
-        with urlopen(plugin_url) as resp:
+        with urlopen(plugin_url, timeout=DOWNLOAD_TIMEOUT) as resp:
             code = resp.read().decode('utf-8')
         with open(plugin_path, 'w', encoding='utf-8') as f:
             f.write(code)
@@ -35,6 +37,7 @@ def download_and_load_plugin(plugin_url: str) -> str:
             importlib.reload(sys.modules[module_name])
         else:
             importlib.import_module(module_name)
+        plugin_workers.plugins_changed()
         return f"Plugin {plugin_name} downloaded and loaded."
     except Exception as e:
         logger.error(f"Failed to download/load plugin: {e}")
@@ -0,0 +1,37 @@
+from shared.logger import setup_logger
+from .decorator import command, COST_CLASSES
+from logic_server.db import get_rate_limits, set_rate_limit, reset_rate_limits
+
+logger = setup_logger("commands")
+
+CHANNEL_PREFIXES = ("#", "&")
+USAGE = "Usage: !ratelimit [set <cheap|network|ai> <user|channel> <count>/<seconds> | reset]"
+
+@command("ratelimit")
+def ratelimit_handler(channel: str, *args) -> str:
+    """Show or change this channel's rate limits per command class."""
+    if not args:
+        limits = get_rate_limits(channel)
+        return "Rate limits: " + "; ".join(
+            f"{cls} user {s['user'][0]}/{s['user'][1]}s channel {s['channel'][0]}/{s['channel'][1]}s"
+            for cls, s in limits.items()
+        )
+    if not channel.startswith(CHANNEL_PREFIXES):
+        return "Rate limits can only be changed in a channel."
+    if args[0] == "reset" and len(args) == 1:
+        reset_rate_limits(channel)
+        return f"Rate limits reset to defaults for {channel}"
+    if args[0] == "set" and len(args) == 4:
+        cost, scope, spec = args[1], args[2], args[3]
+        if cost not in COST_CLASSES or scope not in ("user", "channel"):
+            return USAGE
+        try:
+            count, seconds = spec.split("/", 1)
+            count, seconds = int(count), float(seconds)
+        except ValueError:
+            return USAGE
+        if count < 1 or seconds <= 0:
+            return "Count must be at least 1 and seconds positive."
+        set_rate_limit(channel, cost, scope, count, seconds)
+        return f"{cost} limit per {scope} set to {count}/{seconds:g}s in {channel}"
+    return USAGE
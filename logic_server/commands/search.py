@@ -0,0 +1,44 @@
+from shared.logger import setup_logger
+from .decorator import command
+from logic_server.db import search_log
+from logic_server.stats import get_last_seen, is_event
+
+logger = setup_logger("commands")
+
+GREP_MAX_RESULTS = 3
+
+@command("grep")
+def grep_command(channel, source, *args):
+    """Search this channel's history. Usage: !grep <text>"""
+    if not args:
+        return "Usage: !grep <text>"
+    text = " ".join(args)
+    rows = search_log(text, channel=channel, limit=GREP_MAX_RESULTS)
+    if not rows:
+        return f"No matches for '{text}'."
+    return [f"[{ts.strftime('%Y-%m-%d %H:%M')}] <{nick}> {msg}" for ts, nick, _, msg in rows]
+
+@command("seen")
+def seen_command(channel, source, *args):
+    """Show when a nick was last seen talking. Usage: !seen <nick>"""
+    if len(args) != 1:
+        return "Usage: !seen <nick>"
+    nick = args[0]
+    if nick.lower() == source.lower():
+        return f"{source}, you're right here."
+    # Only lines from this channel are quoted; activity elsewhere is reported by time alone.
+    here = get_last_seen(nick, channel) if channel.startswith("#") else None
+    latest = get_last_seen(nick)
+    if not here and not latest:
+        return f"I haven't seen {nick}."
+    elsewhere = ""
+    if latest and (not here or latest[0] > here[0]):
+        latest_when = latest[0].strftime('%Y-%m-%d %H:%M')
+        if not here:
+            return f"{nick} was last seen elsewhere at {latest_when}."
+        elsewhere = f" (seen elsewhere at {latest_when})"
+    ts, target, msg = here
+    when = ts.strftime('%Y-%m-%d %H:%M')
+    if is_event(msg.split(' ', 1)[0], target, msg):
+        return f"{nick} was last seen at {when}: {msg}{elsewhere}"
+    return f"{nick} was last seen in {target} at {when}: <{nick}> {msg}{elsewhere}"
@@ -0,0 +1,37 @@
+from shared.logger import setup_logger
+from .decorator import command
+import logic_server.stats as channel_stats
+
+logger = setup_logger("commands")
+
+SPARK = "▁▂▃▄▅▆▇█"
+
+def sparkline(values: list[int]) -> str:
+    peak = max(values) or 1
+    return "".join(SPARK[min(len(SPARK) - 1, v * len(SPARK) // (peak + 1))] if v else " " for v in values)
+
+def _partial_note() -> str:
+    return "" if channel_stats.backfill_complete() else " (still counting older history)"
+
+@command("stats")
+def stats_command(channel, source, *args):
+    """Channel activity, or one nick's. Usage: !stats [nick]"""
+    if not channel or not channel.startswith(channel_stats.CHANNEL_PREFIXES):
+        return "Usage: !stats [nick] (in a channel)"
+    if len(args) > 1:
+        return "Usage: !stats [nick]"
+    if args:
+        s = channel_stats.nick_summary(channel, args[0])
+        if s is None:
+            return f"I haven't seen {args[0]} in {channel}.{_partial_note()}"
+        return (f"{s['nick']} in {channel}: {s['messages']:,} messages ({s['share']:.0%}, #{s['rank']}), "
+                f"first seen {s['first_seen'].strftime('%Y-%m-%d')}, "
+                f"last seen {s['last_seen'].strftime('%Y-%m-%d %H:%M')}{_partial_note()}")
+    s = channel_stats.channel_summary(channel)
+    if not s["messages"]:
+        return f"No messages counted in {channel} yet.{_partial_note()}"
+    top = ", ".join(f"{nick} {count:,}" for nick, count in s["top"])
+    return [
+        f"{channel}: {s['messages']:,} messages since {s['since'].strftime('%Y-%m-%d')}. Top: {top}{_partial_note()}",
+        f"Last 24h ({sum(s['hourly']):,} messages): [{sparkline(s['hourly'])}]",
+    ]
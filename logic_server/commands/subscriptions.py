@@ -0,0 +1,164 @@
+"""
+subscriptions.py
+IRC events for plugins: join, part, nick, quit, kick, topic, mode, and channel or
+private messages matching a regex.
+
+    @on_event("join")
+    def greet(event): return f"Welcome, {event.nick}!"
+
+    @on_event("message", pattern=r"https?://\\S+")
+    def link_title(event): ...   # event.match is the pattern's match
+
+Handlers are indexed by event type, so dispatching an event only looks at the
+handlers subscribed to that type. The set of subscribed types goes to the bot with the
+rest of its state (see events.get_state) and the bot forwards only those events.
+"""
+import asyncio
+import re
+import time
+from typing import Optional
+import config
+from shared import metrics
+from shared.logger import setup_logger
+from .parser import run_command
+
+logger = setup_logger("commands.subscriptions")
+
+EVENT_TYPES = ("join", "part", "nick", "quit", "kick", "topic", "mode", "message")
+
+# Event type -> [(compiled pattern or None, handler)]
+EVENT_HANDLERS: dict[str, list[tuple]] = {}
+_version = 0  # bumped when the subscribed types may have changed
+
+
+class IRCEvent:
+    """
+    One IRC event. channel is None for nick and quit (channels then lists the channels
+    the user shared with the bot) and for private messages. text is the message, part
+    or quit reason, kick reason or new topic; target the kicked nick, the new nick or
+    the mode arguments.
+    """
+    __slots__ = ("type", "hostmask", "nick", "channel", "target", "text", "channels", "match")
+
+    def __init__(self, type: str, hostmask: str, nick: str, channel: Optional[str] = None,
+                 target: str = "", text: str = "", channels: tuple = ()):
+        self.type = type
+        self.hostmask = hostmask
+        self.nick = nick
+        self.channel = channel
+        self.target = target
+        self.text = text
+        self.channels = channels
+        self.match: Optional[re.Match] = None
+
+    @property
+    def reply_to(self) -> Optional[str]:
+        """Where a handler's return value goes: the channel, the sender of a private message, or nowhere."""
+        if self.channel:
+            return self.channel
+        return self.nick if self.type == "message" else None
+
+    def __reduce__(self):
+        # re.Match cannot be pickled (see plugin_workers); the copy searches the text again
+        pattern = self.match.re if self.match else None
+        return _rebuild, (self.type, self.hostmask, self.nick, self.channel, self.target, self.text,
+                          self.channels, pattern)
+
+    def matched(self, match: re.Match) -> "IRCEvent":
+        copy = IRCEvent(self.type, self.hostmask, self.nick, self.channel, self.target, self.text, self.channels)
+        copy.match = match
+        return copy
+
+def _rebuild(type, hostmask, nick, channel, target, text, channels, pattern) -> IRCEvent:
+    event = IRCEvent(type, hostmask, nick, channel, target, text, channels)
+    if pattern is not None:
+        event.match = pattern.search(text)
+    return event
+
+
+def on_event(event_type: str, pattern: Optional[str] = None, flags: int = re.IGNORECASE):
+    """
+    Decorator to subscribe handler(event) to an event type. The handler runs like a
+    command (in a worker thread, or awaited if async, under COMMAND_TIMEOUT) and may
+    return text for event.reply_to. "message" handlers can give a regex pattern and
+    then only see messages it matches.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type {event_type!r}")
+    if pattern is not None and event_type != "message":
+        raise ValueError("Only message subscriptions take a pattern")
+    compiled = re.compile(pattern, flags) if pattern is not None else None
+    def decorator(func: callable):
+        global _version
+        handlers = EVENT_HANDLERS.setdefault(event_type, [])
+        # Reloading a plugin replaces its handler instead of adding a second one
+        handlers[:] = [(p, f) for p, f in handlers
+                       if (f.__module__, f.__qualname__) != (func.__module__, func.__qualname__)]
+        handlers.append((compiled, func))
+        _version += 1
+        return func
+    return decorator
+
+def unsubscribe_module(module_name: str) -> int:
+    """Drop the subscriptions of an unloaded plugin; returns how many."""
+    global _version
+    removed = 0
+    for event_type in list(EVENT_HANDLERS):
+        kept = [(p, f) for p, f in EVENT_HANDLERS[event_type] if f.__module__ != module_name]
+        removed += len(EVENT_HANDLERS[event_type]) - len(kept)
+        if kept:
+            EVENT_HANDLERS[event_type] = kept
+        else:
+            del EVENT_HANDLERS[event_type]
+    _version += 1
+    return removed
+
+def subscribed() -> set[str]:
+    return set(EVENT_HANDLERS)
+
+def version() -> int:
+    return _version
+
+def has_handlers(event_type: str) -> bool:
+    return event_type in EVENT_HANDLERS
+
+
+async def _run(func: callable, event: IRCEvent) -> Optional[dict]:
+    name = f"{func.__module__}.{func.__name__}"
+    started = time.monotonic()
+    try:
+        result = await run_command(func, (event,), config.COMMAND_TIMEOUT, name)
+    except asyncio.TimeoutError:
+        metrics.incr(f"events.timeout.{event.type}")
+        logger.warning(f"Event handler {name} timed out on {event.type}")
+        return None
+    except Exception as e:
+        metrics.incr(f"events.error.{event.type}")
+        logger.error(f"Event handler {name} failed on {event.type}: {e}", exc_info=True)
+        return None
+    finally:
+        metrics.observe(f"events.run_s.{event.type}", time.monotonic() - started)
+    if not result:
+        return None
+    if event.reply_to is None:
+        logger.debug(f"Event handler {name} returned a reply for {event.type}, which has no channel; dropped")
+        return None
+    return {"response": result, "target": event.reply_to}
+
+async def dispatch(event: IRCEvent) -> list[dict]:
+    """Run the handlers subscribed to event.type concurrently; returns their replies."""
+    handlers = EVENT_HANDLERS.get(event.type)
+    if not handlers:
+        return []
+    calls = []
+    for pattern, func in handlers:
+        if pattern is None:
+            calls.append(_run(func, event))
+            continue
+        match = pattern.search(event.text)
+        if match:
+            calls.append(_run(func, event.matched(match)))
+    if not calls:
+        return []
+    metrics.incr(f"events.dispatched.{event.type}")
+    return [r for r in await asyncio.gather(*calls) if r]
@@ -1,21 +1,55 @@
+import asyncio
 import datetime
+import json
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import peewee
 import config
 from shared.logger import setup_logger
 
-db = peewee.SqliteDatabase(config.DB_PATH)
+# Two database files: users and channel settings (small, read on every line) and the
+# append-heavy chat log. Each has its own writer thread, WAL and page cache, so settings
+# never queue behind log inserts, and the log file can be rotated or dropped on its own.
+#
+# WAL lets readers run concurrently with the single writer; NORMAL sync is durable across
+# application crashes and only risks the last commits on power loss.
+PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -4000,  # 4 MiB page cache per connection
+    "temp_store": "memory",
+    "mmap_size": 16 * 1024 * 1024,
+    "wal_autocheckpoint": 1000,
+}
+LOG_PRAGMAS = {
+    **PRAGMAS,
+    "cache_size": -32000,  # searches and AI context scan the log
+    "mmap_size": 256 * 1024 * 1024,
+    "wal_autocheckpoint": 4000,  # fewer checkpoints under a steady insert stream
+}
+BUSY_TIMEOUT = 10  # seconds to wait on a lock held by another process
+READ_POOL_SIZE = 4
+WRITE_BATCH_MAX = 256  # max queued writes committed in one transaction
+
+db = peewee.SqliteDatabase(config.DB_PATH, pragmas=PRAGMAS, timeout=BUSY_TIMEOUT)
+log_db = peewee.SqliteDatabase(config.LOG_DB_PATH, pragmas=LOG_PRAGMAS, timeout=BUSY_TIMEOUT)
 
 class BaseModel(peewee.Model):
     class Meta:
         database = db
 
+class LogModel(peewee.Model):
+    class Meta:
+        database = log_db
+
 class User(BaseModel):
     hostmask = peewee.CharField(unique=True)
     nick = peewee.CharField()
     level = peewee.CharField()
     added_at = peewee.DateTimeField(default=datetime.datetime.now)
 
-class Log(BaseModel):
+class Log(LogModel):
     timestamp = peewee.DateTimeField(default=datetime.datetime.now)
     hostmask = peewee.CharField()
     nick = peewee.CharField()
@@ -26,27 +60,197 @@ class ChannelSetting(BaseModel):
     channel = peewee.CharField(unique=True)
     prefix = peewee.CharField(default="!")
     disabled_commands = peewee.TextField(default="")  # comma-separated
+    rate_limits = peewee.TextField(default="")  # JSON overrides of DEFAULT_RATE_LIMITS
 
 class SchemaVersion(BaseModel):
     version = peewee.IntegerField()
     applied_at = peewee.DateTimeField(default=datetime.datetime.now)
 
+class LogSchemaVersion(LogModel):
+    version = peewee.IntegerField()
+    applied_at = peewee.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = "schemaversion"
+
 logger = setup_logger("logic_server.db")
 
+# {cost class: {scope: [max events, per seconds]}}; scope "user" is per hostmask, "channel" is shared.
+DEFAULT_RATE_LIMITS = {
+    "cheap": {"user": [10, 30], "channel": [30, 30]},
+    "network": {"user": [3, 60], "channel": [10, 60]},
+    "ai": {"user": [3, 60], "channel": [10, 60]},
+}
+
+# Bumped whenever data the bot caches (see events.get_state) changes.
+_state_version = 0
+
+def state_version() -> int:
+    return _state_version
+
+def _bump_state():
+    global _state_version
+    _state_version += 1
+
+
+class DBWriter(threading.Thread):
+    """
+    Single writer thread for one database. Every write is queued here and executed on
+    one connection; whatever has queued up while a transaction was running is committed
+    together in the next one (group commit), each write in its own savepoint.
+    """
+    _STOP = object()
+
+    def __init__(self, database: peewee.SqliteDatabase, name: str):
+        super().__init__(name=name, daemon=True)
+        self.database = database
+        self.queue = queue.SimpleQueue()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        fut = Future()
+        self.queue.put((func, args, kwargs, fut))
+        return fut
+
+    def stop(self):
+        self.queue.put(self._STOP)
+        self.join()
+
+    def run(self):
+        self.database.connect(reuse_if_open=True)
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not self._STOP]
+            if batch:
+                self._commit(batch)
+        self.database.close()
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.database.atomic():
+                for func, args, kwargs, fut in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with self.database.atomic():
+                            results.append((fut, func(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((fut, None, e))
+        except Exception as e:
+            logger.error(f"DB write batch of {len(batch)} failed to commit: {e}", exc_info=True)
+            results = [(fut, None, e) for _, _, _, fut in batch if fut.running()]
+        for fut, result, exc in results:
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+
+_writer: DBWriter = None
+_log_writer: DBWriter = None
+_read_pool: ThreadPoolExecutor = None
+
+def _init_reader():
+    for database in (db, log_db):
+        database.connect(reuse_if_open=True)
+        database.execute_sql("PRAGMA query_only = 1")
+
 def init_db():
+    global _writer, _log_writer, _read_pool
+    # The log store first: moving rows out of an older combined database needs its tables
+    log_db.connect(reuse_if_open=True)
+    log_db.create_tables([Log, LogSchemaVersion], safe=True)
+    if not LogSchemaVersion.select().exists():
+        LogSchemaVersion.create(version=1)
+    run_migrations("log")
     db.connect(reuse_if_open=True)
-    db.create_tables([User, Log, ChannelSetting, SchemaVersion], safe=True)
+    db.create_tables([User, ChannelSetting, SchemaVersion], safe=True)
     if not SchemaVersion.select().exists():
         SchemaVersion.create(version=1)
     run_migrations()
+    if _writer is None:
+        _writer = DBWriter(db, "db-writer")
+        _writer.start()
+    if _log_writer is None:
+        _log_writer = DBWriter(log_db, "db-log-writer")
+        _log_writer.start()
+    if _read_pool is None:
+        _read_pool = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="db-reader", initializer=_init_reader)
 
+def close_db():
+    """Flush queued writes and stop the writer threads and read pool."""
+    global _writer, _log_writer, _read_pool
+    for writer in (_writer, _log_writer):
+        if writer is not None:
+            writer.stop()
+    _writer = _log_writer = None
+    if _read_pool is not None:
+        _read_pool.shutdown(wait=True)
+        _read_pool = None
+    db.close()
+    log_db.close()
 
-def add_user(hostmask: str, nick: str, level: str):
+def _submit(writer: DBWriter, database: peewee.SqliteDatabase, func, args, kwargs) -> Future:
+    if writer is None:
+        fut = Future()
+        try:
+            with database.atomic():
+                fut.set_result(func(*args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+    return writer.submit(func, *args, **kwargs)
+
+def submit_write(func, *args, **kwargs) -> Future:
+    """Queue func(*args) on the settings writer thread. Runs inline if the writer is not started."""
+    return _submit(_writer, db, func, args, kwargs)
+
+def submit_log_write(func, *args, **kwargs) -> Future:
+    """Like submit_write, for writes to the log database."""
+    return _submit(_log_writer, log_db, func, args, kwargs)
+
+def write(func, *args, **kwargs):
+    """Run func(*args) on the writer thread and wait for its result."""
+    return submit_write(func, *args, **kwargs).result()
+
+async def awrite(func, *args, **kwargs):
+    """Awaitable write: the event loop is not blocked while the writer commits."""
+    return await asyncio.wrap_future(submit_write(func, *args, **kwargs))
+
+async def awrite_log(func, *args, **kwargs):
+    """Awaitable write on the log writer thread."""
+    return await asyncio.wrap_future(submit_log_write(func, *args, **kwargs))
+
+async def aread(func, *args, **kwargs):
+    """Run a read-only func(*args) on the read connection pool."""
+    if _read_pool is None:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_pool, lambda: func(*args, **kwargs))
+
+
+def _add_user(hostmask: str, nick: str, level: str):
     User.replace(hostmask=hostmask, nick=nick, level=level).execute()
 
-def remove_user(hostmask: str):
+def add_user(hostmask: str, nick: str, level: str):
+    write(_add_user, hostmask, nick, level)
+    _bump_state()
+
+def _remove_user(hostmask: str):
     User.delete().where(User.hostmask == hostmask).execute()
 
+def remove_user(hostmask: str):
+    write(_remove_user, hostmask)
+    _bump_state()
+
 def get_user_level(hostmask: str) -> str:
     try:
         u = User.get(User.hostmask == hostmask)
@@ -54,14 +258,43 @@ def get_user_level(hostmask: str) -> str:
     except User.DoesNotExist:
         return "Normal"
 
+def get_ignored_hostmasks() -> list[str]:
+    return [u.hostmask for u in User.select(User.hostmask).where(User.level == "Ignored")]
+
+def has_owner() -> bool:
+    return User.select().where(User.level == "Owner").exists()
+
+
+# Called on the log writer thread with each new Log row, e.g. to keep search indexes current
+LOG_LISTENERS: list[callable] = []
+
+def on_log_insert(func: callable):
+    """Register func(row) to be called for every logged line."""
+    LOG_LISTENERS.append(func)
+    return func
+
+def _log_message(hostmask: str, nick: str, target: str, message: str):
+    row = Log.create(hostmask=hostmask, nick=nick, target=target, message=message)
+    for listener in LOG_LISTENERS:
+        try:
+            listener(row)
+        except Exception as e:
+            logger.error(f"Log listener {listener.__name__} failed: {e}", exc_info=True)
 
 def log_message(hostmask: str, nick: str, target: str, message: str):
-    Log.create(hostmask=hostmask, nick=nick, target=target, message=message)
+    """Queue a log row. Does not wait for the commit; failures are logged by the writer."""
+    fut = submit_log_write(_log_message, hostmask, nick, target, message)
+    fut.add_done_callback(_report_write_error)
+
+def _report_write_error(fut: Future):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.error(f"Queued DB write failed: {fut.exception()}")
 
 
 def get_channel_setting(channel: str) -> ChannelSetting:
-    cs, _ = ChannelSetting.get_or_create(channel=channel)
-    return cs
+    """Returns the stored settings for a channel, or unsaved defaults if there are none."""
+    cs = ChannelSetting.get_or_none(ChannelSetting.channel == channel)
+    return cs if cs else ChannelSetting(channel=channel)
 
 def get_prefix(channel: str) -> str:
     return get_channel_setting(channel).prefix
@@ -71,25 +304,77 @@ def is_command_enabled(channel: str, cmd_name: str) -> bool:
     disabled = [c.strip() for c in cs.disabled_commands.split(",") if c.strip()]
     return cmd_name not in disabled
 
-def set_prefix(channel: str, prefix: str):
+def _set_prefix(channel: str, prefix: str):
     cs = get_channel_setting(channel)
     cs.prefix = prefix
     cs.save()
 
-def disable_command(channel: str, cmd: str):
+def set_prefix(channel: str, prefix: str):
+    write(_set_prefix, channel, prefix)
+    _bump_state()
+
+def get_all_prefixes() -> dict[str, str]:
+    """Channels whose prefix differs from the default '!'."""
+    return {cs.channel: cs.prefix for cs in ChannelSetting.select().where(ChannelSetting.prefix != "!")}
+
+def _parse_rate_limits(raw: str) -> dict:
+    try:
+        return json.loads(raw) if raw else {}
+    except json.JSONDecodeError:
+        logger.warning(f"Ignoring malformed rate_limits value: {raw!r}")
+        return {}
+
+def get_rate_limits(channel: str) -> dict:
+    """Effective limits for a channel: DEFAULT_RATE_LIMITS with its overrides applied."""
+    limits = {cls: dict(scopes) for cls, scopes in DEFAULT_RATE_LIMITS.items()}
+    for cls, scopes in _parse_rate_limits(get_channel_setting(channel).rate_limits).items():
+        limits.setdefault(cls, {}).update(scopes)
+    return limits
+
+def get_all_rate_limit_overrides() -> dict[str, dict]:
+    q = ChannelSetting.select().where(ChannelSetting.rate_limits != "")
+    return {cs.channel: _parse_rate_limits(cs.rate_limits) for cs in q}
+
+def _set_rate_limit(channel: str, cost: str, scope: str, count: int, seconds: float):
+    cs = get_channel_setting(channel)
+    overrides = _parse_rate_limits(cs.rate_limits)
+    overrides.setdefault(cost, {})[scope] = [count, seconds]
+    cs.rate_limits = json.dumps(overrides)
+    cs.save()
+
+def set_rate_limit(channel: str, cost: str, scope: str, count: int, seconds: float):
+    write(_set_rate_limit, channel, cost, scope, count, seconds)
+    _bump_state()
+
+def _reset_rate_limits(channel: str):
+    cs = get_channel_setting(channel)
+    cs.rate_limits = ""
+    cs.save()
+
+def reset_rate_limits(channel: str):
+    write(_reset_rate_limits, channel)
+    _bump_state()
+
+def _disable_command(channel: str, cmd: str):
     cs = get_channel_setting(channel)
     disabled = set([c.strip() for c in cs.disabled_commands.split(",") if c.strip()])
     disabled.add(cmd)
     cs.disabled_commands = ",".join(sorted(disabled))
     cs.save()
 
-def enable_command(channel: str, cmd: str):
+def disable_command(channel: str, cmd: str):
+    write(_disable_command, channel, cmd)
+
+def _enable_command(channel: str, cmd: str):
     cs = get_channel_setting(channel)
     disabled = set([c.strip() for c in cs.disabled_commands.split(",") if c.strip()])
     disabled.discard(cmd)
     cs.disabled_commands = ",".join(sorted(disabled))
     cs.save()
 
+def enable_command(channel: str, cmd: str):
+    write(_enable_command, channel, cmd)
+
 def get_channel_log_context(channel: str, limit: int = 20):
     """
     Returns the last `limit` lines of chat log for the given channel, ordered oldest to newest.
@@ -102,27 +387,172 @@ def get_channel_log_context(channel: str, limit: int = 20):
     )
     return [ (row.timestamp, row.nick, row.message) for row in reversed(list(rows)) ]
 
-def get_schema_version() -> int:
-    sv = SchemaVersion.select().order_by(SchemaVersion.version.desc()).first()
+def get_schema_version(store: str = "settings") -> int:
+    model = STORES[store][1]
+    sv = model.select().order_by(model.version.desc()).first()
     return sv.version if sv else 0
 
-def set_schema_version(version: int):
-    SchemaVersion.create(version=version)
+def set_schema_version(version: int, store: str = "settings"):
+    STORES[store][1].create(version=version)
+
+MIGRATIONS: dict[int, callable] = {}      # settings database
+LOG_MIGRATIONS: dict[int, callable] = {}  # log database, numbered independently
 
-MIGRATIONS: dict[int, callable] = {}
+# store name -> (database, schema version model, migrations)
+STORES = {
+    "settings": (db, SchemaVersion, MIGRATIONS),
+    "log": (log_db, LogSchemaVersion, LOG_MIGRATIONS),
+}
 
-def migration(version: int):
-    """Decorator to register a migration function for a schema version"""
+def migration(version: int, store: str = "settings"):
+    """Decorator to register a migration function for a schema version of a store"""
     def decorator(func: callable):
-        MIGRATIONS[version] = func
+        STORES[store][2][version] = func
         return func
     return decorator
 
-def run_migrations():
-    """Apply all migrations with version greater than current"""
-    current = get_schema_version()
-    for version in sorted(MIGRATIONS):
+def run_migrations(store: str = "settings"):
+    """Apply all migrations of a store with version greater than current"""
+    migrations = STORES[store][2]
+    current = get_schema_version(store)
+    for version in sorted(migrations):
         if version > current:
-            logger.info(f"Applying migration {version}")
-            MIGRATIONS[version]()
-            set_schema_version(version)
+            logger.info(f"Applying {store} migration {version}")
+            migrations[version]()
+            set_schema_version(version, store)
+
+
+FTS_BACKFILL_CHUNK = 5000
+
+def fts_available() -> bool:
+    """True if the log_fts full-text index exists in the log database."""
+    return log_db.table_exists("log_fts")
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching all terms (quoted, so no syntax errors)."""
+    terms = [t.replace('"', '""') for t in text.split() if t.strip()]
+    return " ".join(f'"{t}"' for t in terms)
+
+def search_log(text: str, channel: str = None, limit: int = 10, order: str = "recent"):
+    """
+    Full-text search over the chat log. Returns (timestamp, nick, target, message) tuples.
+    order="recent" returns newest matches first, order="rank" returns best matches first.
+    Falls back to a LIKE scan if the FTS index is not available.
+    """
+    query = _fts_query(text)
+    if not query:
+        return []
+    if fts_available():
+        sql = "SELECT log.* FROM log_fts JOIN log ON log.id = log_fts.rowid WHERE log_fts MATCH ?"
+        params = [query]
+        if channel:
+            sql += " AND log.target = ?"
+            params.append(channel)
+        sql += " ORDER BY rank" if order == "rank" else " ORDER BY log.id DESC"
+        sql += " LIMIT ?"
+        params.append(limit)
+        rows = Log.raw(sql, *params)
+    else:
+        rows = Log.select().where(Log.message.contains(text))
+        if channel:
+            rows = rows.where(Log.target == channel)
+        rows = rows.order_by(Log.id.desc()).limit(limit)
+    return [(row.timestamp, row.nick, row.target, row.message) for row in rows]
+
+def get_last_seen(nick: str, channel: str = None):
+    """
+    Returns (timestamp, target, message) for the last public log line from `nick`, or None.
+    """
+    q = Log.select().where(Log.nick == nick)
+    if channel:
+        q = q.where(Log.target == channel)
+    else:
+        q = q.where(Log.target.startswith("#"))
+    row = q.order_by(Log.id.desc()).first()
+    return (row.timestamp, row.target, row.message) if row else None
+
+@migration(2, store="log")
+def _migration_log_fts():
+    """Create the FTS5 index over Log.message, its sync triggers, and backfill existing rows in chunks."""
+    log_db.execute_sql("CREATE INDEX IF NOT EXISTS log_nick_id ON log (nick, id)")
+    try:
+        log_db.execute_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5("
+            "message, content='log', content_rowid='id', tokenize='unicode61')"
+        )
+    except peewee.OperationalError as e:
+        logger.error(f"FTS5 not available in this SQLite build, search will use LIKE scans: {e}")
+        return
+    log_db.execute_sql(
+        "CREATE TRIGGER IF NOT EXISTS log_fts_ai AFTER INSERT ON log BEGIN "
+        "INSERT INTO log_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    log_db.execute_sql(
+        "CREATE TRIGGER IF NOT EXISTS log_fts_ad AFTER DELETE ON log BEGIN "
+        "INSERT INTO log_fts(log_fts, rowid, message) VALUES ('delete', old.id, old.message); END"
+    )
+    log_db.execute_sql(
+        "CREATE TRIGGER IF NOT EXISTS log_fts_au AFTER UPDATE OF message ON log BEGIN "
+        "INSERT INTO log_fts(log_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+        "INSERT INTO log_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    # Rows inserted from now on are indexed by the triggers; backfill everything older.
+    max_id = log_db.execute_sql("SELECT COALESCE(MAX(id), 0) FROM log").fetchone()[0]
+    last = 0
+    while last < max_id:
+        upper = min(last + FTS_BACKFILL_CHUNK, max_id)
+        with log_db.atomic():
+            log_db.execute_sql(
+                "INSERT INTO log_fts(rowid, message) SELECT id, message FROM log WHERE id > ? AND id <= ?",
+                (last, upper),
+            )
+        logger.info(f"FTS backfill: indexed log rows up to id {upper}/{max_id}")
+        last = upper
+
+@migration(3)
+def _migration_rate_limits():
+    """Per-channel rate limit overrides on ChannelSetting."""
+    from playhouse.migrate import SqliteMigrator, migrate
+    if "rate_limits" in [c.name for c in db.get_columns(ChannelSetting._meta.table_name)]:
+        return
+    migrate(SqliteMigrator(db).add_column(ChannelSetting._meta.table_name, "rate_limits", ChannelSetting.rate_limits))
+
+LOG_MOVE_CHUNK = 50000
+
+@migration(4)
+def _migration_split_log():
+    """Move chat log rows from the combined database of older versions into the log database."""
+    if not db.table_exists("log"):
+        return
+    total = db.execute_sql("SELECT COUNT(*) FROM log").fetchone()[0]
+    if total:
+        logger.info(f"Moving {total} log rows to {config.LOG_DB_PATH}")
+        db.execute_sql("ATTACH DATABASE ? AS logstore", (config.LOG_DB_PATH,))
+        try:
+            max_id = db.execute_sql("SELECT MAX(id) FROM log").fetchone()[0]
+            last = 0
+            while last < max_id:
+                upper = min(last + LOG_MOVE_CHUNK, max_id)
+                with db.atomic():
+                    # Ids are kept, so references like the vector index stay valid; the
+                    # log store's FTS triggers index the rows as they arrive
+                    db.execute_sql(
+                        "INSERT OR IGNORE INTO logstore.log (id, timestamp, hostmask, nick, target, message) "
+                        "SELECT id, timestamp, hostmask, nick, target, message FROM main.log WHERE id > ? AND id <= ?",
+                        (last, upper),
+                    )
+                logger.info(f"Log move: copied rows up to id {upper}/{max_id}")
+                last = upper
+            # The log store's migrations ran first, so the stats backfill (log migration 3)
+            # recorded its range before these rows existed; the moved rows bypassed the
+            # stats listener and must be counted by the backfill
+            if db.execute_sql("SELECT 1 FROM logstore.sqlite_master WHERE type = 'table' "
+                              "AND name = 'statsbackfill'").fetchone():
+                db.execute_sql("UPDATE logstore.statsbackfill SET upto = MAX(upto, ?)", (max_id,))
+        finally:
+            db.execute_sql("DETACH DATABASE logstore")
+    for trigger in ("log_fts_ai", "log_fts_ad", "log_fts_au"):
+        db.execute_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    db.execute_sql("DROP TABLE IF EXISTS log_fts")
+    db.execute_sql("DROP TABLE IF EXISTS log")
+    db.execute_sql("VACUUM")
@@ -0,0 +1,255 @@
+import asyncio
+import time
+from typing import Optional
+import logic_server.db as db
+from shared.logger import setup_logger
+from logic_server.commands import handle_line, split_command, COMMAND_CLASSES, subscriptions
+from logic_server.commands.subscriptions import IRCEvent
+
+logger = setup_logger("logic_server.events")
+
+ADMIN_USER_SUBCOMMANDS = ("add", "remove", "set")
+# "!<command> <sub>" needs Owner or Admin; the bare commands (e.g. showing rate limits) stay open
+RESTRICTED_SUBCOMMANDS = {
+    "admin": ("broadcast", "clients", "profile"),
+    "ratelimit": ("set", "reset"),
+}
+ADMIN_LEVELS = ("Owner", "Admin")
+USER_LEVELS = ("Owner", "Admin", "Normal", "Ignored")
+PENDING_ADMIN_TTL = 60  # seconds to wait for a WHOIS reply before dropping the request
+PENDING_ADMIN_MAX = 100
+CHANNEL_PREFIXES = ("#", "&")
+SUPPRESSED_SAMPLE_CHARS = 100
+LOGGED_EVENTS = ("join", "part", "nick")  # always forwarded by the bot, for the log and !seen
+
+# Secret the first owner must send via "/msg <bot> !verify <secret>"; None once an owner exists.
+owner_secret: Optional[str] = None
+# nick -> (cmd, level, channel, requested_at) for admin user changes waiting on a WHOIS reply
+pending_admin: dict[str, tuple] = {}
+# Ignored hostmasks and prefixes, refreshed when db.state_version() changes. Lets the
+# pre-dispatch checks run without awaiting, so lines are logged in the order they arrive
+# even though the server handles each line in its own task.
+_settings_cache = {"version": None, "ignored": set(), "prefixes": {}}
+
+
+def set_owner_secret(secret: Optional[str]):
+    global owner_secret
+    owner_secret = secret or None
+
+def split_source(source: str) -> tuple[str, str]:
+    """Returns (hostmask, nick) from an IRC source like ':nick!user@host'."""
+    hostmask = source.lstrip(':')
+    return hostmask, hostmask.split('!')[0]
+
+def reply(text, target: Optional[str] = None) -> dict:
+    msg = {"response": text}
+    if target:
+        msg["target"] = target
+    return msg
+
+def _read_state() -> dict:
+    return {
+        "type": "state",
+        "ignored": db.get_ignored_hostmasks(),
+        "prefixes": db.get_all_prefixes(),
+        "command_classes": dict(COMMAND_CLASSES),
+        "rate_limits": {"default": db.DEFAULT_RATE_LIMITS, "channels": db.get_all_rate_limit_overrides()},
+        # Non-message events the bot should forward; messages always are
+        "events": sorted(set(LOGGED_EVENTS) | subscriptions.subscribed() - {"message"}),
+    }
+
+async def get_state() -> dict:
+    """Read caches pushed down to the bot so it can filter and rate limit traffic without asking us."""
+    return await db.aread(_read_state)
+
+def state_version() -> tuple:
+    """Changes whenever get_state() would return something different."""
+    return db.state_version(), subscriptions.version()
+
+def cached_settings() -> dict:
+    if _settings_cache["version"] != db.state_version():
+        _settings_cache["version"] = db.state_version()
+        _settings_cache["ignored"] = set(db.get_ignored_hostmasks())
+        _settings_cache["prefixes"] = db.get_all_prefixes()
+    return _settings_cache
+
+async def handle_message(data: dict) -> list[dict]:
+    """
+    Handle one message from a bot connection and return the messages to send back.
+    Raw IRC lines are filtered, logged and dispatched to handle_line here; the bot
+    itself never touches the database.
+    """
+    msg_type = data.get("type")
+    if msg_type == "sent":
+        return handle_sent(data)
+    if msg_type == "whois":
+        return await handle_whois(data)
+    if msg_type == "endofwhois":
+        return handle_endofwhois(data)
+    if msg_type == "suppressed":
+        return handle_suppressed(data)
+    raw_line = data.get("line")
+    if raw_line:
+        return await handle_irc_line(raw_line, log_only=data.get("log_only", False),
+                                     channels=tuple(data.get("channels", ())))
+    return []
+
+def handle_sent(data: dict) -> list[dict]:
+    """Log lines the bot actually sent to IRC."""
+    bot_nick = data.get("nick")
+    target = data.get("target")
+    for line in data.get("lines", []):
+        db.log_message(f"{bot_nick}!bot@localhost", bot_nick, target, line)
+    return []
+
+def handle_suppressed(data: dict) -> list[dict]:
+    """One log row for a flood the bot dropped instead of forwarding it."""
+    hostmask, nick = split_source(data.get("hostmask", ""))
+    if hostmask in cached_settings()["ignored"]:
+        return []
+    sample = data.get("sample", "")[:SUPPRESSED_SAMPLE_CHARS]
+    db.log_message(hostmask, nick, data.get("target", ""),
+                   f"[{data.get('count', 0)} lines suppressed ({data.get('reason', 'flood')}): {sample}]")
+    return []
+
+async def handle_irc_line(raw_line: str, log_only: bool = False, channels: tuple = ()) -> list[dict]:
+    """log_only lines (e.g. rate limited by the bot) are recorded but never dispatched."""
+    parts = raw_line.split(" ", 3)
+    if len(parts) < 3:
+        return []
+    hostmask, nick = split_source(parts[0])
+    verb = parts[1]
+    settings = cached_settings()
+    if hostmask in settings["ignored"]:
+        return []
+    if verb == "PRIVMSG" and len(parts) == 4:
+        target, content = parts[2], parts[3][1:]
+        if log_only:
+            db.log_message(hostmask, nick, target, content)
+            return []
+        if owner_secret and not target.startswith(CHANNEL_PREFIXES) and content.startswith("!verify "):
+            return await handle_verify(hostmask, nick, content)
+        if is_admin_user_command(settings["prefixes"].get(target, "!"), content):
+            return await handle_admin_user(hostmask, target, content)
+        if is_restricted_command(settings["prefixes"].get(target, "!"), content):
+            if await db.aread(db.get_user_level, hostmask) not in ADMIN_LEVELS:
+                return [reply("Permission denied", target)]
+        db.log_message(hostmask, nick, target, content)
+        if not subscriptions.has_handlers("message"):
+            resp, resp_target = await handle_line(raw_line)
+            return [reply(resp, resp_target)] if resp else []
+        channel = target if target.startswith(CHANNEL_PREFIXES) else None
+        event = IRCEvent("message", hostmask, nick, channel, text=content)
+        (resp, resp_target), replies = await asyncio.gather(handle_line(raw_line), subscriptions.dispatch(event))
+        return ([reply(resp, resp_target)] if resp else []) + replies
+    event = parse_event(verb, hostmask, nick, parts, channels)
+    if event is None:
+        return []
+    if event.type == "join":
+        db.log_message(hostmask, nick, event.channel, f"{nick} joined {event.channel}")
+    elif event.type == "part":
+        db.log_message(hostmask, nick, event.channel, f"{nick} left {event.channel}")
+    elif event.type == "nick":
+        db.log_message(hostmask, nick, event.target, f"{nick} is now {event.target}")
+    if log_only:
+        return []
+    return await subscriptions.dispatch(event)
+
+def parse_event(verb: str, hostmask: str, nick: str, parts: list[str], channels: tuple = ()) -> Optional[IRCEvent]:
+    """
+    An IRCEvent for a JOIN, PART, NICK, QUIT, KICK, TOPIC or MODE line as the bot
+    forwards it (parts is the line split on its first three spaces), else None.
+    """
+    rest = parts[3] if len(parts) == 4 else ""
+    trailing = rest[1:] if rest.startswith(":") else rest
+    if verb == "JOIN":
+        return IRCEvent("join", hostmask, nick, parts[2].lstrip(":"))
+    if verb == "PART":
+        return IRCEvent("part", hostmask, nick, parts[2], text=trailing)
+    if verb == "NICK":
+        return IRCEvent("nick", hostmask, nick, target=parts[2].lstrip(":"), channels=channels)
+    if verb == "QUIT":
+        reason = " ".join(parts[2:])
+        return IRCEvent("quit", hostmask, nick, text=reason[1:] if reason.startswith(":") else reason,
+                        channels=channels)
+    if verb == "KICK":
+        kicked, _, reason = rest.partition(" :")
+        return IRCEvent("kick", hostmask, nick, parts[2], target=kicked, text=reason)
+    if verb == "TOPIC":
+        return IRCEvent("topic", hostmask, nick, parts[2], text=trailing)
+    if verb == "MODE" and parts[2].startswith(CHANNEL_PREFIXES):
+        return IRCEvent("mode", hostmask, nick, parts[2], target=rest)
+    return None
+
+async def handle_verify(hostmask: str, nick: str, content: str) -> list[dict]:
+    provided = content.split(" ", 1)[1].strip()
+    if provided != owner_secret:
+        return [reply("Invalid passphrase.", nick)]
+    await asyncio.to_thread(db.add_user, hostmask, nick, "Owner")
+    set_owner_secret(None)
+    logger.info(f"{hostmask} verified as owner")
+    return [reply("You are now the owner.", nick)]
+
+def is_admin_user_command(prefix: str, content: str) -> bool:
+    invoked = split_command(prefix, content)
+    if invoked is None:
+        return False
+    cmd, args = invoked
+    return cmd == "admin" and len(args) >= 2 and args[0] == "user" and args[1] in ADMIN_USER_SUBCOMMANDS
+
+def is_restricted_command(prefix: str, content: str) -> bool:
+    invoked = split_command(prefix, content)
+    if invoked is None:
+        return False
+    cmd, args = invoked
+    return bool(args) and args[0] in RESTRICTED_SUBCOMMANDS.get(cmd, ())
+
+def _expire_pending_admin():
+    cutoff = time.monotonic() - PENDING_ADMIN_TTL
+    for nick in [n for n, info in pending_admin.items() if info[3] < cutoff]:
+        logger.info(f"Dropping stale admin request for {nick}")
+        del pending_admin[nick]
+
+async def handle_admin_user(caller: str, channel: str, content: str) -> list[dict]:
+    """!admin user add|set|remove NICK [LEVEL]: permission check here, hostmask via a bot WHOIS."""
+    parts = content.split()
+    lvl = await db.aread(db.get_user_level, caller)
+    if lvl not in ADMIN_LEVELS:
+        return [reply("Permission denied", channel)]
+    if len(parts) < 4 or parts[1] != "user":
+        return [reply("Usage: !admin user add|remove NICK [LEVEL]", channel)]
+    cmd, target = parts[2], parts[3]
+    newlvl = None
+    if cmd in ("add", "set"):
+        if len(parts) != 5:
+            return [reply("Usage: !admin user add NICK LEVEL", channel)]
+        newlvl = parts[4].capitalize()
+        if newlvl not in USER_LEVELS:
+            return [reply(f"Invalid level {newlvl}", channel)]
+    _expire_pending_admin()
+    pending_admin.pop(target, None)
+    while len(pending_admin) >= PENDING_ADMIN_MAX:
+        del pending_admin[next(iter(pending_admin))]  # oldest first
+    pending_admin[target] = (cmd, newlvl, channel, time.monotonic())
+    return [reply(f"__WHOIS__::{target}"), reply(f"Looking up hostmask for {target}...", channel)]
+
+async def handle_whois(data: dict) -> list[dict]:
+    nick = data.get("nick")
+    info = pending_admin.pop(nick, None)
+    if not info:
+        return []
+    cmd, lvl, channel, _ = info
+    hostmask = f"{nick}!{data.get('user')}@{data.get('host')}"
+    if cmd in ("add", "set"):
+        await asyncio.to_thread(db.add_user, hostmask, nick, lvl)
+        text = f"User {nick} added as {lvl}"
+    else:
+        await asyncio.to_thread(db.remove_user, hostmask)
+        text = f"User {nick} removed"
+    return [reply(text, channel)]
+
+def handle_endofwhois(data: dict) -> list[dict]:
+    info = pending_admin.pop(data.get("nick"), None)
+    if not info:
+        return []
+    return [reply(f"WHOIS failed for {data.get('nick')}", info[2])]
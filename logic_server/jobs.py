@@ -0,0 +1,455 @@
+"""
+jobs.py
+Timers and scheduled jobs for plugins: reminders, periodic feeds, cache refreshes.
+
+    @job("feed", every=600, jitter=30, target="#news")
+    def feed(target, data): ...          # periodic; returns text for target, or None
+
+    @job("remind")
+    def remind(target, data): ...        # one-shot type, scheduled with schedule()
+    schedule("remind", delay=3600, target="#chan", data={"text": "tea"})
+
+Pending runs are rows in the settings database (ScheduledJob), so they survive
+restarts. Only the runs due within HORIZON seconds are held in memory, in a heap, and
+the rest are read from the run_at index as the horizon moves on, so scheduling costs
+O(log n) however many reminders are pending.
+
+When a run is more than `misfire_grace` seconds late (the server was down or busy) its
+job's `misfire` policy decides: "skip" drops it (a periodic job waits for its next
+slot), "once" runs it once, "all" also runs every missed slot of a periodic job.
+One-shot runs are deleted after they finish, so one interrupted by a restart runs again.
+
+A run scheduled while handling a line remembers the bot that line came from, and its
+output goes only to bots on that bot's network (preferring that bot), so a reminder in
+#python on one network is not also said in #python on another. Runs with no origin,
+such as periodic jobs, go to every network's bot in the target channel.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import json
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+import peewee
+import config
+import logic_server.db as db
+from logic_server import plugin_workers, clients
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("logic_server.jobs")
+
+HORIZON = 3600          # seconds of upcoming runs kept in memory
+RETRY_UNDELIVERED = 60  # seconds before retrying a one-shot result no bot was connected for
+MAX_CATCHUP = 100       # missed slots a periodic job with misfire="all" runs at most
+MISFIRE_POLICIES = ("skip", "once", "all")
+PERIODIC_KEY = "every:"
+
+
+class ScheduledJob(db.BaseModel):
+    job = peewee.CharField()
+    run_at = peewee.FloatField(index=True)  # epoch seconds, without jitter
+    target = peewee.CharField(default="")
+    data = peewee.TextField(default="")     # JSON
+    key = peewee.CharField(null=True, unique=True)  # optional, for replacing or cancelling by name
+    created_at = peewee.FloatField(default=time.time)
+    bot = peewee.CharField(default="")      # id of the bot the scheduling line came from; "" for none
+    network = peewee.CharField(default="")  # that bot's network; output goes only there
+
+
+class JobDef:
+    __slots__ = ("name", "func", "every", "jitter", "target", "max_concurrent", "timeout", "misfire",
+                 "misfire_grace", "running")
+
+    def __init__(self, name, func, every, jitter, target, max_concurrent, timeout, misfire, misfire_grace):
+        self.name = name
+        self.func = func
+        self.every = every
+        self.jitter = jitter
+        self.target = target
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.misfire = misfire
+        self.misfire_grace = misfire_grace
+        self.running = 0
+
+    @property
+    def periodic(self) -> bool:
+        return self.every is not None
+
+
+JOBS: dict[str, JobDef] = {}
+
+
+def job(name: str, every: Optional[float] = None, jitter: float = 0, target: str = "",
+        max_concurrent: Optional[int] = None, timeout: Optional[float] = None,
+        misfire: Optional[str] = None, misfire_grace: float = 60):
+    """
+    Decorator to register a job handler, called as handler(target, data) in a worker
+    thread (or awaited, if async) and expected to return text for target, a list of
+    lines, or None. With `every` (seconds) the job runs periodically; otherwise runs are
+    created with schedule(). Periodic jobs default to one run at a time and skipping
+    missed runs; one-shot jobs to 4 concurrent runs and running late ones once.
+    """
+    misfire = misfire or ("skip" if every else "once")
+    if misfire not in MISFIRE_POLICIES:
+        raise ValueError(f"Unknown misfire policy {misfire!r} for job {name}")
+    if every is not None and every <= 0:
+        raise ValueError(f"Job {name} needs a positive interval")
+    def decorator(func: callable):
+        JOBS[name] = JobDef(name, func, every, jitter, target, max_concurrent or (1 if every else 4),
+                            timeout or config.JOB_TIMEOUT, misfire, misfire_grace)
+        if _scheduler is not None and every is not None:
+            _scheduler.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(_scheduler.ensure_periodic(name)))
+        return func
+    return decorator
+
+
+class Run:
+    """A pending run held in memory (within the horizon)."""
+    __slots__ = ("id", "job", "run_at", "target", "data", "bot", "network")
+
+    def __init__(self, row_id: int, job_name: str, run_at: float, target: str, data: str,
+                 bot: str = "", network: str = ""):
+        self.id = row_id
+        self.job = job_name
+        self.run_at = run_at
+        self.target = target
+        self.data = data
+        self.bot = bot
+        self.network = network
+
+
+class JobScheduler:
+    def __init__(self, send: Callable[..., Awaitable[bool]], max_concurrency: int):
+        self.send = send
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.get_running_loop()
+        self.heap: list[tuple] = []         # (due incl. jitter, seq, run id)
+        self.pending: dict[int, Run] = {}   # run id -> run, for everything in the heap
+        self.waiting: deque = deque()       # runs that are due but over a concurrency limit
+        self.running = 0
+        self.loaded_until = 0.0             # every run due up to here is in the heap
+        self.loading_until = 0.0            # horizon of a refill still reading the DB
+        self.seq = itertools.count()
+        self.wake = asyncio.Event()
+        # Timed-out sync handlers keep their thread, hence the headroom
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="job")
+        self.task: Optional[asyncio.Task] = None
+
+    # --- in-memory queue ---
+
+    def add(self, run: Run):
+        """Track a run if it is due within the loaded horizon (else a later refill loads it)."""
+        if run.id in self.pending or run.run_at > max(self.loaded_until, self.loading_until):
+            return
+        definition = JOBS.get(run.job)
+        due = run.run_at + (random.uniform(0, definition.jitter) if definition and definition.jitter else 0)
+        self.pending[run.id] = run
+        heapq.heappush(self.heap, (due, next(self.seq), run.id))
+        if self.heap[0][2] == run.id:
+            self.wake.set()
+
+    def discard(self, run_id: int):
+        self.pending.pop(run_id, None)  # its heap entry is skipped when popped
+
+    async def refill(self):
+        until = time.time() + HORIZON
+        self.loading_until = until
+        rows = await db.aread(_due_rows, self.loaded_until, until)
+        self.loaded_until = until
+        for row in rows:
+            self.add(Run(*row))
+        metrics.gauge("jobs.in_memory", len(self.pending))
+
+    async def ensure_periodic(self, name: str):
+        """Create the row for a periodic job registered after startup (or never run before)."""
+        definition = JOBS.get(name)
+        if definition is None or not definition.periodic:
+            return
+        row = await db.awrite(_ensure_periodic_row, name, time.time() + definition.every)
+        self.add(Run(*row))
+
+    # --- main loop ---
+
+    async def run(self):
+        for name in [n for n, d in JOBS.items() if d.periodic]:
+            await self.ensure_periodic(name)
+        await db.awrite(_drop_orphan_periodic_rows, [n for n, d in JOBS.items() if d.periodic])
+        await self.refill()
+        while True:
+            now = time.time()
+            if now + HORIZON / 2 > self.loaded_until:
+                await self.refill()
+            while self.heap and self.heap[0][0] <= now:
+                _, _, run_id = heapq.heappop(self.heap)
+                run = self.pending.pop(run_id, None)
+                if run is not None:
+                    self.due(run, now)
+            timeout = self.loaded_until - HORIZON / 2 - now
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - now)
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def due(self, run: Run, now: float):
+        definition = JOBS.get(run.job)
+        if definition is None:
+            logger.warning(f"No handler registered for job {run.job} (run {run.id}), leaving it pending")
+            return
+        late = now - run.run_at > definition.misfire_grace
+        if late:
+            metrics.incr(f"jobs.misfired.{run.job}")
+        if definition.periodic:
+            # Move the row to the next slot before running, so a crash mid-run does not repeat it
+            missed = int((now - run.run_at) // definition.every)
+            if late and (definition.misfire != "all" or missed > MAX_CATCHUP):
+                slot = run.run_at + definition.every * (missed + 1)
+            else:
+                slot = run.run_at + definition.every  # catching up: due again right away
+            self._reschedule(run, slot)
+            if late and definition.misfire == "skip":
+                return
+            if definition.running >= definition.max_concurrent and definition.misfire != "all":
+                metrics.incr(f"jobs.overlap_skipped.{run.job}")
+                logger.info(f"Job {run.job} still running, skipping this run")
+                return
+        elif late and definition.misfire == "skip":
+            logger.info(f"Dropping job {run.job} (run {run.id}), {now - run.run_at:.0f}s late")
+            db.submit_write(_delete_row, run.id)
+            return
+        self.waiting.append(run)
+        self._start_waiting()
+
+    def _reschedule(self, run: Run, slot: float):
+        db.submit_write(_move_row, run.id, slot)
+        self.add(Run(run.id, run.job, slot, run.target, run.data, run.bot, run.network))
+
+    def _start_waiting(self):
+        if not self.waiting or self.running >= self.max_concurrency:
+            return
+        for _ in range(len(self.waiting)):
+            run = self.waiting.popleft()
+            definition = JOBS.get(run.job)
+            if definition is None:
+                continue
+            if definition.running >= definition.max_concurrent:
+                self.waiting.append(run)
+                continue
+            definition.running += 1
+            self.running += 1
+            asyncio.create_task(self.execute(run, definition))
+            if self.running >= self.max_concurrency:
+                break
+        metrics.gauge("jobs.waiting", len(self.waiting))
+
+    async def deliver(self, run: Run, message: dict) -> bool:
+        """Send a run's output on the network it was scheduled from, or anywhere if it has no origin."""
+        if not run.bot:
+            return await self.send(message)
+        origin = clients.CLIENTS.get(run.bot)
+        if origin is not None and origin.network != run.network:
+            origin = None  # the id now belongs to a bot elsewhere
+        return await self.send(message, origin=origin, network=run.network)
+
+    async def execute(self, run: Run, definition: JobDef):
+        started = time.monotonic()
+        target = run.target or definition.target
+        try:
+            data = json.loads(run.data) if run.data else {}
+            if plugin_workers.isolated(definition.func):
+                result = await asyncio.wait_for(plugin_workers.call(definition.func, (target, data)),
+                                                definition.timeout)
+            elif inspect.iscoroutinefunction(definition.func):
+                result = await asyncio.wait_for(definition.func(target, data), definition.timeout)
+            else:
+                work = self.loop.run_in_executor(self.executor, definition.func, target, data)
+                result = await asyncio.wait_for(work, definition.timeout)
+            delivered = True
+            if result and target:
+                delivered = await self.deliver(run, {"response": result, "target": target})
+            if not definition.periodic:
+                if delivered:
+                    await db.awrite(_delete_row, run.id)
+                else:
+                    logger.warning(f"No bot connected for job {run.job} (run {run.id}), "
+                                   f"retrying in {RETRY_UNDELIVERED}s")
+                    self._reschedule(run, time.time() + RETRY_UNDELIVERED)
+            metrics.incr(f"jobs.ran.{run.job}")
+        except asyncio.TimeoutError:
+            metrics.incr(f"jobs.timeout.{run.job}")
+            logger.warning(f"Job {run.job} (run {run.id}) timed out after {definition.timeout}s")
+            if not definition.periodic:
+                await db.awrite(_delete_row, run.id)
+        except Exception as e:
+            metrics.incr(f"jobs.error.{run.job}")
+            logger.error(f"Job {run.job} (run {run.id}) failed: {e}", exc_info=True)
+            if not definition.periodic:
+                await db.awrite(_delete_row, run.id)
+        finally:
+            metrics.observe(f"jobs.run_s.{run.job}", time.monotonic() - started)
+            definition.running -= 1
+            self.running -= 1
+            self._start_waiting()
+
+
+# --- database side (writer thread / read pool) --------------------------------
+
+def _due_rows(after: float, until: float) -> list[tuple]:
+    q = (ScheduledJob.select(ScheduledJob.id, ScheduledJob.job, ScheduledJob.run_at, ScheduledJob.target,
+                             ScheduledJob.data, ScheduledJob.bot, ScheduledJob.network)
+         .where(ScheduledJob.run_at <= until))
+    if after:
+        q = q.where(ScheduledJob.run_at > after)
+    return list(q.tuples())
+
+def _insert_row(name: str, run_at: float, target: str, data: str, key: Optional[str],
+                bot: str = "", network: str = "") -> tuple:
+    """The new row, and the ids of the rows it replaced."""
+    replaced = _delete_rows(key, None) if key is not None else []
+    row = ScheduledJob.create(job=name, run_at=run_at, target=target, data=data, key=key, bot=bot, network=network)
+    return (row.id, name, run_at, target, data, bot, network), replaced
+
+def _ensure_periodic_row(name: str, run_at: float) -> tuple:
+    row = ScheduledJob.get_or_none(ScheduledJob.key == PERIODIC_KEY + name)
+    if row is None:
+        row = ScheduledJob.create(job=name, run_at=run_at, key=PERIODIC_KEY + name)
+    return row.id, row.job, row.run_at, row.target, row.data, row.bot, row.network
+
+def _drop_orphan_periodic_rows(names: list[str]):
+    """Periodic rows whose job no longer exists once all plugins are loaded."""
+    keys = [PERIODIC_KEY + n for n in names]
+    q = ScheduledJob.delete().where(ScheduledJob.key.startswith(PERIODIC_KEY))
+    if keys:
+        q = q.where(ScheduledJob.key.not_in(keys))
+    q.execute()
+
+def _move_row(row_id: int, run_at: float):
+    ScheduledJob.update(run_at=run_at).where(ScheduledJob.id == row_id).execute()
+
+def _delete_row(row_id: int):
+    ScheduledJob.delete().where(ScheduledJob.id == row_id).execute()
+
+def _delete_rows(key: Optional[str], row_id: Optional[int], key_prefix: Optional[str] = None) -> list[int]:
+    q = ScheduledJob.select(ScheduledJob.id)
+    if key_prefix is not None:
+        q = q.where(ScheduledJob.key.startswith(key_prefix))
+    elif key is not None:
+        q = q.where(ScheduledJob.key == key)
+    else:
+        q = q.where(ScheduledJob.id == row_id)
+    ids = [r.id for r in q]
+    if ids:
+        ScheduledJob.delete().where(ScheduledJob.id.in_(ids)).execute()
+    return ids
+
+@db.migration(5)
+def _migration_scheduled_jobs():
+    """Pending runs of plugin jobs."""
+    db.db.create_tables([ScheduledJob], safe=True)
+
+@db.migration(6)
+def _migration_scheduled_job_origin():
+    """The bot and network a pending run was scheduled from."""
+    from playhouse.migrate import SqliteMigrator, migrate
+    table = ScheduledJob._meta.table_name
+    existing = [c.name for c in db.db.get_columns(table)]
+    migrator = SqliteMigrator(db.db)
+    migrate(*[migrator.add_column(table, name, getattr(ScheduledJob, name))
+              for name in ("bot", "network") if name not in existing])
+
+
+# --- plugin API ---------------------------------------------------------------
+
+_scheduler: Optional[JobScheduler] = None
+
+def _run_at(delay: Optional[float], at: Optional[float]) -> float:
+    if (delay is None) == (at is None):
+        raise ValueError("Pass exactly one of delay (seconds) or at (epoch seconds)")
+    return time.time() + delay if delay is not None else at
+
+def _origin() -> tuple[str, str]:
+    """(bot id, network) of the bot whose line is being handled, or ("", "") outside a request."""
+    origin = clients.ORIGIN.get()
+    return (origin.id, origin.network) if origin is not None else ("", "")
+
+def _track(row: tuple, replaced: list[int]):
+    if _scheduler is not None:
+        for run_id in replaced:
+            _scheduler.loop.call_soon_threadsafe(_scheduler.discard, run_id)
+        _scheduler.loop.call_soon_threadsafe(_scheduler.add, Run(*row))
+
+def schedule(name: str, delay: Optional[float] = None, at: Optional[float] = None, target: str = "",
+             data: Optional[dict] = None, key: Optional[str] = None) -> int:
+    """
+    Schedule a one-shot run of job `name` in `delay` seconds or at epoch time `at`,
+    persisted until it has run. A run with the same key replaces the earlier one.
+    Called while handling a line, the run's output goes back to that line's network.
+    Blocks on the database write: call from sync handlers (use aschedule when async).
+    Returns the run id.
+    """
+    if name not in JOBS:
+        raise ValueError(f"Unknown job {name}")
+    row, replaced = db.write(_insert_row, name, _run_at(delay, at), target, json.dumps(data or {}), key,
+                             *_origin())
+    _track(row, replaced)
+    return row[0]
+
+async def aschedule(name: str, delay: Optional[float] = None, at: Optional[float] = None, target: str = "",
+                    data: Optional[dict] = None, key: Optional[str] = None) -> int:
+    if name not in JOBS:
+        raise ValueError(f"Unknown job {name}")
+    row, replaced = await db.awrite(_insert_row, name, _run_at(delay, at), target, json.dumps(data or {}), key,
+                                    *_origin())
+    _track(row, replaced)
+    return row[0]
+
+def cancel(key: Optional[str] = None, run_id: Optional[int] = None, key_prefix: Optional[str] = None) -> int:
+    """Cancel pending runs by key, id or key prefix; returns how many. Blocks on the database write."""
+    if key is None and run_id is None and key_prefix is None:
+        raise ValueError("Pass key, run_id or key_prefix")
+    ids = db.write(_delete_rows, key, run_id, key_prefix)
+    if _scheduler is not None:
+        for i in ids:
+            _scheduler.loop.call_soon_threadsafe(_scheduler.discard, i)
+    return len(ids)
+
+def pending_count(name: Optional[str] = None, key_prefix: Optional[str] = None) -> int:
+    """Pending runs, optionally of one job or with keys starting with key_prefix."""
+    q = ScheduledJob.select()
+    if name:
+        q = q.where(ScheduledJob.job == name)
+    if key_prefix is not None:
+        q = q.where(ScheduledJob.key.startswith(key_prefix))
+    return q.count()
+
+def unregister_module(module_name: str) -> list[str]:
+    """Drop the jobs a plugin registered (its pending runs stay in the database)."""
+    removed = [n for n, d in JOBS.items() if d.func.__module__ == module_name]
+    for n in removed:
+        del JOBS[n]
+    return removed
+
+def start(send: Callable[..., Awaitable[bool]]) -> asyncio.Task:
+    """
+    Start running jobs; send(message, origin=None, network=None) delivers a response like
+    clients.deliver and returns False if no bot took it.
+    """
+    global _scheduler
+    _scheduler = JobScheduler(send, config.JOB_MAX_CONCURRENCY)
+    _scheduler.task = asyncio.create_task(_scheduler.run())
+    return _scheduler.task
+
+def stop():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.task.cancel()
+        _scheduler.executor.shutdown(wait=False)
+        _scheduler = None
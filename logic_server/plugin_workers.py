@@ -0,0 +1,229 @@
+"""
+plugin_workers.py
+Runs plugin handlers in a pool of worker subprocesses (PLUGIN_WORKERS > 0), so a plugin
+that burns CPU, leaks memory or crashes only costs its own calls: each call is limited
+to PLUGIN_CPU_SECONDS of CPU, each worker to PLUGIN_MEMORY_MB on top of what it needs
+after start-up, a call that overruns its timeout has its worker killed and replaced,
+and no plugin handler can hold more than half of the workers. Built-in commands, and plugins
+that set IN_PROCESS = True because they use server state (e.g. remind, which
+schedules jobs), keep running in the server process.
+
+Plugins are still imported in the server, which registers their commands, events and
+jobs; the workers import them too and run the handlers. Arguments and results travel
+pickled over a pipe per worker, which the event loop watches directly.
+"""
+import asyncio
+import importlib
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from typing import Optional
+import config
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("logic_server.plugin_workers")
+
+PLUGIN_PACKAGE = "logic_server.plugins."
+
+
+class PluginError(Exception):
+    """A plugin handler failed in its worker; the message is the worker's error."""
+
+
+class CPULimitExceeded(Exception):
+    pass
+
+
+# --- worker process -----------------------------------------------------------
+
+def _cpu_exceeded(signum, frame):
+    raise CPULimitExceeded(f"used more than {config.PLUGIN_CPU_SECONDS}s of CPU")
+
+def _limit_memory(megabytes: int):
+    """Cap the address space at its current size plus megabytes (Linux; skipped elsewhere)."""
+    import resource
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (current + megabytes * 1024 * 1024, hard))
+
+def _limit_cpu(seconds: Optional[float]):
+    """SIGXCPU once this process has used `seconds` more CPU time; None lifts the limit."""
+    import resource
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        soft = hard
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _resolve(module_name: str, qualname: str):
+    module = sys.modules.get(module_name) or importlib.import_module(module_name)
+    target = module
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    return target
+
+def _worker_main(conn):
+    """Serve calls from the pipe until it closes. Replies are (status, value): "ok", "error" or "fatal"."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server stops us on shutdown
+    import logic_server.commands  # noqa: F401  imports every plugin, as the server does
+    _limit_memory(config.PLUGIN_MEMORY_MB)
+    signal.signal(signal.SIGXCPU, _cpu_exceeded)
+    while True:
+        try:
+            module_name, qualname, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            _limit_cpu(config.PLUGIN_CPU_SECONDS)
+            result = _resolve(module_name, qualname)(*args)
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            reply = ("ok", result)
+        except (CPULimitExceeded, MemoryError) as e:
+            reply = ("fatal", f"{type(e).__name__}: {e}")
+        except BaseException as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        finally:
+            _limit_cpu(None)
+        try:
+            conn.send(reply)
+        except Exception as e:  # e.g. an unpicklable result
+            conn.send(("error", f"could not return result: {e}"))
+
+
+# --- server side --------------------------------------------------------------
+
+class Worker:
+    def __init__(self, ctx, generation: int):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), name="plugin-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.generation = generation
+
+    async def call(self, module_name: str, qualname: str, args: tuple):
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        fd = self.conn.fileno()
+
+        def readable():
+            loop.remove_reader(fd)
+            if reply.done():
+                return
+            try:
+                reply.set_result(self.conn.recv())
+            except (EOFError, OSError):
+                reply.set_exception(PluginError(f"worker exited (code {self.process.exitcode})"))
+
+        try:
+            self.conn.send((module_name, qualname, args))
+        except OSError:
+            raise PluginError(f"worker exited (code {self.process.exitcode})")
+        loop.add_reader(fd, readable)
+        try:
+            return await reply
+        finally:
+            loop.remove_reader(fd)
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class WorkerPool:
+    def __init__(self, size: int):
+        self.ctx = multiprocessing.get_context("spawn")  # never fork a threaded server
+        self.size = size
+        self.share = max(1, size // 2)  # workers one handler may occupy at once
+        self.generation = 0
+        self.idle: deque[Worker] = deque(Worker(self.ctx, 0) for _ in range(size))
+        self.available = asyncio.Semaphore(size)
+        self.per_handler: dict[tuple, asyncio.Semaphore] = {}
+        self.busy: set[Worker] = set()
+
+    async def call(self, func, args: tuple):
+        module_name, qualname = func.__module__, func.__qualname__
+        handler = self.per_handler.setdefault((module_name, qualname), asyncio.Semaphore(self.share))
+        async with handler, self.available:
+            worker = self.idle.popleft()
+            self.busy.add(worker)
+            metrics.gauge("plugins.workers_busy", len(self.busy))
+            healthy = False
+            try:
+                status, value = await worker.call(module_name, qualname, args)
+                healthy = status != "fatal"
+                if status == "ok":
+                    return value
+                metrics.incr(f"plugins.{'limit' if status == 'fatal' else 'error'}.{module_name[len(PLUGIN_PACKAGE):]}")
+                raise PluginError(value)
+            finally:
+                self.busy.discard(worker)
+                if healthy and worker.generation == self.generation:
+                    self.idle.append(worker)
+                else:
+                    # Cancelled (timed out), crashed, over a limit, or running old plugin code
+                    metrics.incr("plugins.worker_restarts")
+                    worker.kill()
+                    self.idle.append(Worker(self.ctx, self.generation))
+
+    def refresh(self):
+        """Replace the workers, so they import the plugins as they are now; busy ones when they finish."""
+        self.generation += 1
+        for worker in list(self.idle):
+            worker.kill()
+        self.idle = deque(Worker(self.ctx, self.generation) for _ in self.idle)
+
+    def close(self):
+        for worker in list(self.idle) + list(self.busy):
+            worker.kill()
+
+
+_pool: Optional[WorkerPool] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def isolated(func) -> bool:
+    """True if func is a plugin handler that runs in the worker pool."""
+    if _pool is None or not func.__module__.startswith(PLUGIN_PACKAGE):
+        return False
+    return not getattr(sys.modules.get(func.__module__), "IN_PROCESS", False)
+
+async def call(func, args: tuple):
+    """Run func(*args) in a worker; raises PluginError if it fails. Cancelling kills the worker."""
+    started = time.monotonic()
+    try:
+        return await _pool.call(func, args)
+    finally:
+        metrics.observe("plugins.call_s", time.monotonic() - started)
+
+def plugins_changed():
+    """Call after loading, unloading or reloading a plugin (from any thread)."""
+    if _pool is not None:
+        _loop.call_soon_threadsafe(_pool.refresh)
+
+def start():
+    global _pool, _loop
+    if config.PLUGIN_WORKERS > 0:
+        _loop = asyncio.get_running_loop()
+        _pool = WorkerPool(config.PLUGIN_WORKERS)
+        logger.info(f"Running plugins in {config.PLUGIN_WORKERS} worker processes")
+
+def stop():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
@@ -0,0 +1,40 @@
+import re
+import time
+from shared.logger import setup_logger
+from logic_server.commands import command
+from logic_server.jobs import job, schedule, cancel, pending_count
+
+logger = setup_logger("plugins.remind")
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_RE = re.compile(r"^(\d+)([smhdw]?)$")
+MAX_DELAY = 365 * 86400
+MAX_PER_NICK = 20
+IN_PROCESS = True  # schedules jobs, which live in the server process
+
+def parse_duration(text: str):
+    """Seconds for "90" (minutes), "30s", "10m", "2h", "1d" or "1w"; None if malformed."""
+    m = DURATION_RE.match(text.lower())
+    if not m:
+        return None
+    return int(m.group(1)) * UNITS[m.group(2) or "m"]
+
+@job("remind")
+def remind_job(target: str, data: dict):
+    return f"{data['nick']}: reminder: {data['text']}"
+
+@command("remind")
+def remind_command(channel: str, nick: str, *args) -> str:
+    """Remind you of something later. Usage: !remind <10m|2h|1d> <text> | !remind cancel"""
+    key_prefix = f"remind:{nick.lower()}:"
+    if args[:1] == ("cancel",):
+        dropped = cancel(key_prefix=key_prefix)
+        return f"Cancelled {dropped} reminder(s)." if dropped else "You have no pending reminders."
+    delay = parse_duration(args[0]) if len(args) >= 2 else None
+    if delay is None or not 0 < delay <= MAX_DELAY:
+        return "Usage: !remind <10m|2h|1d> <text> (up to a year) | !remind cancel"
+    if pending_count(key_prefix=key_prefix) >= MAX_PER_NICK:
+        return f"You already have {MAX_PER_NICK} pending reminders."
+    schedule("remind", delay=delay, target=channel, data={"nick": nick, "text": " ".join(args[1:])},
+             key=f"{key_prefix}{time.time_ns()}")
+    return f"OK {nick}, I'll remind you in {args[0]}."
@@ -5,7 +5,9 @@ from urllib.parse import quote_plus
 
 logger = setup_logger("plugins.weather")
 
-@command("weather")
+FETCH_TIMEOUT = 8  # seconds; stays under the command timeout so users get the real error
+
+@command("weather", cost="network")
 def weather_command(channel: str, *args) -> str:
     """Fetches current weather for a specified location using wttr.in."""
     if not args:
@@ -13,7 +15,7 @@ def weather_command(channel: str, *args) -> str:
     location = " ".join(args)
     try:
         url = f"http://wttr.in/{quote_plus(location)}?format=3"
-        with urlopen(url) as resp:
+        with urlopen(url, timeout=FETCH_TIMEOUT) as resp:
             data = resp.read().decode('utf-8').strip()
         if channel and channel != '':
             nick_and_location = f"{channel}+{location}".replace('+', ' ')
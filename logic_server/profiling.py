@@ -0,0 +1,246 @@
+"""
+profiling.py
+Opt-in instrumentation for finding out where a slow request spent its time.
+
+- Slow-request log: with SLOW_REQUEST_THRESHOLD set, each request records stage
+  timings (parse, settings, handler, context, ai, tools, send). A request still
+  running when the threshold passes gets a stack snapshot of its task and worker
+  threads, and the whole breakdown is logged when it finishes.
+- Sampling profiler: `!admin profile on <cmd>` samples the stacks of threads running
+  that command every PROFILE_SAMPLE_INTERVAL seconds; `!admin profile show <cmd>`
+  reports the hottest stacks and writes folded stacks for flamegraph tools.
+- Event-loop lag: `!admin profile lag [seconds]` measures how late the loop wakes up.
+
+With the threshold unset and no command profiled, the hooks are a context variable
+lookup or a dict check and nothing else.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+import config
+from shared import metrics, tracing
+from shared.logger import setup_logger
+
+logger = setup_logger("logic_server.profiling")
+
+STACK_DEPTH = 12                   # innermost frames kept per sampled or snapshotted stack
+WORKER_THREAD_PREFIXES = ("command", "ai")
+
+# The event loop the server runs on, for thread-side helpers like measure_lag_blocking
+LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+class RequestTiming:
+    __slots__ = ("label", "started", "stages", "snapshot", "lock")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.stages: list[tuple[str, float]] = []
+        self.snapshot: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            self.stages.append((name, seconds))
+
+    def summary(self) -> str:
+        totals: dict[str, float] = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in totals.items())
+
+
+_CURRENT: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar("request_timing", default=None)
+_NOOP = nullcontext()
+
+
+def _format_frames(frame) -> str:
+    return "".join(traceback.format_list(traceback.extract_stack(frame)[-STACK_DEPTH:]))
+
+def _is_idle(frame) -> bool:
+    """True for a pool thread waiting for work: only threading/queue frames above the pool's _worker."""
+    while frame is not None and frame.f_code.co_name != "_worker":
+        if not frame.f_code.co_filename.endswith(("threading.py", "queue.py")):
+            return False
+        frame = frame.f_back
+    return True
+
+def _snapshot(req: RequestTiming, task: Optional[asyncio.Task]):
+    """Runs on the loop once a request passes the threshold: capture where it is stuck."""
+    parts = []
+    if task is not None and not task.done():
+        frames = task.get_stack(limit=STACK_DEPTH)
+        if frames:
+            parts.append("task:\n" + _format_frames(frames[-1]))
+    names = {t.ident: t.name for t in threading.enumerate()}
+    for ident, frame in sys._current_frames().items():
+        name = names.get(ident, "")
+        if name.startswith(WORKER_THREAD_PREFIXES) and not _is_idle(frame):
+            parts.append(f"thread {name}:\n{_format_frames(frame)}")
+    req.snapshot = "\n".join(parts) or "(no stack captured)"
+
+@contextmanager
+def _track_request(label: str):
+    req = RequestTiming(label)
+    token = _CURRENT.set(req)
+    loop = asyncio.get_running_loop()
+    handle = loop.call_later(config.SLOW_REQUEST_THRESHOLD, _snapshot, req, asyncio.current_task())
+    try:
+        yield req
+    finally:
+        handle.cancel()
+        _CURRENT.reset(token)
+        elapsed = time.perf_counter() - req.started
+        if elapsed >= config.SLOW_REQUEST_THRESHOLD:
+            metrics.incr("requests.slow")
+            logger.warning(f"Slow request ({elapsed:.2f}s) {label!r}: {req.summary()}"
+                           + (f"\nStack at {config.SLOW_REQUEST_THRESHOLD}s:\n{req.snapshot}" if req.snapshot else ""))
+
+def track_request(label: str):
+    """Wrap one request (a line from the bot) to record its stages; no-op unless SLOW_REQUEST_THRESHOLD is set."""
+    if not config.SLOW_REQUEST_THRESHOLD:
+        return _NOOP
+    return _track_request(label)
+
+@contextmanager
+def _stage(req: RequestTiming, name: str):
+    started = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        req.add(name, time.perf_counter() - started)
+
+def stage(name: str):
+    """Time a stage of the current request, if one is being tracked, and trace it if sampled."""
+    req = _CURRENT.get()
+    return tracing.span(name) if req is None else _stage(req, name)
+
+def bind(func):
+    """
+    Wrap func so it sees the caller's context vars (profiled request, trace, the channel
+    tools are scoped to) when run (once) on another thread.
+    """
+    ctx = contextvars.copy_context()
+    def run(*args, **kwargs):
+        return ctx.run(func, *args, **kwargs)
+    return run
+
+
+# --- sampling profiler -------------------------------------------------------
+
+class Sampler:
+    """Samples the stacks of threads registered with track() for the profiled commands."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: dict[int, str] = {}  # thread id -> command being run there
+        self.samples: dict[str, Counter] = {}  # command -> folded stack -> count
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def enable(self, cmd: str):
+        with self.lock:
+            self.samples.setdefault(cmd, Counter())
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+
+    def disable(self, cmd: str) -> Optional[Counter]:
+        with self.lock:
+            return self.samples.pop(cmd, None)
+
+    @contextmanager
+    def track(self, cmd: str):
+        ident = threading.get_ident()
+        self.active[ident] = cmd
+        try:
+            yield
+        finally:
+            self.active.pop(ident, None)
+
+    def _run(self):
+        while self.samples:
+            time.sleep(self.interval)
+            if not self.active:
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, cmd in list(self.active.items()):
+                    frame = frames.get(ident)
+                    if frame is not None and cmd in self.samples:
+                        self.samples[cmd][_fold(frame)] += 1
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None and len(names) < 64:
+        names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+_sampler = Sampler(config.PROFILE_SAMPLE_INTERVAL)
+PROFILED_COMMANDS = _sampler.samples
+
+def profile_command(cmd: str):
+    """Context manager around a command's handler; no-op unless the command is being profiled."""
+    if cmd not in PROFILED_COMMANDS:
+        return _NOOP
+    return _sampler.track(cmd)
+
+def start_profile(cmd: str):
+    _sampler.enable(cmd)
+
+def report_profile(cmd: str, stop: bool = False, top: int = 5) -> list[str]:
+    """Hottest leaf functions for cmd, and the folded stacks written to PROFILE_DIR."""
+    samples = _sampler.disable(cmd) if stop else _sampler.samples.get(cmd)
+    if samples is None:
+        return [f"{cmd} is not being profiled."]
+    total = sum(samples.values())
+    if not total:
+        return [f"No samples for {cmd} yet."]
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIR, f"{cmd}.folded")
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    leaves = Counter()
+    for stack, count in samples.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    hot = ", ".join(f"{leaf} {count * 100 / total:.0f}%" for leaf, count in leaves.most_common(top))
+    return [f"{cmd}: {total} samples ({total * _sampler.interval:.2f}s). Hottest: {hot}", f"Folded stacks: {path}"]
+
+def profiled_commands() -> list[str]:
+    return sorted(_sampler.samples)
+
+
+# --- event loop lag ----------------------------------------------------------
+
+async def measure_lag(seconds: float, interval: float = 0.01) -> dict:
+    """How late the event loop wakes from short sleeps, over `seconds`."""
+    lags = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - before - interval))
+    lags.sort()
+    return {
+        "samples": len(lags),
+        "p50": lags[len(lags) // 2],
+        "p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+        "max": lags[-1],
+        "tasks": len(asyncio.all_tasks()),
+    }
+
+def measure_lag_blocking(seconds: float) -> dict:
+    """measure_lag from a worker thread (e.g. a sync command handler)."""
+    if LOOP is None:
+        raise RuntimeError("Event loop not registered")
+    return asyncio.run_coroutine_threadsafe(measure_lag(seconds), LOOP).result(seconds + 5)
@@ -3,33 +3,89 @@ import json
 import websockets
 import config
 import signal
+from shared import tracing
 from shared.logger import setup_logger
 logger = setup_logger("logic_server")
-from logic_server.commands import handle_line
+from logic_server import events
+import logic_server.db as db
+from logic_server.ai import retrieval
+from logic_server import profiling, stats, jobs, plugin_workers, clients
 
 async def handler(websocket, path=None):
-    logger.info("Logic server: client connected")
+    """
+    Each message is handled in its own task so a slow command or AI request never
+    holds up the lines behind it. Heartbeats, hellos and channel lists are handled inline.
+    """
+    client = clients.connect(websocket)
+    logger.info(f"Logic server: client connected ({len(clients.CLIENTS)} connected)")
+    tasks = set()
+
+    async def process(data: dict):
+        try:
+            label = data.get("line") or data.get("type", "message")
+            clients.ORIGIN.set(client)  # e.g. so a job scheduled by this line answers on this bot's network
+            with profiling.track_request(label), tracing.continue_trace(data.get("trace"), "logic.handle", line=label):
+                outputs = await events.handle_message(data)
+                with profiling.stage("send"):
+                    parent = tracing.traceparent()
+                    for out in outputs:
+                        if "response" in out:
+                            logger.info(f"Sending response: {out['response']} to {out.get('target', '(no target)')}")
+                        if parent:
+                            out["trace"] = parent  # the bot records its IRC send under this request
+                        if isinstance(out.get("response"), str) and out["response"].startswith("__BROADCAST__::"):
+                            await clients.broadcast_text(out["response"].split("::", 1)[1])
+                        else:
+                            await clients.deliver(out, origin=client)
+            if data.get("ack") and "id" in data:
+                await client.send({"type": "ack", "id": data["id"]})
+            await clients.push_state(events.state_version(), events.get_state)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info("Client went away before its response was sent")
+        except Exception as e:
+            logger.error(f"Error handling WS message {data}: {e}", exc_info=True)
+
     try:
+        client.state_version = events.state_version()
+        await websocket.send(json.dumps(await events.get_state()))
         async for message in websocket:
             logger.debug(f"Received raw WS message: {message}")
             data = json.loads(message)
-            if data.get("type") == "heartbeat":
-                await websocket.send(json.dumps({"type": "heartbeat"}))
+            msg_type = data.get("type")
+            if msg_type == "heartbeat":
+                client.link = data.get("link")
+                await websocket.send(json.dumps({"type": "heartbeat", "id": data.get("id")}))
                 logger.debug("Replied to WS heartbeat")
                 continue
-            raw_line = data.get("line")
-            if raw_line:
-                resp, target = await handle_line(raw_line)
-                if resp and target:
-                    logger.info(f"Sending response: {resp} to {target}")
-                    await websocket.send(json.dumps({"response": resp, "target": target}))
-                elif resp:
-                    logger.info(f"Sending response: {resp} (no target)")
-                    await websocket.send(json.dumps({"response": resp}))
+            if msg_type == "hello":
+                clients.hello(client, data)
+                continue
+            if msg_type == "channels":
+                clients.set_channels(client, data.get("channels", []))
+                continue
+            # The bot coalesces lines that queued up behind a busy socket into one batch
+            items = data.get("items", []) if msg_type == "batch" else [data]
+            client.received.add(len(items))
+            for item in items:
+                task = asyncio.create_task(process(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
     except websockets.exceptions.ConnectionClosed:
         logger.info("Client disconnected")
+    finally:
+        clients.disconnect(client)
 
 async def main():
+    db.init_db()
+    tracing.setup("logic_server")
+    backfill = asyncio.create_task(stats.backfill())
+    plugin_workers.start()
+    jobs.start(clients.deliver)
+    profiling.LOOP = asyncio.get_running_loop()
+    if not db.has_owner():
+        secret = input("No owner found. Enter secret passphrase for first owner: ").strip()
+        events.set_owner_secret(secret)
+        logger.info("Owner setup pending: /msg the bot '!verify <passphrase>' to claim ownership")
     server = await websockets.serve(
         handler,
         config.LOGIC_SERVER_HOST,
@@ -44,6 +100,12 @@ async def main():
     logger.info("Shutting down logic server")
     server.close()
     await server.wait_closed()
+    backfill.cancel()  # resumes from its last chunk on the next start
+    jobs.stop()
+    plugin_workers.stop()
+    retrieval.close()
+    db.close_db()
+    tracing.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
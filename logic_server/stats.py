@@ -0,0 +1,211 @@
+"""
+stats.py
+Channel statistics kept up to date as lines are logged, so "who talks most", "when was
+X last here" and "messages per hour" are index lookups instead of scans of Log.
+
+The aggregates live in the log database next to the rows they summarise (dropping the
+log drops them too). New rows are counted by a log listener on the log writer thread;
+rows that existed when the tables were created are counted by backfill(), a task that
+feeds them through the same writer in small chunks.
+"""
+import asyncio
+import datetime
+import peewee
+import logic_server.db as db
+from shared import metrics
+from shared.logger import setup_logger
+
+logger = setup_logger("logic_server.stats")
+
+BACKFILL_CHUNK = 2000   # Log rows per backfill transaction
+BACKFILL_PAUSE = 0.05   # seconds between chunks, so live log writes get the writer in between
+CHANNEL_PREFIXES = ("#", "&")
+BOT_HOSTMASK_SUFFIX = "!bot@localhost"  # lines the bot sent (see events.handle_sent)
+
+
+class ChannelStat(db.LogModel):
+    channel = peewee.CharField(unique=True)
+    messages = peewee.IntegerField(default=0)
+    first_seen = peewee.DateTimeField()
+
+class NickStat(db.LogModel):
+    channel = peewee.CharField()
+    nick_key = peewee.CharField()  # lowercased nick
+    nick = peewee.CharField()      # as last seen
+    messages = peewee.IntegerField(default=0)
+    first_seen = peewee.DateTimeField()
+    last_seen = peewee.DateTimeField()
+    last_message = peewee.TextField(default="")
+    last_id = peewee.IntegerField(default=0)  # Log id of last_message
+
+    class Meta:
+        indexes = (
+            (("channel", "nick_key"), True),
+            (("channel", "messages"), False),
+            (("nick_key", "last_seen"), False),
+        )
+
+class HourlyStat(db.LogModel):
+    channel = peewee.CharField()
+    hour = peewee.DateTimeField()
+    messages = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = ((("channel", "hour"), True),)
+
+class StatsBackfill(db.LogModel):
+    upto = peewee.IntegerField()  # rows with ids up to here predate the listener
+    done = peewee.IntegerField(default=0)
+
+_backfill_complete = False
+
+
+def is_event(nick: str, target: str, message: str) -> bool:
+    """JOIN/PART rows are logged as text (see events.handle_irc_line); they count as presence, not messages."""
+    return message in (f"{nick} joined {target}", f"{nick} left {target}")
+
+def _hour(ts: datetime.datetime) -> datetime.datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+# The upserts shared by the per-row listener and the backfill; {source} yields the new values
+CHANNEL_UPSERT = (
+    "INSERT INTO channelstat (channel, messages, first_seen) {source} "
+    "ON CONFLICT (channel) DO UPDATE SET messages = channelstat.messages + excluded.messages, "
+    "first_seen = MIN(channelstat.first_seen, excluded.first_seen)"
+)
+NICK_UPSERT = (
+    "INSERT INTO nickstat (channel, nick_key, nick, messages, first_seen, last_seen, last_message, last_id) {source} "
+    "ON CONFLICT (channel, nick_key) DO UPDATE SET messages = nickstat.messages + excluded.messages, "
+    "first_seen = MIN(nickstat.first_seen, excluded.first_seen), "
+    "nick = CASE WHEN excluded.last_id > nickstat.last_id THEN excluded.nick ELSE nickstat.nick END, "
+    "last_seen = CASE WHEN excluded.last_id > nickstat.last_id THEN excluded.last_seen ELSE nickstat.last_seen END, "
+    "last_message = CASE WHEN excluded.last_id > nickstat.last_id THEN excluded.last_message "
+    "ELSE nickstat.last_message END, "
+    "last_id = MAX(nickstat.last_id, excluded.last_id)"
+)
+HOURLY_UPSERT = (
+    "INSERT INTO hourlystat (channel, hour, messages) {source} "
+    "ON CONFLICT (channel, hour) DO UPDATE SET messages = hourlystat.messages + excluded.messages"
+)
+
+@db.on_log_insert
+def _count_row(row):
+    """Runs on the log writer thread, in the same transaction as the Log insert."""
+    if not row.target.startswith(CHANNEL_PREFIXES) or row.hostmask.endswith(BOT_HOSTMASK_SUFFIX):
+        return
+    said = 0 if is_event(row.nick, row.target, row.message) else 1
+    ts = row.timestamp
+    db.log_db.execute_sql(NICK_UPSERT.format(source="VALUES (?, ?, ?, ?, ?, ?, ?, ?)"),
+                          (row.target, row.nick.lower(), row.nick, said, ts, ts, row.message, row.id))
+    if said:
+        db.log_db.execute_sql(CHANNEL_UPSERT.format(source="VALUES (?, ?, ?)"), (row.target, 1, ts))
+        db.log_db.execute_sql(HOURLY_UPSERT.format(source="VALUES (?, ?, ?)"), (row.target, _hour(ts), 1))
+
+
+# --- backfill ----------------------------------------------------------------
+
+# Log rows in (?, ?] that the listener would have counted, and whether each is a message
+_BACKFILL_ROWS = (
+    "SELECT id, timestamp, nick, target, message, "
+    "message NOT IN (nick || ' joined ' || target, nick || ' left ' || target) AS said "
+    "FROM log WHERE id > ? AND id <= ? AND substr(target, 1, 1) IN ('#', '&') "
+    f"AND hostmask NOT LIKE '%{BOT_HOSTMASK_SUFFIX}'"
+)
+
+def _backfill_chunk() -> bool:
+    """Count the next BACKFILL_CHUNK old rows; runs on the log writer. True once everything is counted."""
+    state = StatsBackfill.get_or_none()
+    if state is None or state.done >= state.upto:
+        return True
+    lo, hi = state.done, min(state.done + BACKFILL_CHUNK, state.upto)
+    params = (lo, hi)
+    rows = f"({_BACKFILL_ROWS})"
+    db.log_db.execute_sql(CHANNEL_UPSERT.format(
+        source=f"SELECT target, COUNT(*), MIN(timestamp) FROM {rows} WHERE said GROUP BY target"), params)
+    db.log_db.execute_sql(HOURLY_UPSERT.format(
+        source=f"SELECT target, strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*) FROM {rows} "
+               "WHERE said GROUP BY 1, 2"), params)
+    db.log_db.execute_sql(NICK_UPSERT.format(
+        source=f"SELECT g.target, g.nick_key, l.nick, g.said, g.first_seen, l.timestamp, l.message, g.last_id "
+               f"FROM (SELECT target, lower(nick) AS nick_key, SUM(said) AS said, MIN(timestamp) AS first_seen, "
+               f"MAX(id) AS last_id FROM {rows} GROUP BY target, lower(nick)) g "
+               "JOIN log l ON l.id = g.last_id WHERE true"), params)
+    state.done = hi
+    state.save()
+    return hi >= state.upto
+
+async def backfill():
+    """Count the Log rows that predate the statistics tables, a chunk at a time."""
+    global _backfill_complete
+    state = await db.aread(StatsBackfill.get_or_none)
+    if state is None or state.done >= state.upto:
+        _backfill_complete = True
+        return
+    logger.info(f"Stats backfill: counting log rows {state.done + 1}..{state.upto}")
+    chunks = 0
+    while not await db.awrite_log(_backfill_chunk):
+        chunks += 1
+        metrics.incr("stats.backfill_chunks")
+        if chunks % 50 == 0:
+            logger.info(f"Stats backfill: {chunks * BACKFILL_CHUNK} rows counted")
+        await asyncio.sleep(BACKFILL_PAUSE)
+    _backfill_complete = True
+    logger.info("Stats backfill complete")
+
+def backfill_complete() -> bool:
+    return _backfill_complete
+
+@db.migration(3, store="log")
+def _migration_stats():
+    """Aggregate tables; rows logged so far are counted by backfill()."""
+    db.log_db.create_tables([ChannelStat, NickStat, HourlyStat, StatsBackfill], safe=True)
+    upto = db.log_db.execute_sql("SELECT COALESCE(MAX(id), 0) FROM log").fetchone()[0]
+    StatsBackfill.create(upto=upto, done=0)
+
+
+# --- queries -----------------------------------------------------------------
+
+def get_last_seen(nick: str, channel: str = None):
+    """(timestamp, channel, message) of the last line or JOIN/PART from nick, or None."""
+    q = NickStat.select().where(NickStat.nick_key == nick.lower())
+    if channel:
+        q = q.where(NickStat.channel == channel)
+    stat = q.order_by(NickStat.last_seen.desc()).first()
+    if stat is None and not _backfill_complete:
+        return db.get_last_seen(nick, channel)  # may only be in rows not counted yet
+    return (stat.last_seen, stat.channel, stat.last_message) if stat else None
+
+def channel_summary(channel: str, top: int = 5, hours: int = 24) -> dict:
+    """Totals, the top talkers and the last `hours` hourly counts (oldest first) for a channel."""
+    total = ChannelStat.get_or_none(ChannelStat.channel == channel)
+    talkers = (NickStat.select(NickStat.nick, NickStat.messages)
+               .where((NickStat.channel == channel) & (NickStat.messages > 0))
+               .order_by(NickStat.messages.desc()).limit(top))
+    now = _hour(datetime.datetime.now())
+    since = now - datetime.timedelta(hours=hours - 1)
+    buckets = {h.hour: h.messages for h in HourlyStat.select()
+               .where((HourlyStat.channel == channel) & (HourlyStat.hour >= since))}
+    return {
+        "messages": total.messages if total else 0,
+        "since": total.first_seen if total else None,
+        "top": [(t.nick, t.messages) for t in talkers],
+        "hourly": [buckets.get(since + datetime.timedelta(hours=i), 0) for i in range(hours)],
+    }
+
+def nick_summary(channel: str, nick: str) -> dict:
+    """A nick's counts in a channel, with its rank by messages; None if never seen there."""
+    stat = NickStat.get_or_none((NickStat.channel == channel) & (NickStat.nick_key == nick.lower()))
+    if stat is None:
+        return None
+    total = ChannelStat.get_or_none(ChannelStat.channel == channel)
+    rank = 1 + (NickStat.select()
+                .where((NickStat.channel == channel) & (NickStat.messages > stat.messages)).count())
+    return {
+        "nick": stat.nick,
+        "messages": stat.messages,
+        "share": stat.messages / total.messages if total and total.messages else 0.0,
+        "rank": rank,
+        "first_seen": stat.first_seen,
+        "last_seen": stat.last_seen,
+    }
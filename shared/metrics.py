@@ -0,0 +1,80 @@
+"""
+In-process metrics: counters, gauges and summaries (count/sum/max plus recent values
+for percentiles). Cheap enough to call on hot paths; read with snapshot().
+"""
+import threading
+from collections import defaultdict, deque
+
+SUMMARY_WINDOW = 1024  # recent observations kept per summary for percentiles
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+_summaries: dict[str, "Summary"] = {}
+
+
+class Summary:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, pct: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+def incr(name: str, n: float = 1):
+    with _lock:
+        _counters[name] += n
+
+def gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, value: float):
+    with _lock:
+        s = _summaries.get(name)
+        if s is None:
+            s = _summaries[name] = Summary()
+        s.observe(value)
+
+def snapshot(prefix: str = "") -> dict:
+    with _lock:
+        return {
+            "counters": {k: v for k, v in _counters.items() if k.startswith(prefix)},
+            "gauges": {k: v for k, v in _gauges.items() if k.startswith(prefix)},
+            "summaries": {k: s.as_dict() for k, s in _summaries.items() if k.startswith(prefix)},
+        }
+
+def format_snapshot(prefix: str = "") -> list[str]:
+    """Human-readable lines for IRC replies."""
+    snap = snapshot(prefix)
+    lines = []
+    if snap["counters"]:
+        lines.append(", ".join(f"{k}={v:g}" for k, v in sorted(snap["counters"].items())))
+    if snap["gauges"]:
+        lines.append(", ".join(f"{k}={v:g}" for k, v in sorted(snap["gauges"].items())))
+    for k, s in sorted(snap["summaries"].items()):
+        lines.append(f"{k}: n={s['count']} avg={s['avg']:.3f} p50={s['p50']:.3f} p99={s['p99']:.3f} max={s['max']:.3f}")
+    return lines
@@ -0,0 +1,225 @@
+"""
+tracing.py
+Lightweight request tracing across the bot and the logic server.
+
+The bot starts a trace for a sampled IRC line (TRACE_SAMPLE_RATE of them); the trace
+context travels in the WebSocket messages as a W3C-style "traceparent" string under
+"trace", and each process records spans for the hops it owns. Spans are written as
+Chrome trace events (JSON array format, one event per line) to
+TRACE_DIR/<process>.json, which chrome://tracing and ui.perfetto.dev load directly.
+Timestamps are wall-clock, so both processes' files line up:
+
+    python -m shared.tracing traces/irc_bot.json traces/logic_server.json -o trace.json
+
+merges them into one file. Each trace gets its own track per thread, so concurrent
+requests (and concurrent tool calls within one) never overlap on a track.
+
+Until setup() is called with a non-zero sample rate every hook is a context variable
+lookup and nothing else.
+"""
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+import config
+
+FLUSH_EVERY = 200        # buffered events before a write
+FLUSH_INTERVAL = 1.0     # seconds between writes while events trickle in
+MAX_HELD = 1000          # spans kept open across the outbound queue (see hold)
+MAX_ARG_CHARS = 120
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "args", "tid", "held")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], args: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.args = args
+        self.tid = _lane(trace_id)
+        self.held = False
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self):
+        if _recorder is not None:
+            _recorder.record(self, time.time())
+
+
+class Recorder:
+    """Buffers finished spans and appends them to the process's trace file."""
+    def __init__(self, process: str, directory: str, max_bytes: int):
+        self.process = process
+        self.path = os.path.join(directory, f"{process}.json")
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self.buffer: list[str] = []
+        self.lanes: set[int] = set()
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._event({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": process}})
+
+    def _event(self, event: dict):
+        self.buffer.append(json.dumps(event, separators=(",", ":")) + ",\n")
+
+    def record(self, span: Span, end: float):
+        args = {"trace_id": span.trace_id, "span_id": span.span_id}
+        if span.parent_id:
+            args["parent_id"] = span.parent_id
+        args.update(span.args)
+        with self.lock:
+            if span.tid not in self.lanes:
+                if len(self.lanes) > 10000:
+                    self.lanes.clear()
+                self.lanes.add(span.tid)
+                self._event({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": span.tid,
+                             "args": {"name": f"trace {span.trace_id[:8]} {threading.current_thread().name}"}})
+            self._event({
+                "name": span.name, "cat": self.process, "ph": "X", "pid": self.pid, "tid": span.tid,
+                "ts": int(span.start * 1e6), "dur": max(1, int((end - span.start) * 1e6)), "args": args,
+            })
+            if len(self.buffer) >= FLUSH_EVERY or time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            new = not os.path.exists(self.path)
+            with open(self.path, "a") as f:
+                if new:
+                    f.write("[\n")
+                f.writelines(self.buffer)
+        except OSError as e:
+            print(f"[tracing] Could not write {self.path}: {e}", file=sys.stderr)
+        self.buffer.clear()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+_recorder: Optional[Recorder] = None
+_CURRENT: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+_NOOP = nullcontext()
+_held: dict[str, Span] = {}
+
+
+def _lane(trace_id: str) -> int:
+    return zlib.crc32(f"{trace_id}:{threading.get_ident()}".encode()) & 0x7FFFFFFF
+
+def _clean_args(args: dict) -> dict:
+    return {k: v[:MAX_ARG_CHARS] if isinstance(v, str) else v for k, v in args.items()}
+
+def setup(process: str):
+    """Start recording spans for this process if TRACE_SAMPLE_RATE is set."""
+    global _recorder
+    if config.TRACE_SAMPLE_RATE > 0 and _recorder is None:
+        _recorder = Recorder(process, config.TRACE_DIR, config.TRACE_MAX_BYTES)
+
+def close():
+    if _recorder is not None:
+        _recorder.flush()
+
+def active() -> bool:
+    """True inside a sampled trace."""
+    return _CURRENT.get() is not None
+
+def traceparent() -> Optional[str]:
+    span = _CURRENT.get()
+    return span.traceparent if span is not None else None
+
+@contextmanager
+def _run(span: Span):
+    token = _CURRENT.set(span)
+    try:
+        yield span
+    finally:
+        _CURRENT.reset(token)
+        if not span.held:
+            span.end()
+
+def start_trace(name: str, **args):
+    """Root span for a new request, if this one is sampled."""
+    if _recorder is None or random.random() >= config.TRACE_SAMPLE_RATE:
+        return _NOOP
+    return _run(Span(name, f"{random.getrandbits(128):032x}", None, _clean_args(args)))
+
+def continue_trace(parent: Optional[str], name: str, **args):
+    """Span for a hop of a trace started elsewhere (parent is the received traceparent)."""
+    if _recorder is None or not parent:
+        return _NOOP
+    try:
+        _, trace_id, parent_id, flags = parent.split("-")
+    except ValueError:
+        return _NOOP
+    if flags != "01":
+        return _NOOP
+    return _run(Span(name, trace_id, parent_id, _clean_args(args)))
+
+def span(name: str, **args):
+    """Child of the current span; a no-op outside a sampled trace."""
+    parent = _CURRENT.get()
+    if parent is None:
+        return _NOOP
+    return _run(Span(name, parent.trace_id, parent.span_id, _clean_args(args)))
+
+def hold() -> Optional[str]:
+    """
+    Keep the current span open past its with-block until release() is called with
+    the returned traceparent, e.g. until a queued message is actually sent.
+    """
+    span = _CURRENT.get()
+    if span is None:
+        return None
+    if not span.held:
+        span.held = True
+        while len(_held) >= MAX_HELD:
+            _held.pop(next(iter(_held))).end()
+        _held[span.traceparent] = span
+    return span.traceparent
+
+def release(parent: Optional[str]):
+    span = _held.pop(parent, None) if parent else None
+    if span is not None:
+        span.end()
+
+
+def _load_events(path: str) -> list:
+    """Events from a trace file, tolerating the open-ended array the recorder writes."""
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith("{"):
+        return json.loads(text).get("traceEvents", [])
+    return json.loads(text.rstrip("]").rstrip().rstrip(",") + "]") if text else []
+
+def main(argv: list[str]):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m shared.tracing", description="Merge trace files into one")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-o", "--output", default="trace.json")
+    args = parser.parse_args(argv)
+    events = []
+    for path in args.files:
+        events.extend(_load_events(path))
+    with open(args.output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"Wrote {len(events)} events to {args.output}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])